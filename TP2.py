@@ -1,21 +1,86 @@
+import argparse
+import asyncio
+import base64
+import bisect
+import builtins
+import concurrent.futures
+import contextlib
+import csv
+import gzip
+import heapq
+import io
+import itertools
+import json
+import os
+import queue
+import random
+import re
+import resource
+import signal
+import socket
 import sqlite3
+import sys
+import threading
+import time
+import urllib.parse
+import weakref
+from array import array
+
 import texttable as TT
 
+try:
+    import numpy as np                # optionnel : analyse de capacité
+except ImportError:
+    np = None
+try:
+    import zstandard as zstd          # optionnel : export .zst
+except ImportError:
+    zstd = None
+try:
+    import yaml                       # optionnel : scripts d'opérations .yaml
+except ImportError:
+    yaml = None
+
 DB = "IoT.db"
 
 # ------------------ Petites utilitaires (simples) ------------------
 
-def draw_query(cur, sql, params=()):
-    """Exécute un SELECT et affiche le résultat avec texttable."""
-    res = cur.execute(sql, params)
-    tbl = TT.Texttable()
-    headers = [d[0] for d in res.description]
-    tbl.add_rows([headers])
-    for row in res:
-        tbl.add_row(row)
+PAGE_SIZE = 50        # lignes lues / affichées par page
+MAX_COL_WIDTH = 40    # au-delà, texttable replie la cellule
+
+def col_widths(headers, sample):
+    """Largeurs fixes calculées sur un échantillon (la 1re page)."""
+    widths = [len(str(h)) for h in headers]
+    for row in sample:
+        for i, v in enumerate(row):
+            widths[i] = max(widths[i], len(str(v)))
+    return [min(max(w, 1), MAX_COL_WIDTH) for w in widths]
+
+def draw_page(headers, rows, widths):
+    tbl = TT.Texttable(max_width=0)
+    tbl.set_cols_width(widths)
+    tbl.set_cols_dtype(["t"] * len(headers))   # str(v), cohérent avec col_widths
     tbl.set_header_align(["c"] * len(headers))
     tbl.set_cols_align(["c"] * len(headers))
-    print(tbl.draw())
+    tbl.add_rows([headers] + [list(r) for r in rows])
+    return tbl.draw()
+
+def draw_query(cur, sql, params=(), page_size=PAGE_SIZE, pause=False):
+    """Exécute un SELECT et affiche le résultat page par page (fetchmany) :
+    la mémoire ne dépend que de la taille de page."""
+    res = cur.execute(sql, params)
+    headers = [d[0] for d in res.description]
+    rows = res.fetchmany(page_size)
+    if not rows:
+        print(draw_page(headers, [], col_widths(headers, []))); return
+    widths = col_widths(headers, rows)
+    n = 0
+    while rows:
+        print(draw_page(headers, rows, widths))
+        n += len(rows)
+        rows = res.fetchmany(page_size)
+        if rows and pause and input_txt(f"-- {n} lignes. Entrée = suite, q = arrêter : ").lower() == "q":
+            break
 
 def input_int(msg):
     while True:
@@ -31,221 +96,1236 @@ def input_txt(msg, default=None):
         return default
     return s
 
+def input_ids(msg):
+    while True:
+        s = input(msg).replace(";", ",")
+        try:
+            return [int(x) for x in s.split(",") if x.strip()]
+        except ValueError:
+            print("=> Entrez des entiers séparés par des virgules.")
+
 def table_exists(cur, name):
     return cur.execute(
         "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
         (name,)
     ).fetchone() is not None
 
-def list_and_choose(cur, sql_list, prompt="ID"):
-    """Affiche (ID, Label) et renvoie l'ID choisi, ou None si vide."""
-    rows = cur.execute(sql_list).fetchall()
-    if not rows:
+# Sélecteur : table -> (clé, nom, contexte affiché, en-tête du contexte).
+PICKERS = {
+    "BATIMENT": ("NUM_BATIMENT", "NOM_BATIMENT", None, None),
+    "SALLE": ("NUM_SALLE", "NOM_SALLE",
+              "(SELECT NOM_BATIMENT FROM BATIMENT B WHERE B.NUM_BATIMENT = X.NUM_BATIMENT)", "Bâtiment"),
+    "GATEWAY": ("NUM_GATEWAY", "NOM_GATEWAY",
+                "(SELECT NOM_SALLE FROM SALLE S WHERE S.NUM_SALLE = X.NUM_SALLE)", "Salle"),
+    "CAPTEUR": ("NUM_CAPTEUR", "NOM_CAPTEUR",
+                "(SELECT NOM_GATEWAY FROM GATEWAY G WHERE G.NUM_GATEWAY = X.NUM_GATEWAY)", "Gateway"),
+    "SERVEUR": ("NUM_SERVEUR", "ADRESSE_IP", None, None),
+    "TYPE": ("NUM_TYPE", "NOM_TYPE", "X.UNITE", "Unité"),
+    "RESEAU": ("NUM_RESEAU", "TYPE_RESEAU", "X.DEBIT_RESEAU", "Débit"),
+    "APPLICATION": ("NUM_APPLICATION", "NOM_APPLICATION", None, None),
+}
+
+def fts_query(table, term):
+    """Chaque mot saisi devient un préfixe : « sal 12 » -> "sal"* "12"*."""
+    words = re.findall(r"[\w.\-]+", term)
+    if not words:
+        return None
+    return f"TBL : {table} AND NOM : (" + " ".join(f'"{w}"*' for w in words) + ")"
+
+def picker_page(cur, table, term="", after=None, limit=PAGE_SIZE):
+    """Une page de (ID, nom[, contexte]) correspondant à `term`, triée par nom.
+    FTS5 (début de n'importe quel mot, sans casse) pour les tables indexées,
+    sinon plage sur l'index du nom (début du nom, casse comprise).
+    Renvoie (lignes, clé de reprise)."""
+    key, name, ctx, _ = PICKERS[table]
+    cols = f"X.{key}, X.{name}" + (f", {ctx}" if ctx else "")
+    q = fts_query(table, term) if term and table in SEARCH and table_exists(cur, "RECHERCHE") else None
+    if q:
+        sort = ("R.NOM", "R.rowid")
+        src = f"RECHERCHE R JOIN {table} X ON X.{key} = R.rowid >> 3"
+        where, params = ["RECHERCHE MATCH :q"], {"q": q}
+    else:
+        sort = (f"X.{name}", f"X.{key}")
+        src, where, params = f"{table} X", [], {}
+        if term:
+            where.append(f"X.{name} >= :lo AND X.{name} < :hi")
+            params.update(lo=term, hi=term + "\U0010ffff")
+    if after:
+        where.append(f"({sort[0]}, {sort[1]}) > (:n, :k)")
+        params.update(n=after[0], k=after[1])
+    params["lim"] = limit
+    rows = cur.execute(f"SELECT {cols}, {sort[0]}, {sort[1]} FROM {src}"
+                       + (" WHERE " + " AND ".join(where) if where else "")
+                       + f" ORDER BY {sort[0]}, {sort[1]} LIMIT :lim", params).fetchall()
+    last = tuple(rows[-1][-2:]) if rows else None
+    return [r[:-2] for r in rows], last
+
+def lookup_id(cur, table, s):
+    """ID saisi (« 12 » ou « #12 ») vérifié par la clé primaire, sinon None."""
+    s = s.strip().lstrip("#")
+    if not s.isdigit():
+        return None
+    key = PICKERS[table][0]
+    row = cur.execute(f"SELECT {key} FROM {table} WHERE {key} = ?", (int(s),)).fetchone()
+    return row[0] if row else None
+
+def choose(cur, table):
+    """Renvoie l'ID choisi dans `table`, ou None (table vide / abandon).
+    Petite table : liste directe. Sinon recherche par nom, page par page ;
+    « #ID » choisit directement. Rien n'est chargé au-delà d'une page."""
+    key, _, ctx, ctx_head = PICKERS[table]
+    n = cur.execute(f"SELECT count(*) FROM (SELECT 1 FROM {table} LIMIT ?)", (PAGE_SIZE + 1,)).fetchone()[0]
+    if not n:
         print("(Aucune donnée)")
         return None
-    t = TT.Texttable()
-    t.add_rows([["ID", "Label"]] + [list(r) for r in rows])
-    t.set_header_align(["c", "c"]); t.set_cols_align(["c", "c"])
-    print(t.draw())
-    ids = {r[0] for r in rows}
+    big = n > PAGE_SIZE
+    headers = ["ID", "Nom"] + ([ctx_head] if ctx else [])
     while True:
-        rid = input_int(f"Saisir {prompt} : ")
-        if rid in ids:
-            return rid
-        print("=> ID invalide.")
+        term = ""
+        if big:
+            term = input_txt(f"Rechercher {table.lower()} (début du nom, #ID ; vide = tout ; q = annuler) : ")
+            if term == "q":
+                return None
+            if term.startswith("#"):
+                rid = lookup_id(cur, table, term)
+                if rid is not None:
+                    return rid
+                print("=> ID invalide.")
+                continue
+        after, s = None, ""
+        while s != "/":
+            rows, after = picker_page(cur, table, term, after)
+            if rows:
+                print(draw_page(headers, rows, col_widths(headers, rows)))
+            else:
+                print("(Aucune correspondance)")
+            more = len(rows) == PAGE_SIZE
+            hint = ", ".join((["Entrée = suite"] if more else []) + (["/ = autre recherche"] if big else [])
+                             + ["q = annuler"])
+            while True:
+                s = input_txt(f"Saisir {key} ({hint}) : ")
+                if s == "q":
+                    return None
+                if (s == "" and more) or (s == "/" and big):
+                    break
+                rid = lookup_id(cur, table, s)
+                if rid is not None:
+                    return rid
+                print("=> ID invalide.")
+
+def column_names(cur, table):
+    return [r[1] for r in cur.execute(f'PRAGMA table_info("{table}")')]
+
+# ------------------ Schéma & migrations ------------------
+
+# Tables de base (mêmes noms que la base livrée IoT.db).
+TABLES = {
+    "BATIMENT": """
+        CREATE TABLE IF NOT EXISTS BATIMENT (
+        NUM_BATIMENT         INTEGER primary key autoincrement,
+        NOM_BATIMENT         CHAR(50)             not null
+        )""",
+    "SALLE": """
+        CREATE TABLE IF NOT EXISTS SALLE (
+        NUM_SALLE            INTEGER primary key autoincrement,
+        NUM_BATIMENT         INTEGER              not null,
+        NOM_SALLE            CHAR(50)             not null,
+        foreign key (NUM_BATIMENT)
+              references BATIMENT (NUM_BATIMENT)
+        )""",
+    "SERVEUR": """
+        CREATE TABLE IF NOT EXISTS SERVEUR (
+        NUM_SERVEUR          INTEGER primary key autoincrement,
+        ADRESSE_IP           CHAR(15)             not null
+        )""",
+    "APPLICATION": """
+        CREATE TABLE IF NOT EXISTS APPLICATION (
+        NUM_APPLICATION      INTEGER primary key autoincrement,
+        NOM_APPLICATION      CHAR(50)             not null
+        )""",
+    "APP_SRV_CONNEXION": """
+        CREATE TABLE IF NOT EXISTS APP_SRV_CONNEXION (
+        NUM_APPLICATION      INTEGER              not null,
+        NUM_SERVEUR          INTEGER              not null,
+        primary key (NUM_APPLICATION, NUM_SERVEUR),
+        foreign key (NUM_APPLICATION)
+              references APPLICATION (NUM_APPLICATION),
+        foreign key (NUM_SERVEUR)
+              references SERVEUR (NUM_SERVEUR)
+        )""",
+    "GATEWAY": """
+        CREATE TABLE IF NOT EXISTS GATEWAY (
+        NUM_GATEWAY          INTEGER primary key autoincrement,
+        NUM_SERVEUR          INTEGER              not null,
+        NUM_SALLE            INTEGER              not null,
+        NOM_GATEWAY          CHAR(50)             not null,
+        foreign key (NUM_SERVEUR)
+              references SERVEUR (NUM_SERVEUR),
+        foreign key (NUM_SALLE)
+              references SALLE (NUM_SALLE)
+        )""",
+    "TYPE": """
+        CREATE TABLE IF NOT EXISTS TYPE (
+        NUM_TYPE             INTEGER primary key autoincrement,
+        NOM_TYPE             CHAR(50)             not null,
+        UNITE                CHAR(10)             not null
+        )""",
+    "RESEAU": """
+        CREATE TABLE IF NOT EXISTS RESEAU (
+        NUM_RESEAU           INTEGER primary key autoincrement,
+        TYPE_RESEAU          CHAR(50)             not null,
+        DEBIT_RESEAU         INTEGER              not null
+        )""",
+    "CAPTEUR": """
+        CREATE TABLE IF NOT EXISTS CAPTEUR (
+        NUM_CAPTEUR          INTEGER primary key autoincrement,
+        NUM_SALLE            INTEGER              not null,
+        NUM_GATEWAY          INTEGER              not null,
+        NUM_TYPE             INTEGER              not null,
+        NUM_RESEAU           INTEGER              not null,
+        NOM_CAPTEUR          CHAR(50)             not null,
+        foreign key (NUM_SALLE)
+              references SALLE (NUM_SALLE),
+        foreign key (NUM_GATEWAY)
+              references GATEWAY (NUM_GATEWAY),
+        foreign key (NUM_TYPE)
+              references TYPE (NUM_TYPE),
+        foreign key (NUM_RESEAU)
+              references RESEAU (NUM_RESEAU)
+        )""",
+}
+
+# Un index par clé étrangère (cascades) et par ORDER BY des menus.
+# La colonne de nom en 2e position évite le tri après le filtrage.
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS IDX_BATIMENT_NOM ON BATIMENT(NOM_BATIMENT)",
+    "CREATE INDEX IF NOT EXISTS IDX_SALLE_BATIMENT ON SALLE(NUM_BATIMENT, NOM_SALLE)",
+    "CREATE INDEX IF NOT EXISTS IDX_SALLE_NOM ON SALLE(NOM_SALLE)",
+    "CREATE INDEX IF NOT EXISTS IDX_SERVEUR_IP ON SERVEUR(ADRESSE_IP)",
+    "CREATE INDEX IF NOT EXISTS IDX_APPLICATION_NOM ON APPLICATION(NOM_APPLICATION)",
+    "CREATE INDEX IF NOT EXISTS IDX_CONNEXION_SERVEUR ON APP_SRV_CONNEXION(NUM_SERVEUR, NUM_APPLICATION)",
+    "CREATE INDEX IF NOT EXISTS IDX_GATEWAY_SALLE ON GATEWAY(NUM_SALLE, NOM_GATEWAY)",
+    "CREATE INDEX IF NOT EXISTS IDX_GATEWAY_SERVEUR ON GATEWAY(NUM_SERVEUR, NOM_GATEWAY)",
+    "CREATE INDEX IF NOT EXISTS IDX_GATEWAY_NOM ON GATEWAY(NOM_GATEWAY)",
+    "CREATE INDEX IF NOT EXISTS IDX_TYPE_NOM ON TYPE(NOM_TYPE)",
+    "CREATE INDEX IF NOT EXISTS IDX_RESEAU_TYPE ON RESEAU(TYPE_RESEAU)",
+    "CREATE INDEX IF NOT EXISTS IDX_CAPTEUR_GATEWAY ON CAPTEUR(NUM_GATEWAY, NOM_CAPTEUR)",
+    "CREATE INDEX IF NOT EXISTS IDX_CAPTEUR_SALLE ON CAPTEUR(NUM_SALLE, NOM_CAPTEUR)",
+    "CREATE INDEX IF NOT EXISTS IDX_CAPTEUR_TYPE ON CAPTEUR(NUM_TYPE)",
+    "CREATE INDEX IF NOT EXISTS IDX_CAPTEUR_RESEAU ON CAPTEUR(NUM_RESEAU)",
+    "CREATE INDEX IF NOT EXISTS IDX_CAPTEUR_NOM ON CAPTEUR(NOM_CAPTEUR)",
+]
+
+def _migration_1(cur):
+    """Noms alignés sur IoT.db, tables manquantes créées, index ajoutés."""
+    # anciennes versions du script : APPLICATION(NUM_APP, NOM_APP) + CONNEXION
+    if table_exists(cur, "APPLICATION"):
+        cols = column_names(cur, "APPLICATION")
+        if "NUM_APP" in cols:
+            cur.execute("ALTER TABLE APPLICATION RENAME COLUMN NUM_APP TO NUM_APPLICATION")
+        if "NOM_APP" in cols:
+            cur.execute("ALTER TABLE APPLICATION RENAME COLUMN NOM_APP TO NOM_APPLICATION")
+    if table_exists(cur, "CONNEXION"):
+        if "NUM_APP" in column_names(cur, "CONNEXION"):
+            cur.execute("ALTER TABLE CONNEXION RENAME COLUMN NUM_APP TO NUM_APPLICATION")
+        if table_exists(cur, "APP_SRV_CONNEXION"):
+            cur.execute("""INSERT OR IGNORE INTO APP_SRV_CONNEXION(NUM_APPLICATION, NUM_SERVEUR)
+                           SELECT NUM_APPLICATION, NUM_SERVEUR FROM CONNEXION""")
+            cur.execute("DROP TABLE CONNEXION")
+        else:
+            cur.execute("ALTER TABLE CONNEXION RENAME TO APP_SRV_CONNEXION")
+    for ddl in TABLES.values():
+        cur.execute(ddl)
+    for ddl in INDEXES:
+        cur.execute(ddl)
+
+# Tables dont la clé est allouée par SQLite (AUTOINCREMENT + sqlite_sequence).
+AUTO_ID = {"BATIMENT": "NUM_BATIMENT", "SALLE": "NUM_SALLE", "SERVEUR": "NUM_SERVEUR",
+           "APPLICATION": "NUM_APPLICATION", "GATEWAY": "NUM_GATEWAY", "TYPE": "NUM_TYPE",
+           "RESEAU": "NUM_RESEAU", "CAPTEUR": "NUM_CAPTEUR"}
+
+def _migration_2(cur):
+    """Clés en AUTOINCREMENT : reconstruction des tables (procédure SQLite
+    create / copy / drop / rename, foreign_keys désactivé par défaut)."""
+    for table in AUTO_ID:
+        sql = cur.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?",
+                          (table,)).fetchone()[0]
+        if "autoincrement" in sql.lower():
+            continue
+        cols = ", ".join(column_names(cur, table))
+        cur.execute(TABLES[table].replace(f"IF NOT EXISTS {table} (", f"{table}_NEW ("))
+        cur.execute(f"INSERT INTO {table}_NEW({cols}) SELECT {cols} FROM {table}")
+        cur.execute(f"DROP TABLE {table}")
+        cur.execute(f"ALTER TABLE {table}_NEW RENAME TO {table}")
+    for ddl in INDEXES:
+        cur.execute(ddl)
+
+# Relevés des capteurs : HORODATAGE en millisecondes depuis l'époque Unix.
+# WITHOUT ROWID : la clé (capteur, instant) est la table elle-même.
+MESURE_DDL = """
+    CREATE TABLE IF NOT EXISTS MESURE (
+    NUM_CAPTEUR          INTEGER              not null,
+    HORODATAGE           INTEGER              not null,
+    VALEUR               REAL                 not null,
+    primary key (NUM_CAPTEUR, HORODATAGE)
+    ) WITHOUT ROWID"""
+
+def _migration_3(cur):
+    cur.execute(MESURE_DDL)
+    cur.execute("CREATE INDEX IF NOT EXISTS IDX_MESURE_HORODATAGE ON MESURE(HORODATAGE)")
+
+# Agrégats (min / max / somme / nombre) par résolution, tenus à jour à
+# l'ingestion. Salle et bâtiment sont ventilés par TYPE (une unité chacun).
+AGREGAT_DDL = [
+    """CREATE TABLE IF NOT EXISTS AGREGAT_CAPTEUR (
+    NUM_CAPTEUR INTEGER not null, RESOLUTION INTEGER not null, DEBUT INTEGER not null,
+    NB INTEGER not null, SOMME REAL not null, MINI REAL not null, MAXI REAL not null,
+    primary key (NUM_CAPTEUR, RESOLUTION, DEBUT)
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS AGREGAT_SALLE (
+    NUM_SALLE INTEGER not null, NUM_TYPE INTEGER not null, RESOLUTION INTEGER not null,
+    DEBUT INTEGER not null,
+    NB INTEGER not null, SOMME REAL not null, MINI REAL not null, MAXI REAL not null,
+    primary key (NUM_SALLE, NUM_TYPE, RESOLUTION, DEBUT)
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS AGREGAT_BATIMENT (
+    NUM_BATIMENT INTEGER not null, NUM_TYPE INTEGER not null, RESOLUTION INTEGER not null,
+    DEBUT INTEGER not null,
+    NB INTEGER not null, SOMME REAL not null, MINI REAL not null, MAXI REAL not null,
+    primary key (NUM_BATIMENT, NUM_TYPE, RESOLUTION, DEBUT)
+    ) WITHOUT ROWID""",
+    "CREATE INDEX IF NOT EXISTS IDX_AGREGAT_CAPTEUR_DEBUT ON AGREGAT_CAPTEUR(RESOLUTION, DEBUT)",
+    "CREATE INDEX IF NOT EXISTS IDX_AGREGAT_SALLE_DEBUT ON AGREGAT_SALLE(RESOLUTION, DEBUT)",
+    "CREATE INDEX IF NOT EXISTS IDX_AGREGAT_BATIMENT_DEBUT ON AGREGAT_BATIMENT(RESOLUTION, DEBUT)",
+]
+
+def _migration_4(cur):
+    for ddl in AGREGAT_DDL:
+        cur.execute(ddl)
+
+# Index plein texte des noms (sélecteur d'entités). rowid = ID * 8 + rang de
+# la table : une seule table FTS5, mise à jour / suppression par rowid.
+SEARCH = {   # table -> (rang, clé, colonne cherchée)
+    "BATIMENT": (1, "NUM_BATIMENT", "NOM_BATIMENT"),
+    "SALLE": (2, "NUM_SALLE", "NOM_SALLE"),
+    "GATEWAY": (3, "NUM_GATEWAY", "NOM_GATEWAY"),
+    "CAPTEUR": (4, "NUM_CAPTEUR", "NOM_CAPTEUR"),
+    "SERVEUR": (5, "NUM_SERVEUR", "ADRESSE_IP"),
+}
+RECHERCHE_DDL = """CREATE VIRTUAL TABLE IF NOT EXISTS RECHERCHE USING fts5(
+    TBL, NOM, tokenize = "unicode61 tokenchars '.-_'", prefix = '1 2 3')"""
+
+def search_triggers(table):
+    tag, key, col = SEARCH[table]
+    rid = f"{key} * 8 + {tag}"
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS TRG_RECHERCHE_{table}_INS AFTER INSERT ON {table} BEGIN
+            INSERT INTO RECHERCHE(rowid, TBL, NOM) VALUES (NEW.{rid}, '{table}', NEW.{col}); END""",
+        f"""CREATE TRIGGER IF NOT EXISTS TRG_RECHERCHE_{table}_UPD AFTER UPDATE OF {col} ON {table} BEGIN
+            UPDATE RECHERCHE SET NOM = NEW.{col} WHERE rowid = NEW.{rid}; END""",
+        f"""CREATE TRIGGER IF NOT EXISTS TRG_RECHERCHE_{table}_DEL AFTER DELETE ON {table} BEGIN
+            DELETE FROM RECHERCHE WHERE rowid = OLD.{rid}; END""",
+    ]
+
+def rebuild_search(cur):
+    cur.execute("DELETE FROM RECHERCHE")
+    for table, (tag, key, col) in SEARCH.items():
+        cur.execute(f"INSERT INTO RECHERCHE(rowid, TBL, NOM) SELECT {key} * 8 + {tag}, '{table}', {col} FROM {table}")
+
+def _migration_5(cur):
+    try:
+        cur.execute(RECHERCHE_DDL)
+    except sqlite3.OperationalError:
+        return          # SQLite sans FTS5 : le sélecteur cherchera par index (préfixe)
+    for table in SEARCH:
+        for ddl in search_triggers(table):
+            cur.execute(ddl)
+    rebuild_search(cur)
+
+# Inventaire des capteurs (la jointure de show_capteurs), matérialisé et
+# tenu à jour par triggers. Les clés primaires ne changent jamais
+# (AUTOINCREMENT) : seuls les noms et les liens sont suivis. Les NUM_* sont
+# pris côté clé étrangère, pour retrouver les lignes même parent absent.
+INVENTAIRE_COLS = ["NUM_CAPTEUR", "NOM_CAPTEUR", "NUM_TYPE", "NOM_TYPE", "UNITE",
+                   "NUM_SALLE", "NOM_SALLE", "NUM_BATIMENT", "NOM_BATIMENT",
+                   "NUM_RESEAU", "TYPE_RESEAU", "NUM_GATEWAY", "NOM_GATEWAY",
+                   "NUM_SERVEUR", "ADRESSE_IP"]
+INVENTAIRE_SELECT = """
+    SELECT C.NUM_CAPTEUR, C.NOM_CAPTEUR, C.NUM_TYPE, T.NOM_TYPE, T.UNITE,
+           C.NUM_SALLE, S.NOM_SALLE, S.NUM_BATIMENT, B.NOM_BATIMENT,
+           C.NUM_RESEAU, R.TYPE_RESEAU, C.NUM_GATEWAY, G.NOM_GATEWAY,
+           G.NUM_SERVEUR, SV.ADRESSE_IP
+    FROM CAPTEUR C
+    JOIN TYPE T     ON T.NUM_TYPE = C.NUM_TYPE
+    JOIN SALLE S    ON S.NUM_SALLE = C.NUM_SALLE
+    JOIN BATIMENT B ON B.NUM_BATIMENT = S.NUM_BATIMENT
+    JOIN RESEAU R   ON R.NUM_RESEAU = C.NUM_RESEAU
+    LEFT JOIN GATEWAY G ON G.NUM_GATEWAY = C.NUM_GATEWAY
+    LEFT JOIN SERVEUR SV ON SV.NUM_SERVEUR = G.NUM_SERVEUR"""
+# Colonnes typées : sans affinité, « NUM_X = OLD.NUM_X » dans un trigger
+# convertirait la colonne et n'utiliserait plus l'index (parcours complet).
+INVENTAIRE_DDL = [
+    "CREATE TABLE IF NOT EXISTS INVENTAIRE (" + ", ".join(
+        c + (" INTEGER primary key" if c == "NUM_CAPTEUR" else
+             " INTEGER" if c.startswith("NUM_") else " TEXT") for c in INVENTAIRE_COLS) + ")",
+    "CREATE INDEX IF NOT EXISTS IDX_INVENTAIRE_ORDRE ON INVENTAIRE(NOM_BATIMENT, NOM_SALLE, NOM_CAPTEUR)",
+    "CREATE INDEX IF NOT EXISTS IDX_INVENTAIRE_BATIMENT ON INVENTAIRE(NUM_BATIMENT, NOM_SALLE, NOM_CAPTEUR)",
+    "CREATE INDEX IF NOT EXISTS IDX_INVENTAIRE_GATEWAY ON INVENTAIRE(NUM_GATEWAY, NOM_CAPTEUR)",
+    "CREATE INDEX IF NOT EXISTS IDX_INVENTAIRE_RESEAU ON INVENTAIRE(NUM_RESEAU, NOM_CAPTEUR)",
+    "CREATE INDEX IF NOT EXISTS IDX_INVENTAIRE_SALLE ON INVENTAIRE(NUM_SALLE)",
+    "CREATE INDEX IF NOT EXISTS IDX_INVENTAIRE_TYPE ON INVENTAIRE(NUM_TYPE)",
+    "CREATE INDEX IF NOT EXISTS IDX_INVENTAIRE_SERVEUR ON INVENTAIRE(NUM_SERVEUR)",
+]
+# table source -> (clé, filtre de la jointure, colonnes de nom, colonnes de lien)
+INVENTAIRE_SOURCES = {
+    "TYPE": ("NUM_TYPE", "C.NUM_TYPE", ["NOM_TYPE", "UNITE"], []),
+    "RESEAU": ("NUM_RESEAU", "C.NUM_RESEAU", ["TYPE_RESEAU"], []),
+    "SALLE": ("NUM_SALLE", "C.NUM_SALLE", ["NOM_SALLE"], ["NUM_BATIMENT"]),
+    "BATIMENT": ("NUM_BATIMENT", "S.NUM_BATIMENT", ["NOM_BATIMENT"], []),
+    "GATEWAY": ("NUM_GATEWAY", "C.NUM_GATEWAY", ["NOM_GATEWAY"], ["NUM_SERVEUR"]),
+    "SERVEUR": ("NUM_SERVEUR", "G.NUM_SERVEUR", ["ADRESSE_IP"], []),
+}
+
+def inventaire_triggers():
+    """Capteur : sa ligne est recalculée. Parent : renommage = UPDATE en
+    place ; insertion / suppression / nouveau lien = lignes concernées
+    recalculées depuis la jointure (via les index de clés étrangères)."""
+    ddl = [
+        f"""CREATE TRIGGER IF NOT EXISTS TRG_INVENTAIRE_CAPTEUR_INS AFTER INSERT ON CAPTEUR BEGIN
+            INSERT INTO INVENTAIRE {INVENTAIRE_SELECT} WHERE C.NUM_CAPTEUR = NEW.NUM_CAPTEUR; END""",
+        f"""CREATE TRIGGER IF NOT EXISTS TRG_INVENTAIRE_CAPTEUR_UPD AFTER UPDATE ON CAPTEUR BEGIN
+            DELETE FROM INVENTAIRE WHERE NUM_CAPTEUR = OLD.NUM_CAPTEUR;
+            INSERT INTO INVENTAIRE {INVENTAIRE_SELECT} WHERE C.NUM_CAPTEUR = NEW.NUM_CAPTEUR; END""",
+        """CREATE TRIGGER IF NOT EXISTS TRG_INVENTAIRE_CAPTEUR_DEL AFTER DELETE ON CAPTEUR BEGIN
+            DELETE FROM INVENTAIRE WHERE NUM_CAPTEUR = OLD.NUM_CAPTEUR; END""",
+    ]
+    for table, (key, filt, names, links) in INVENTAIRE_SOURCES.items():
+        def refresh(ref):
+            return (f"DELETE FROM INVENTAIRE WHERE {key} = {ref}.{key}; "
+                    f"INSERT INTO INVENTAIRE {INVENTAIRE_SELECT} WHERE {filt} = {ref}.{key};")
+        sets = ", ".join(f"{c} = NEW.{c}" for c in names)
+        ddl += [
+            f"""CREATE TRIGGER IF NOT EXISTS TRG_INVENTAIRE_{table}_INS AFTER INSERT ON {table} BEGIN
+                {refresh("NEW")} END""",
+            f"""CREATE TRIGGER IF NOT EXISTS TRG_INVENTAIRE_{table}_DEL AFTER DELETE ON {table} BEGIN
+                {refresh("OLD")} END""",
+            f"""CREATE TRIGGER IF NOT EXISTS TRG_INVENTAIRE_{table}_NOM AFTER UPDATE OF {", ".join(names)}
+                ON {table} BEGIN UPDATE INVENTAIRE SET {sets} WHERE {key} = NEW.{key}; END""",
+        ]
+        if links:
+            ddl.append(f"""CREATE TRIGGER IF NOT EXISTS TRG_INVENTAIRE_{table}_LIEN AFTER UPDATE OF
+                {", ".join(links)} ON {table} BEGIN {refresh("NEW")} END""")
+    return ddl
+
+def rebuild_inventaire(cur):
+    cur.execute("DELETE FROM INVENTAIRE")
+    cur.execute("INSERT INTO INVENTAIRE " + INVENTAIRE_SELECT)
+    return cur.rowcount
+
+def check_inventaire(cur):
+    """Écarts entre INVENTAIRE et la jointure : (manquantes ou périmées,
+    en trop ou périmées) ; (0, 0) si cohérent."""
+    cols = ", ".join(INVENTAIRE_COLS)
+    live = f"SELECT * FROM ({INVENTAIRE_SELECT})"
+    missing = cur.execute(f"SELECT count(*) FROM ({live} EXCEPT SELECT {cols} FROM INVENTAIRE)").fetchone()[0]
+    extra = cur.execute(f"SELECT count(*) FROM (SELECT {cols} FROM INVENTAIRE EXCEPT {live})").fetchone()[0]
+    return missing, extra
+
+def _migration_6(cur):
+    for ddl in INVENTAIRE_DDL + inventaire_triggers():
+        cur.execute(ddl)
+    rebuild_inventaire(cur)
+
+# Journal des changements (CDC) des neuf tables, rempli par triggers. SEQ en
+# AUTOINCREMENT : jamais réutilisé, même après compaction. OP : I / U / D,
+# R = resynchronisation complète (chargement en masse sans triggers).
+# COLONNES : nouvelles valeurs (toutes pour I, les seules modifiées pour U).
+CDC_SEGMENT = 4096             # compaction par segments entiers de SEQ
+CDC_MAX = 1_000_000            # changements conservés au plus, consommateurs en retard ou non
+CDC_BATCH = 1000
+CDC_KEYS = {**{t: [k] for t, k in AUTO_ID.items()},
+            "APP_SRV_CONNEXION": ["NUM_APPLICATION", "NUM_SERVEUR"]}
+CDC_NOW = "CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)"
+CDC_DDL = [
+    """CREATE TABLE IF NOT EXISTS CHANGEMENT (
+    SEQ                  INTEGER primary key autoincrement,
+    TBL                  TEXT                 not null,
+    CLE                  TEXT                 not null,
+    OP                   CHAR(1)              not null,
+    COLONNES             TEXT,
+    HORODATAGE           INTEGER              not null
+    )""",
+    """CREATE TABLE IF NOT EXISTS CONSOMMATEUR (
+    NOM                  TEXT primary key,
+    SEQ                  INTEGER              not null,
+    HORODATAGE           INTEGER              not null
+    )""",
+]
+
+def cdc_compact_sql(seq):
+    """Supprime les segments entiers que tous les consommateurs ont lus, et
+    au-delà de CDC_MAX changements dans tous les cas."""
+    return f"""DELETE FROM CHANGEMENT WHERE SEQ <= (SELECT h - h % {CDC_SEGMENT} FROM
+        (SELECT max({seq} - {CDC_MAX}, coalesce((SELECT min(SEQ) FROM CONSOMMATEUR), 0)) AS h))"""
+
+def cdc_triggers(cur, table):
+    cols = column_names(cur, table)
+    def obj(ref, names):
+        return "json_object(" + ", ".join(f"'{c}', {ref}.{c}" for c in names) + ")"
+    def log(op, ref, colonnes):
+        return (f"INSERT INTO CHANGEMENT(TBL, CLE, OP, COLONNES, HORODATAGE) VALUES "
+                f"('{table}', {obj(ref, CDC_KEYS[table])}, '{op}', {colonnes}, {CDC_NOW});")
+    changed = " UNION ALL ".join(f"SELECT '{c}' AS C, NEW.{c} AS V WHERE NEW.{c} IS NOT OLD.{c}"
+                                 for c in cols)
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS TRG_CDC_{table}_INS AFTER INSERT ON {table} BEGIN
+            {log("I", "NEW", obj("NEW", cols))} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS TRG_CDC_{table}_UPD AFTER UPDATE ON {table}
+            WHEN {" OR ".join(f"NEW.{c} IS NOT OLD.{c}" for c in cols)} BEGIN
+            INSERT INTO CHANGEMENT(TBL, CLE, OP, COLONNES, HORODATAGE)
+            SELECT '{table}', {obj("OLD", CDC_KEYS[table])}, 'U', json_group_object(C, V), {CDC_NOW}
+            FROM ({changed}); END""",
+        f"""CREATE TRIGGER IF NOT EXISTS TRG_CDC_{table}_DEL AFTER DELETE ON {table} BEGIN
+            {log("D", "OLD", "NULL")} END""",
+    ]
+
+def cdc_mark_resync(cur):
+    cur.execute(f"INSERT INTO CHANGEMENT(TBL, CLE, OP, HORODATAGE) VALUES ('*', '{{}}', 'R', {CDC_NOW})")
+
+def last_change(cur):
+    """Dernier SEQ validé (None : base sans journal des changements)."""
+    try:
+        return cur.execute("SELECT max(SEQ) FROM CHANGEMENT").fetchone()[0] or 0
+    except sqlite3.OperationalError:
+        return None
+
+def tail_changes(cur, since=0, batch=CDC_BATCH):
+    """Lots de changements de SEQ > since, dans l'ordre, jusqu'au dernier
+    validé. LookupError si une partie a déjà été compactée : le consommateur
+    doit repartir d'une lecture complète (de même sur un changement « R »)."""
+    first = cur.execute("SELECT min(SEQ) FROM CHANGEMENT").fetchone()[0]
+    if first is not None and since < first - 1:
+        raise LookupError(f"changements {since + 1} à {first - 1} compactés : resynchronisation complète nécessaire")
+    while True:
+        rows = cur.execute("""SELECT SEQ, TBL, CLE, OP, COLONNES, HORODATAGE FROM CHANGEMENT
+                              WHERE SEQ > ? ORDER BY SEQ LIMIT ?""", (since, batch)).fetchall()
+        if not rows:
+            return
+        yield [{"seq": s, "table": t, "cle": json.loads(k), "op": op,
+                "colonnes": json.loads(c) if c is not None else None, "horodatage": h}
+               for s, t, k, op, c, h in rows]
+        since = rows[-1][0]
+
+def consumer_position(cur, name):
+    row = cur.execute("SELECT SEQ FROM CONSOMMATEUR WHERE NOM = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+def ack_changes(cur, name, seq):
+    """Position d'un consommateur : tout SEQ <= seq est traité et compactable."""
+    cur.execute("""INSERT INTO CONSOMMATEUR(NOM, SEQ, HORODATAGE) VALUES (?, ?, ?)
+                   ON CONFLICT(NOM) DO UPDATE SET SEQ = excluded.SEQ, HORODATAGE = excluded.HORODATAGE""",
+                (name, seq, int(time.time() * 1000)))
+
+def compact_changes(cur):
+    cur.execute(cdc_compact_sql("(SELECT max(SEQ) FROM CHANGEMENT)"))
+    return cur.rowcount
+
+def _migration_7(cur):
+    for ddl in CDC_DDL:
+        cur.execute(ddl)
+    for table in TABLES:
+        for ddl in cdc_triggers(cur, table):
+            cur.execute(ddl)
+    cur.execute(f"""CREATE TRIGGER IF NOT EXISTS TRG_CDC_COMPACTION AFTER INSERT ON CHANGEMENT
+                    WHEN NEW.SEQ % {CDC_SEGMENT} = 0 BEGIN {cdc_compact_sql("NEW.SEQ")}; END""")
+
+@contextlib.contextmanager
+def bulk_load(cur):
+    """Chargement en masse (dans une transaction ouverte par l'appelant) :
+    triggers et index retirés pendant le chargement, puis index recréés
+    et tables dérivées (inventaire, recherche) recalculées en une passe.
+    Le journal des changements ne voit pas les lignes chargées : il reçoit
+    un changement « R » (resynchronisation complète) à la place."""
+    triggers = cur.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'").fetchall()
+    for name, _ in triggers:
+        cur.execute(f"DROP TRIGGER {name}")
+    for ddl in INDEXES:
+        cur.execute("DROP INDEX IF EXISTS " + ddl.split(" ON ")[0].split()[-1])
+    yield
+    for ddl in INDEXES:
+        cur.execute(ddl)
+    rebuild_inventaire(cur)
+    if table_exists(cur, "RECHERCHE"):
+        rebuild_search(cur)
+    for _, sql in triggers:
+        cur.execute(sql)
+    if table_exists(cur, "CHANGEMENT"):
+        cdc_mark_resync(cur)
+
+# (version, fonction) : chaque migration fait passer la base à `version`.
+MIGRATIONS = [
+    (1, _migration_1),
+    (2, _migration_2),
+    (3, _migration_3),
+    (4, _migration_4),
+    (5, _migration_5),
+    (6, _migration_6),
+    (7, _migration_7),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def schema_version(cur):
+    return cur.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(db):
+    """Crée / met à jour le schéma. Chaque migration est transactionnelle."""
+    cur = db.cursor()
+    current = schema_version(cur)
+    if current > SCHEMA_VERSION:
+        raise RuntimeError(f"Base en version {current}, script en version {SCHEMA_VERSION}.")
+    pending = [(v, step) for v, step in MIGRATIONS if v > current]
+    for version, step in pending:
+        db.commit()
+        cur.execute("BEGIN")
+        try:
+            step(cur)
+            cur.execute(f"PRAGMA user_version = {version}")
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+    if pending:
+        cur.execute("ANALYZE")   # statistiques pour le planificateur
+        db.commit()
+    return schema_version(cur)
+
+# ------------------ Allocation des identifiants ------------------
+
+# Les insertions unitaires laissent SQLite choisir la clé (NULL -> lastrowid).
+# Les chargements en masse réservent des blocs d'IDs en avançant
+# sqlite_sequence dans une transaction IMMEDIATE : les autres écrivains
+# (autres processus, insertions unitaires) passent au-dessus du bloc.
+ID_BLOCK = 1000
+
+def reserve_ids(db, table, n, dry_run=False):
+    """Réserve n IDs consécutifs pour `table` ; renvoie le premier.
+    dry_run : calcule le premier ID sans rien réserver."""
+    if db.in_transaction:
+        raise RuntimeError("reserve_ids doit être appelé hors transaction")
+    key = AUTO_ID[table]
+    cur = db.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        row = cur.execute("SELECT seq FROM sqlite_sequence WHERE name=?", (table,)).fetchone()
+        if row:     # seq >= plus grand ID déjà inséré (garanti par AUTOINCREMENT)
+            first = row[0] + 1
+        else:
+            first = (cur.execute(f"SELECT MAX({key}) FROM {table}").fetchone()[0] or 0) + 1
+        if row:
+            cur.execute("UPDATE sqlite_sequence SET seq=? WHERE name=?", (first + n - 1, table))
+        else:
+            cur.execute("INSERT INTO sqlite_sequence(name, seq) VALUES (?,?)", (table, first + n - 1))
+        cur.execute("ROLLBACK" if dry_run else "COMMIT")
+    except Exception:
+        cur.execute("ROLLBACK")
+        raise
+    return first
+
+class IdAllocator:
+    """Distribue des IDs par blocs réservés (un aller-retour pour `block` IDs)."""
+
+    def __init__(self, db, block=ID_BLOCK):
+        self.db, self.block = db, block
+        self.ranges = {}      # table -> [prochain, fin exclue]
+
+    def next(self, table):
+        r = self.ranges.get(table)
+        if r is None or r[0] >= r[1]:
+            first = reserve_ids(self.db, table, self.block)
+            r = self.ranges[table] = [first, first + self.block]
+        nid = r[0]
+        r[0] += 1
+        return nid
+
+    def release(self):
+        """Rend la fin inutilisée des blocs (hors transaction), sauf si un
+        autre écrivain a réservé ou inséré au-dessus entre-temps."""
+        if not self.ranges:
+            return
+        cur = self.db.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            for table, (nxt, end) in self.ranges.items():
+                cur.execute("UPDATE sqlite_sequence SET seq=? WHERE name=? AND seq=?", (nxt - 1, table, end - 1))
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+        self.ranges.clear()
+
+# ------------------ Cache de topologie ------------------
+
+def _csr(pairs, n):
+    """Listes d'enfants compactes (CSR) à partir de couples (parent, enfant) :
+    enfants de p = children[offsets[p]:offsets[p+1]], dans l'ordre des couples."""
+    offsets = array("l", [0]) * (n + 1)
+    for p, _ in pairs:
+        offsets[p + 1] += 1
+    for i in range(n):
+        offsets[i + 1] += offsets[i]
+    children = array("l", [0]) * offsets[n]
+    pos = offsets[:n]
+    for p, c in pairs:
+        children[pos[p]] = c
+        pos[p] += 1
+    return offsets, children
+
+class TopologyGraph:
+    """Application → Serveur → Gateway → Capteur en tableaux indexés.
+    Une lecture par table, sans jointure ; une question sur une
+    sous-arborescence ne parcourt que cette sous-arborescence."""
+
+    def __init__(self, cur):
+        def load(sql):
+            rows = cur.execute(sql).fetchall()
+            return rows, {r[0]: i for i, r in enumerate(rows)}
+
+        # indices denses dans l'ordre d'affichage (tri fait par SQLite)
+        srv, self.srv_idx = load("SELECT NUM_SERVEUR, ADRESSE_IP FROM SERVEUR ORDER BY ADRESSE_IP")
+        gw, self.gw_idx = load("SELECT NUM_GATEWAY, NOM_GATEWAY, NUM_SERVEUR FROM GATEWAY ORDER BY NOM_GATEWAY")
+        cap, self.cap_idx = load("""SELECT NUM_CAPTEUR, NOM_CAPTEUR, NUM_GATEWAY, NUM_RESEAU, NUM_TYPE
+                                    FROM CAPTEUR ORDER BY NOM_CAPTEUR""")
+        app, self.app_idx = load("SELECT NUM_APPLICATION, NOM_APPLICATION FROM APPLICATION ORDER BY NOM_APPLICATION")
+        self.reseaux = dict(cur.execute("SELECT NUM_RESEAU, TYPE_RESEAU FROM RESEAU"))
+        self.types = {r[0]: (r[1], r[2]) for r in cur.execute("SELECT NUM_TYPE, NOM_TYPE, UNITE FROM TYPE")}
+        links = cur.execute("SELECT NUM_APPLICATION, NUM_SERVEUR FROM APP_SRV_CONNEXION").fetchall()
+
+        self.srv_id = array("q", (r[0] for r in srv)); self.srv_name = [r[1] for r in srv]
+        self.gw_id = array("q", (r[0] for r in gw));   self.gw_name = [r[1] for r in gw]
+        self.cap_id = array("q", (r[0] for r in cap)); self.cap_name = [r[1] for r in cap]
+        self.app_id = array("q", (r[0] for r in app)); self.app_name = [r[1] for r in app]
+        self.cap_reseau = array("q", (r[3] for r in cap))
+        self.cap_type = array("q", (r[4] for r in cap))
+        # parent de chaque nœud (-1 : référence absente)
+        self.gw_srv = array("l", (self.srv_idx.get(r[2], -1) for r in gw))
+        self.cap_gw = array("l", (self.gw_idx.get(r[2], -1) for r in cap))
+
+        self.srv_gw = _csr([(p, g) for g, p in enumerate(self.gw_srv) if p >= 0], len(srv))
+        self.gw_cap = _csr([(p, c) for c, p in enumerate(self.cap_gw) if p >= 0], len(gw))
+        self.srv_cap = _csr([(self.gw_srv[g], c) for c, g in enumerate(self.cap_gw)
+                             if g >= 0 and self.gw_srv[g] >= 0], len(srv))
+        pairs = sorted((self.app_idx[a], self.srv_idx[sv]) for a, sv in links
+                       if a in self.app_idx and sv in self.srv_idx)
+        self.app_srv = _csr(pairs, len(app))
+        self.srv_app = _csr(sorted((sv, a) for a, sv in pairs), len(srv))
+        self.resort = False     # un renommage a pu casser l'ordre par nom
+
+    @staticmethod
+    def kids(csr, i):
+        offsets, children = csr
+        return children[offsets[i]:offsets[i + 1]]
+
+    def ordered(self, nodes, names):
+        return sorted(nodes, key=names.__getitem__) if self.resort else nodes
+
+    def capteurs_of_server(self, num_serveur):
+        """IDs des capteurs derrière un serveur, toutes gateways confondues."""
+        i = self.srv_idx.get(num_serveur)
+        return [] if i is None else [self.cap_id[c] for c in self.kids(self.srv_cap, i)]
+
+    def capteurs_of_gateway(self, num_gateway):
+        i = self.gw_idx.get(num_gateway)
+        return [] if i is None else [self.cap_id[c] for c in self.kids(self.gw_cap, i)]
+
+    def gateways_of_server(self, num_serveur):
+        i = self.srv_idx.get(num_serveur)
+        return [] if i is None else [self.gw_id[g] for g in self.kids(self.srv_gw, i)]
+
+    def servers_of_application(self, num_app):
+        i = self.app_idx.get(num_app)
+        return [] if i is None else [self.srv_id[sv] for sv in self.kids(self.app_srv, i)]
+
+    def applications_of_gateway(self, num_gateway):
+        """IDs des applications qui dépendent d'une gateway (via son serveur)."""
+        i = self.gw_idx.get(num_gateway)
+        if i is None or self.gw_srv[i] < 0:
+            return []
+        return [self.app_id[a] for a in self.kids(self.srv_app, self.gw_srv[i])]
+
+    def applications_of_server(self, num_serveur):
+        i = self.srv_idx.get(num_serveur)
+        return [] if i is None else [self.app_id[a] for a in self.kids(self.srv_app, i)]
+
+    def capteurs_of_application(self, num_app):
+        """IDs des capteurs derrière les serveurs d'une application."""
+        i = self.app_idx.get(num_app)
+        return [] if i is None else [self.cap_id[c] for sv in self.kids(self.app_srv, i)
+                                     for c in self.kids(self.srv_cap, sv)]
+
+    def rename(self, table, ident, name, extra=None):
+        """Patch d'un renommage : pas de reconstruction, l'ordre d'affichage
+        est rétabli par un tri des seuls frères à l'affichage."""
+        if table == "RESEAU":
+            self.reseaux[ident] = name
+        elif table == "TYPE":
+            self.types[ident] = (name, extra)
+        else:
+            idx, names = {"SERVEUR": (self.srv_idx, self.srv_name),
+                          "APPLICATION": (self.app_idx, self.app_name),
+                          "GATEWAY": (self.gw_idx, self.gw_name),
+                          "CAPTEUR": (self.cap_idx, self.cap_name)}[table]
+            if ident in idx:
+                names[idx[ident]] = name
+                self.resort = True
+
+# Colonnes lues par TopologyGraph, dont celles de nom (patchables sans reconstruction).
+TOPOLOGY_COLS = {
+    "SERVEUR": ({"ADRESSE_IP"}, {"ADRESSE_IP"}),
+    "GATEWAY": ({"NOM_GATEWAY", "NUM_SERVEUR"}, {"NOM_GATEWAY"}),
+    "CAPTEUR": ({"NOM_CAPTEUR", "NUM_GATEWAY", "NUM_RESEAU", "NUM_TYPE"}, {"NOM_CAPTEUR"}),
+    "APPLICATION": ({"NOM_APPLICATION"}, {"NOM_APPLICATION"}),
+    "RESEAU": ({"TYPE_RESEAU"}, {"TYPE_RESEAU"}),
+    "TYPE": ({"NOM_TYPE", "UNITE"}, {"NOM_TYPE", "UNITE"}),
+    "APP_SRV_CONNEXION": ({"NUM_APPLICATION", "NUM_SERVEUR"}, set()),
+}
+
+class TopologyCache:
+    """Graphe construit à la première demande, patché par les renommages,
+    invalidé par les insertions / suppressions / changements de liens.
+    Règle unique : tout écrivain de ce processus appelle invalidate() ou
+    rename() après son commit. Le journal des changements ne rattrape que
+    les écritures des autres connexions (et processus) : seuls les
+    changements depuis la construction sont relus."""
+
+    def __init__(self):
+        self.graph, self.conn, self.seq = None, None, None
+
+    def get(self, cur):
+        seq = last_change(cur)
+        if self.graph is not None and self.conn is cur.connection and seq != self.seq:
+            self.catch_up(cur)
+        if self.graph is None or self.conn is not cur.connection:
+            self.graph, self.conn = TopologyGraph(cur), cur.connection
+        self.seq = seq
+        return self.graph
+
+    def catch_up(self, cur):
+        if self.seq is None:
+            self.invalidate()
+            return
+        try:
+            for batch in tail_changes(cur, self.seq):
+                for ch in batch:
+                    if not self.apply(ch):
+                        self.invalidate()
+                        return
+        except LookupError:
+            self.invalidate()
+
+    def apply(self, ch):
+        """Applique un changement au graphe ; False s'il faut le reconstruire."""
+        cols, names = TOPOLOGY_COLS.get(ch["table"], (set(), set()))
+        if ch["op"] != "U":
+            return not cols and ch["op"] != "R"
+        changed = set(ch["colonnes"]) & cols
+        if not changed:
+            return True
+        if not changed <= names:
+            return False
+        ident, new = next(iter(ch["cle"].values())), ch["colonnes"]
+        if ch["table"] == "TYPE":
+            nom, unite = self.graph.types.get(ident, (None, None))
+            self.graph.rename("TYPE", ident, new.get("NOM_TYPE", nom), new.get("UNITE", unite))
+        else:
+            self.graph.rename(ch["table"], ident, new[next(iter(names))])
+        return True
+
+    def invalidate(self):
+        self.graph = None
+
+    def rename(self, table, ident, name, extra=None):
+        if self.graph is not None:
+            self.graph.rename(table, ident, name, extra)
+
+topology_cache = TopologyCache()
 
 # ------------------ Affichages ------------------
 
+# Vues paginées par clé (keyset) : SELECT affiché, FROM, clé de tri.
+# La clé reprend l'ORDER BY historique + l'ID pour être unique.
+VIEWS = {
+    "batiments": (
+        'SELECT B.NOM_BATIMENT AS "Bâtiment"',
+        "FROM BATIMENT B",
+        ["B.NOM_BATIMENT", "B.NUM_BATIMENT"]),
+    "salles": (
+        "SELECT S.NOM_SALLE AS 'Salle', B.NOM_BATIMENT AS 'Bâtiment'",
+        """FROM SALLE S
+        JOIN BATIMENT B ON B.NUM_BATIMENT = S.NUM_BATIMENT""",
+        ["B.NOM_BATIMENT", "S.NOM_SALLE", "S.NUM_SALLE"]),
+    "capteurs": (
+        """SELECT I.NOM_CAPTEUR AS 'Capteur',
+               I.NOM_TYPE    AS 'Type',
+               I.UNITE       AS 'Unité',
+               I.NOM_SALLE   AS 'Salle',
+               I.NOM_BATIMENT AS 'Bâtiment',
+               I.TYPE_RESEAU AS 'Réseau',
+               I.NOM_GATEWAY AS 'Gateway',
+               I.ADRESSE_IP  AS 'Serveur'""",
+        "FROM INVENTAIRE I",       # jointure matérialisée (voir INVENTAIRE_SELECT)
+        ["I.NOM_BATIMENT", "I.NOM_SALLE", "I.NOM_CAPTEUR", "I.NUM_CAPTEUR"]),
+    "gateways": (
+        """SELECT G.NOM_GATEWAY AS 'Gateway',
+               S.NOM_SALLE AS 'Salle',
+               B.NOM_BATIMENT AS 'Bâtiment',
+               SV.ADRESSE_IP AS 'Serveur'""",
+        """FROM GATEWAY G
+        JOIN SALLE S    ON S.NUM_SALLE = G.NUM_SALLE
+        JOIN BATIMENT B ON B.NUM_BATIMENT = S.NUM_BATIMENT
+        LEFT JOIN SERVEUR SV ON SV.NUM_SERVEUR = G.NUM_SERVEUR""",
+        ["B.NOM_BATIMENT", "S.NOM_SALLE", "G.NOM_GATEWAY", "G.NUM_GATEWAY"]),
+}
+
+def keyset_page(cur, view, after=None, before=None, limit=PAGE_SIZE):
+    """Une page de `view` strictement après la clé `after` (ou avant `before`).
+    Renvoie (entêtes, lignes, clé de la 1re ligne, clé de la dernière)."""
+    select, from_, keys = VIEWS[view]
+    cols = ", ".join(keys)
+    marks = ", ".join("?" * len(keys))
+    where, order, params = "", cols, []
+    if after is not None:
+        where, params = f"WHERE ({cols}) > ({marks})", list(after)
+    elif before is not None:
+        where, params = f"WHERE ({cols}) < ({marks})", list(before)
+        order = ", ".join(k + " DESC" for k in keys)
+    res = cur.execute(f"{select}, {cols} {from_} {where} ORDER BY {order} LIMIT ?",
+                      params + [limit])
+    n = len(keys)
+    headers = [d[0] for d in res.description][:-n]
+    rows = res.fetchall()
+    if before is not None:
+        rows.reverse()
+    if not rows:
+        return headers, [], None, None
+    return headers, [r[:-n] for r in rows], rows[0][-n:], rows[-1][-n:]
+
+def browse(cur, view, page_size=PAGE_SIZE, pause=True):
+    """Parcours page par page : Entrée/s = suivante, p = précédente, q = quitter."""
+    headers, rows, first, last = keyset_page(cur, view, limit=page_size)
+    widths = col_widths(headers, rows)
+    print(draw_page(headers, rows, widths))
+    if len(rows) < page_size:
+        return          # tout tient sur une page
+    while True:
+        c = input_txt("[s]uivante / [p]récédente / [q]uitter : ", default="s").lower() if pause else "s"
+        if c == "q":
+            return
+        if c == "p":
+            page = keyset_page(cur, view, before=first, limit=page_size)
+            if not page[1]:
+                print("(Début)"); continue
+        else:
+            page = keyset_page(cur, view, after=last, limit=page_size)
+            if not page[1]:
+                return
+        headers, rows, first, last = page
+        print(draw_page(headers, rows, widths))
+
 def show_batiments(cur):
-    draw_query(cur, 'SELECT NOM_BATIMENT AS "Bâtiment" FROM BATIMENT ORDER BY NOM_BATIMENT')
+    browse(cur, "batiments")
 
 def show_salles(cur):
-    draw_query(cur, """
-        SELECT S.NOM_SALLE AS 'Salle', B.NOM_BATIMENT AS 'Bâtiment'
-        FROM SALLE S
-        JOIN BATIMENT B ON B.NUM_BATIMENT = S.NUM_BATIMENT
-        ORDER BY B.NOM_BATIMENT, S.NOM_SALLE
-    """)
+    browse(cur, "salles")
 
 def show_capteurs(cur):
-    draw_query(cur, """
-        SELECT C.NOM_CAPTEUR AS 'Capteur',
-               T.NOM_TYPE    AS 'Type',
-               T.UNITE       AS 'Unité',
-               S.NOM_SALLE   AS 'Salle',
-               B.NOM_BATIMENT AS 'Bâtiment',
-               R.TYPE_RESEAU AS 'Réseau',
-               G.NOM_GATEWAY AS 'Gateway',
-               SV.ADRESSE_IP AS 'Serveur'
-        FROM CAPTEUR C
-        JOIN TYPE T     ON T.NUM_TYPE = C.NUM_TYPE
-        JOIN SALLE S    ON S.NUM_SALLE = C.NUM_SALLE
-        JOIN BATIMENT B ON B.NUM_BATIMENT = S.NUM_BATIMENT
-        JOIN RESEAU R   ON R.NUM_RESEAU = C.NUM_RESEAU
-        LEFT JOIN GATEWAY G ON G.NUM_GATEWAY = C.NUM_GATEWAY
-        LEFT JOIN SERVEUR SV ON SV.NUM_SERVEUR = G.NUM_SERVEUR
-        ORDER BY B.NOM_BATIMENT, S.NOM_SALLE, C.NOM_CAPTEUR
-    """)
+    browse(cur, "capteurs")
 
 def show_gateways(cur):
-    draw_query(cur, """
-        SELECT G.NOM_GATEWAY AS 'Gateway',
-               S.NOM_SALLE AS 'Salle',
-               B.NOM_BATIMENT AS 'Bâtiment',
-               SV.ADRESSE_IP AS 'Serveur'
-        FROM GATEWAY G
-        JOIN SALLE S    ON S.NUM_SALLE = G.NUM_SALLE
-        JOIN BATIMENT B ON B.NUM_BATIMENT = S.NUM_BATIMENT
-        LEFT JOIN SERVEUR SV ON SV.NUM_SERVEUR = G.NUM_SERVEUR
-        ORDER BY B.NOM_BATIMENT, S.NOM_SALLE, G.NOM_GATEWAY
-    """)
+    browse(cur, "gateways")
+
+# ------------------ Navigateur de topologie ------------------
+
+# `:ids` est une liste JSON d'identifiants, dépliée par json_each.
+_IDS = "(SELECT value FROM json_each(:ids))"
+
+# Nœud -> (clé, nom, libellé, [(en-tête, détail calculé)]) ; la table porte le nom du nœud.
+TOPO_NODES = {
+    "SERVEUR": ("NUM_SERVEUR", "ADRESSE_IP", "Serveur", []),
+    "GATEWAY": ("NUM_GATEWAY", "NOM_GATEWAY", "Gateway", []),
+    "CAPTEUR": ("NUM_CAPTEUR", "NOM_CAPTEUR", "Capteur", [
+        ("Type", "(SELECT NOM_TYPE || ' (' || UNITE || ')' FROM TYPE T WHERE T.NUM_TYPE = X.NUM_TYPE)"),
+        ("Réseau", "(SELECT TYPE_RESEAU FROM RESEAU R WHERE R.NUM_RESEAU = X.NUM_RESEAU)")]),
+    "BATIMENT": ("NUM_BATIMENT", "NOM_BATIMENT", "Bâtiment", []),
+    "SALLE": ("NUM_SALLE", "NOM_SALLE", "Salle", []),
+    "APPLICATION": ("NUM_APPLICATION", "NOM_APPLICATION", "Application", []),
+}
+# Parent -> (enfant, FROM, condition sur le parent :p) ; index (parent, nom) partout.
+TOPO_CHILDREN = {
+    "SERVEUR": ("GATEWAY", "GATEWAY X", "X.NUM_SERVEUR = :p"),
+    "GATEWAY": ("CAPTEUR", "CAPTEUR X", "X.NUM_GATEWAY = :p"),
+    "BATIMENT": ("SALLE", "SALLE X", "X.NUM_BATIMENT = :p"),
+    "SALLE": ("GATEWAY", "GATEWAY X", "X.NUM_SALLE = :p"),
+    "APPLICATION": ("SERVEUR", "APP_SRV_CONNEXION L JOIN SERVEUR X ON X.NUM_SERVEUR = L.NUM_SERVEUR",
+                    "L.NUM_APPLICATION = :p"),
+}
+# Effectifs d'un nœud replié : une requête groupée par compteur, sur les IDs
+# de la page ; les capteurs sont comptés par gateway, comme à l'affichage.
+TOPO_COUNTS = {
+    "SERVEUR": [
+        ("Gateways", f"SELECT NUM_SERVEUR, count(*) FROM GATEWAY WHERE NUM_SERVEUR IN {_IDS} GROUP BY 1"),
+        ("Capteurs", f"""SELECT G.NUM_SERVEUR, count(*) FROM GATEWAY G
+                         JOIN CAPTEUR C ON C.NUM_GATEWAY = G.NUM_GATEWAY
+                         WHERE G.NUM_SERVEUR IN {_IDS} GROUP BY 1""")],
+    "GATEWAY": [
+        ("Capteurs", f"SELECT NUM_GATEWAY, count(*) FROM CAPTEUR WHERE NUM_GATEWAY IN {_IDS} GROUP BY 1")],
+    "BATIMENT": [
+        ("Salles", f"SELECT NUM_BATIMENT, count(*) FROM SALLE WHERE NUM_BATIMENT IN {_IDS} GROUP BY 1"),
+        ("Gateways", f"""SELECT S.NUM_BATIMENT, count(*) FROM SALLE S
+                         JOIN GATEWAY G ON G.NUM_SALLE = S.NUM_SALLE
+                         WHERE S.NUM_BATIMENT IN {_IDS} GROUP BY 1"""),
+        ("Capteurs", f"""SELECT S.NUM_BATIMENT, count(*) FROM SALLE S
+                         JOIN GATEWAY G ON G.NUM_SALLE = S.NUM_SALLE
+                         JOIN CAPTEUR C ON C.NUM_GATEWAY = G.NUM_GATEWAY
+                         WHERE S.NUM_BATIMENT IN {_IDS} GROUP BY 1""")],
+    "SALLE": [
+        ("Gateways", f"SELECT NUM_SALLE, count(*) FROM GATEWAY WHERE NUM_SALLE IN {_IDS} GROUP BY 1"),
+        ("Capteurs", f"""SELECT G.NUM_SALLE, count(*) FROM GATEWAY G
+                         JOIN CAPTEUR C ON C.NUM_GATEWAY = G.NUM_GATEWAY
+                         WHERE G.NUM_SALLE IN {_IDS} GROUP BY 1""")],
+    "APPLICATION": [
+        ("Serveurs", f"""SELECT NUM_APPLICATION, count(*) FROM APP_SRV_CONNEXION
+                         WHERE NUM_APPLICATION IN {_IDS} GROUP BY 1"""),
+        ("Capteurs", f"""SELECT L.NUM_APPLICATION, count(*) FROM APP_SRV_CONNEXION L
+                         JOIN GATEWAY G ON G.NUM_SERVEUR = L.NUM_SERVEUR
+                         JOIN CAPTEUR C ON C.NUM_GATEWAY = G.NUM_GATEWAY
+                         WHERE L.NUM_APPLICATION IN {_IDS} GROUP BY 1""")],
+}
+TOPO_ROOTS = {"s": "SERVEUR", "b": "BATIMENT", "a": "APPLICATION"}
+
+def topo_page(cur, kind, parent=None, after=None, limit=PAGE_SIZE):
+    """Une page de nœuds `kind`, enfants de `parent` = (nœud, ID) ou racines,
+    triée par nom et reprise par clé (keyset). Chaque ligne : ID, nom,
+    détails, puis effectifs des enfants (requêtes groupées, sans les lire).
+    Renvoie (lignes, clé de reprise)."""
+    key, name, _, details = TOPO_NODES[kind]
+    src, where, params = f"{kind} X", [], {"lim": limit}
+    if parent is not None:
+        _, src, cond = TOPO_CHILDREN[parent[0]]
+        where.append(cond)
+        params["p"] = parent[1]
+    if after:
+        where.append(f"(X.{name}, X.{key}) > (:n, :k)")
+        params.update(n=after[0], k=after[1])
+    rows = cur.execute(f"SELECT X.{key}, X.{name}" + "".join(", " + d for _, d in details)
+                       + f" FROM {src}" + (" WHERE " + " AND ".join(where) if where else "")
+                       + f" ORDER BY X.{name}, X.{key} LIMIT :lim", params).fetchall()
+    if not rows:
+        return [], None
+    ids = {"ids": json.dumps([r[0] for r in rows])}
+    counts = [dict(cur.execute(sql, ids).fetchall()) for _, sql in TOPO_COUNTS.get(kind, [])]
+    return [r + tuple(c.get(r[0], 0) for c in counts) for r in rows], (rows[-1][1], rows[-1][0])
+
+def topo_headers(kind):
+    _, _, label, details = TOPO_NODES[kind]
+    return ["ID", label] + [h for h, _ in details] + [h for h, _ in TOPO_COUNTS.get(kind, [])]
+
+def topo_line(level, kind, row):
+    _, _, label, details = TOPO_NODES[kind]
+    extra = [str(v) for v in row[2:2 + len(details)]]
+    counts = [f"{v} {h.lower()}" for (h, _), v in zip(TOPO_COUNTS.get(kind, []), row[2 + len(details):])]
+    return ("  " * level + f"{label} : {row[1]} (#{row[0]})"
+            + (" / " + ", ".join(extra) if extra else "")
+            + (" [" + ", ".join(counts) + "]" if counts else ""))
+
+def topo_walk(cur, kind, parent=None, depth=None, level=0):
+    """Sous-arbre en flux, en profondeur d'abord, page par page : la mémoire
+    ne dépend que de la profondeur et de PAGE_SIZE. Au-delà de `depth`, les
+    nœuds restent repliés (effectifs seuls). Produit (niveau, nœud, ligne)."""
+    child = TOPO_CHILDREN.get(kind)
+    after = None
+    while True:
+        rows, after = topo_page(cur, kind, parent, after)
+        for r in rows:
+            yield level, kind, r
+            if child and (depth is None or level + 1 < depth):
+                yield from topo_walk(cur, child[0], (kind, r[0]), depth, level + 1)
+        if len(rows) < PAGE_SIZE:
+            return
+
+def topo_lookup(cur, kind, parent, s):
+    """Nom du nœud `kind` d'ID saisi (« 12 » / « #12 »), s'il est bien enfant de `parent`."""
+    key, name, _, _ = TOPO_NODES[kind]
+    s = s.strip().lstrip("#")
+    if not s.isdigit():
+        return None
+    src, where, params = f"{kind} X", [f"X.{key} = :id"], {"id": int(s)}
+    if parent is not None:
+        _, src, cond = TOPO_CHILDREN[parent[0]]
+        where.append(cond)
+        params["p"] = parent[1]
+    row = cur.execute(f"SELECT X.{name} FROM {src} WHERE " + " AND ".join(where), params).fetchone()
+    return None if row is None else row[0]
+
+def show_subtree(cur, kind, ident, pause=True):
+    """Tout le sous-arbre d'un nœud, en flux, avec une pause par page."""
+    child, _, _ = TOPO_CHILDREN[kind]
+    n = 0
+    for level, k, row in topo_walk(cur, child, (kind, ident), level=1):
+        print(topo_line(level, k, row))
+        n += 1
+        if pause and n % PAGE_SIZE == 0 and input_txt(f"-- {n} lignes. Entrée = suite, q = arrêter : ").lower() == "q":
+            return
+
+# Nœud -> (capteurs, applications) qui en dépendent, lus dans le graphe en cache.
+TOPO_IMPACT = {
+    "SERVEUR": ("capteurs_of_server", "applications_of_server"),
+    "GATEWAY": ("capteurs_of_gateway", "applications_of_gateway"),
+    "APPLICATION": ("capteurs_of_application", None),
+}
+
+def show_impact(cur, kind, ident):
+    """Capteurs et applications qui dépendent d'un nœud, tirés du graphe en
+    cache : temps proportionnel à la réponse, pas au parc."""
+    g = topology_cache.get(cur)
+    caps, apps = TOPO_IMPACT[kind]
+    capteurs = getattr(g, caps)(ident)
+    names = [g.cap_name[g.cap_idx[c]] for c in capteurs[:PAGE_SIZE]]
+    print(f"  Capteurs ({len(capteurs)}) : " + (", ".join(names) or "aucun")
+          + (" ..." if len(capteurs) > PAGE_SIZE else ""))
+    if apps:
+        names = sorted(g.app_name[g.app_idx[a]] for a in getattr(g, apps)(ident))
+        print(f"  Applications ({len(names)}) : " + (", ".join(names) or "aucune"))
+
+def topo_browse(cur, kind, parent=None, path="Topologie"):
+    """Nœuds `kind` page par page, repliés avec leurs effectifs ; un ID
+    déplie un niveau, « *ID » affiche tout son sous-arbre, « !ID » ce qui
+    en dépend (capteurs, applications)."""
+    child = TOPO_CHILDREN.get(kind)
+    headers = topo_headers(kind)
+    start, widths = None, None
+    while True:
+        rows, last = topo_page(cur, kind, parent, start)
+        print(f"\n== {path} ==")
+        if not rows:
+            print("(Aucun élément)")
+        else:
+            widths = widths or col_widths(headers, rows)
+            print(draw_page(headers, rows, widths))
+        more = len(rows) == PAGE_SIZE
+        hint = ", ".join((["ID = déplier", "*ID = sous-arbre complet"] if child else [])
+                         + (["!ID = dépendants"] if kind in TOPO_IMPACT else [])
+                         + (["Entrée = suite"] if more else []) + ["q = retour"])
+        while True:
+            s = input_txt(f"{hint} : ")
+            if s == "q":
+                return
+            if s == "" and more:
+                start = last
+                break
+            impact = s.startswith("!")
+            ok = kind in TOPO_IMPACT if impact else child
+            nom = topo_lookup(cur, kind, parent, s.lstrip("*!")) if ok else None
+            if nom is None:
+                print("=> ID invalide.")
+                continue
+            nid = int(s.lstrip("*!# "))
+            if impact:
+                print(topo_line(0, kind, (nid, nom)))
+                show_impact(cur, kind, nid)
+            elif s.startswith("*"):
+                print(topo_line(0, kind, (nid, nom)))
+                show_subtree(cur, kind, nid)
+            else:
+                topo_browse(cur, child[0], (kind, nid), f"{path} / {TOPO_NODES[kind][2]} {nom}")
+            break                # page courante réaffichée
 
 def show_topologie(cur):
-    print("\n== Topologie : Serveur → Gateway → Capteur ==")
-    rows = cur.execute("""
-        SELECT SV.ADRESSE_IP, G.NOM_GATEWAY, C.NOM_CAPTEUR, COALESCE(R.TYPE_RESEAU,'?')
-        FROM SERVEUR SV
-        LEFT JOIN GATEWAY G  ON G.NUM_SERVEUR = SV.NUM_SERVEUR
-        LEFT JOIN CAPTEUR C  ON C.NUM_GATEWAY = G.NUM_GATEWAY
-        LEFT JOIN RESEAU R   ON R.NUM_RESEAU = C.NUM_RESEAU
-        ORDER BY SV.ADRESSE_IP, G.NOM_GATEWAY, C.NOM_CAPTEUR
-    """).fetchall()
-    current_ip, current_gw = None, None
-    printed_gw = False
-    for ip, gw, cap, reseau in rows:
-        if ip != current_ip:
-            if current_ip is not None and not printed_gw:
-                print("  (aucune gateway)")
-            print(f"Serveur : {ip}")
-            current_ip, current_gw, printed_gw = ip, None, False
-        if gw is None:
+    """Navigateur : racines (serveurs, bâtiments ou applications), puis
+    sous-arbres dépliés un à un par des lectures indexées."""
+    while True:
+        c = input_txt("Topologie par [s]erveur / [b]âtiment / [a]pplication (q = retour) : ").lower()
+        if c == "q":
+            return
+        if c not in TOPO_ROOTS:
+            print("Choix invalide.")
             continue
-        if gw != current_gw:
-            print(f"  Gateway : {gw}")
-            current_gw, printed_gw = gw, True
-        if cap:
-            print(f"    Capteur : {cap} ({reseau})")
-    # dernier serveur sans GW
-    if rows:
-        last_ip = rows[-1][0]
-        n_gw = cur.execute("""
-            SELECT COUNT(*) FROM GATEWAY G
-            JOIN SERVEUR SV ON SV.NUM_SERVEUR = G.NUM_SERVEUR
-            WHERE SV.ADRESSE_IP = ?
-        """, (last_ip,)).fetchone()[0]
-        if n_gw == 0:
-            print("  (aucune gateway)")
-
-    if table_exists(cur, "CONNEXION"):
-        print("\n== Topologie : Application → Serveur → Capteur / Type ==")
-        rows2 = cur.execute("""
-            SELECT A.NOM_APP, SV.ADRESSE_IP, C.NOM_CAPTEUR, T.NOM_TYPE, T.UNITE
-            FROM APPLICATION A
-            JOIN CONNEXION X ON X.NUM_APP = A.NUM_APP
-            JOIN SERVEUR SV  ON SV.NUM_SERVEUR = X.NUM_SERVEUR
-            LEFT JOIN GATEWAY G ON G.NUM_SERVEUR = SV.NUM_SERVEUR
-            LEFT JOIN CAPTEUR C ON C.NUM_GATEWAY = G.NUM_GATEWAY
-            LEFT JOIN TYPE T    ON T.NUM_TYPE = C.NUM_TYPE
-            ORDER BY A.NOM_APP, SV.ADRESSE_IP, C.NOM_CAPTEUR
-        """).fetchall()
-        if not rows2:
-            print("(Aucune application liée.)")
-        app_now, srv_now = None, None
-        for app, ip, cap, tname, unit in rows2:
-            if app != app_now:
-                print(f"Application : {app}"); app_now, srv_now = app, None
-            if ip and ip != srv_now:
-                print(f"  Serveur : {ip}"); srv_now = ip
-            if cap:
-                print(f"    Capteur : {cap} / {tname} ({unit})")
-   
+        topo_browse(cur, TOPO_ROOTS[c])
 
 # ------------------ INSERT ------------------
 
 def insert_batiment(cur, db):
     nom = input_txt("Nom du bâtiment : ")
-    # ID auto simple = max + 1
-    next_id = cur.execute('SELECT COALESCE(MAX(NUM_BATIMENT),0)+1 FROM BATIMENT').fetchone()[0]
-    cur.execute('INSERT INTO BATIMENT(NUM_BATIMENT, NOM_BATIMENT) VALUES (?,?)', (next_id, nom))
+    # ID attribué par SQLite (AUTOINCREMENT)
+    cur.execute('INSERT INTO BATIMENT(NOM_BATIMENT) VALUES (?)', (nom,))
     db.commit(); print("OK.")
 
 def insert_salle(cur, db):
     nom = input_txt("Nom de la salle : ")
-    num_b = list_and_choose(cur, 'SELECT NUM_BATIMENT, NOM_BATIMENT FROM BATIMENT ORDER BY NOM_BATIMENT', "NUM_BATIMENT")
+    num_b = choose(cur, "BATIMENT")
     if num_b is None: return
-    next_id = cur.execute('SELECT COALESCE(MAX(NUM_SALLE),0)+1 FROM SALLE').fetchone()[0]
-    cur.execute('INSERT INTO SALLE(NUM_SALLE, NUM_BATIMENT, NOM_SALLE) VALUES (?,?,?)', (next_id, num_b, nom))
+    cur.execute('INSERT INTO SALLE(NUM_BATIMENT, NOM_SALLE) VALUES (?,?)', (num_b, nom))
     db.commit(); print("OK.")
 
 def insert_type(cur, db):
     nom = input_txt("Nom du type : ")
     unite = input_txt("Unité : ")
-    next_id = cur.execute('SELECT COALESCE(MAX(NUM_TYPE),0)+1 FROM TYPE').fetchone()[0]
-    cur.execute('INSERT INTO TYPE(NUM_TYPE, NOM_TYPE, UNITE) VALUES (?,?,?)', (next_id, nom, unite))
-    db.commit(); print("OK.")
+    cur.execute('INSERT INTO TYPE(NOM_TYPE, UNITE) VALUES (?,?)', (nom, unite))
+    db.commit(); topology_cache.invalidate(); print("OK.")
 
 def insert_reseau(cur, db):
     techno = input_txt("Type réseau (WiFi/LoRaWAN/Sigfox/NB‑IOT) : ")
     debit = input_int("Débit réseau (entier) : ")
-    next_id = cur.execute('SELECT COALESCE(MAX(NUM_RESEAU),0)+1 FROM RESEAU').fetchone()[0]
-    cur.execute('INSERT INTO RESEAU(NUM_RESEAU, TYPE_RESEAU, DEBIT_RESEAU) VALUES (?,?,?)', (next_id, techno, debit))
-    db.commit(); print("OK.")
+    cur.execute('INSERT INTO RESEAU(TYPE_RESEAU, DEBIT_RESEAU) VALUES (?,?)', (techno, debit))
+    db.commit(); topology_cache.invalidate(); print("OK.")
 
 def insert_serveur(cur, db):
     ip = input_txt("Adresse IP : ")
-    next_id = cur.execute('SELECT COALESCE(MAX(NUM_SERVEUR),0)+1 FROM SERVEUR').fetchone()[0]
-    cur.execute('INSERT INTO SERVEUR(NUM_SERVEUR, ADRESSE_IP) VALUES (?,?)', (next_id, ip))
-    db.commit(); print("OK.")
+    cur.execute('INSERT INTO SERVEUR(ADRESSE_IP) VALUES (?)', (ip,))
+    db.commit(); topology_cache.invalidate(); print("OK.")
 
 def insert_gateway(cur, db):
     nom = input_txt("Nom gateway : ")
-    num_salle = list_and_choose(cur, 'SELECT NUM_SALLE, NOM_SALLE FROM SALLE ORDER BY NOM_SALLE', "NUM_SALLE")
+    num_salle = choose(cur, "SALLE")
     if num_salle is None: return
-    num_serv = list_and_choose(cur, 'SELECT NUM_SERVEUR, ADRESSE_IP FROM SERVEUR ORDER BY ADRESSE_IP', "NUM_SERVEUR")
+    num_serv = choose(cur, "SERVEUR")
     if num_serv is None: return
-    next_id = cur.execute('SELECT COALESCE(MAX(NUM_GATEWAY),0)+1 FROM GATEWAY').fetchone()[0]
-    cur.execute('INSERT INTO GATEWAY(NUM_GATEWAY, NUM_SERVEUR, NUM_SALLE, NOM_GATEWAY) VALUES (?,?,?,?)',
-                (next_id, num_serv, num_salle, nom))
-    db.commit(); print("OK.")
+    cur.execute('INSERT INTO GATEWAY(NUM_SERVEUR, NUM_SALLE, NOM_GATEWAY) VALUES (?,?,?)',
+                (num_serv, num_salle, nom))
+    db.commit(); topology_cache.invalidate(); print("OK.")
 
 def insert_capteur(cur, db):
     nom = input_txt("Nom capteur : ")
-    num_salle = list_and_choose(cur, 'SELECT NUM_SALLE, NOM_SALLE FROM SALLE ORDER BY NOM_SALLE', "NUM_SALLE")
+    num_salle = choose(cur, "SALLE")
     if num_salle is None: return
-    num_gw = list_and_choose(cur, 'SELECT NUM_GATEWAY, NOM_GATEWAY FROM GATEWAY ORDER BY NOM_GATEWAY', "NUM_GATEWAY")
+    num_gw = choose(cur, "GATEWAY")
     if num_gw is None: return
-    num_type = list_and_choose(cur, 'SELECT NUM_TYPE, NOM_TYPE || " (" || UNITE || ")" FROM TYPE ORDER BY NOM_TYPE', "NUM_TYPE")
+    num_type = choose(cur, "TYPE")
     if num_type is None: return
-    num_res = list_and_choose(cur, 'SELECT NUM_RESEAU, TYPE_RESEAU FROM RESEAU ORDER BY TYPE_RESEAU', "NUM_RESEAU")
+    num_res = choose(cur, "RESEAU")
     if num_res is None: return
-    next_id = cur.execute('SELECT COALESCE(MAX(NUM_CAPTEUR),0)+1 FROM CAPTEUR').fetchone()[0]
     cur.execute("""
-        INSERT INTO CAPTEUR(NUM_CAPTEUR, NUM_SALLE, NUM_GATEWAY, NUM_TYPE, NUM_RESEAU, NOM_CAPTEUR)
-        VALUES (?,?,?,?,?,?)
-    """, (next_id, num_salle, num_gw, num_type, num_res, nom))
-    db.commit(); print("OK.")
+        INSERT INTO CAPTEUR(NUM_SALLE, NUM_GATEWAY, NUM_TYPE, NUM_RESEAU, NOM_CAPTEUR)
+        VALUES (?,?,?,?,?)
+    """, (num_salle, num_gw, num_type, num_res, nom))
+    db.commit(); topology_cache.invalidate(); print("OK.")
 
 def insert_application(cur, db):
     nom = input_txt("Nom application : ")
-    next_id = cur.execute('SELECT COALESCE(MAX(NUM_APP),0)+1 FROM APPLICATION').fetchone()[0]
-    cur.execute('INSERT INTO APPLICATION(NUM_APP, NOM_APP) VALUES (?,?)', (next_id, nom))
-    db.commit(); print("OK.")
+    cur.execute('INSERT INTO APPLICATION(NOM_APPLICATION) VALUES (?)', (nom,))
+    db.commit(); topology_cache.invalidate(); print("OK.")
 
 def insert_connexion(cur, db):
-    if not table_exists(cur, "CONNEXION"):
-        print("(Créez la table CONNEXION si nécessaire.)")
-        return
-    num_app = list_and_choose(cur, 'SELECT NUM_APP, NOM_APP FROM APPLICATION ORDER BY NOM_APP', "NUM_APP")
+    num_app = choose(cur, "APPLICATION")
     if num_app is None: return
-    num_srv = list_and_choose(cur, 'SELECT NUM_SERVEUR, ADRESSE_IP FROM SERVEUR ORDER BY ADRESSE_IP', "NUM_SERVEUR")
+    num_srv = choose(cur, "SERVEUR")
     if num_srv is None: return
-    cur.execute('INSERT INTO CONNEXION(NUM_APP, NUM_SERVEUR) VALUES (?,?)', (num_app, num_srv))
-    db.commit(); print("OK.")
+    cur.execute('INSERT INTO APP_SRV_CONNEXION(NUM_APPLICATION, NUM_SERVEUR) VALUES (?,?)', (num_app, num_srv))
+    db.commit(); topology_cache.invalidate(); print("OK.")
 
 # ------------------ UPDATE (très simple) ------------------
 
 def update_batiment(cur, db):
-    nid = list_and_choose(cur, 'SELECT NUM_BATIMENT, NOM_BATIMENT FROM BATIMENT ORDER BY NOM_BATIMENT', "NUM_BATIMENT")
+    nid = choose(cur, "BATIMENT")
     if nid is None: return
     new_name = input_txt("Nouveau nom (laisser vide pour conserver) : ",
                          default=cur.execute('SELECT NOM_BATIMENT FROM BATIMENT WHERE NUM_BATIMENT=?',(nid,)).fetchone()[0])
@@ -253,13 +1333,13 @@ def update_batiment(cur, db):
     db.commit(); print("OK.")
 
 def update_salle(cur, db):
-    nid = list_and_choose(cur, 'SELECT NUM_SALLE, NOM_SALLE FROM SALLE ORDER BY NOM_SALLE', "NUM_SALLE")
+    nid = choose(cur, "SALLE")
     if nid is None: return
     name_def = cur.execute('SELECT NOM_SALLE FROM SALLE WHERE NUM_SALLE=?',(nid,)).fetchone()[0]
     new_name = input_txt("Nouveau nom (vide = garder) : ", default=name_def)
     # possibilité de changer le bâtiment
     if input_txt("Changer de bâtiment ? (o/N) : ").lower() == "o":
-        nb = list_and_choose(cur, 'SELECT NUM_BATIMENT, NOM_BATIMENT FROM BATIMENT ORDER BY NOM_BATIMENT', "NUM_BATIMENT")
+        nb = choose(cur, "BATIMENT")
         if nb is None: return
         cur.execute('UPDATE SALLE SET NOM_SALLE=?, NUM_BATIMENT=? WHERE NUM_SALLE=?', (new_name, nb, nid))
     else:
@@ -267,156 +1347,2680 @@ def update_salle(cur, db):
     db.commit(); print("OK.")
 
 def update_capteur(cur, db):
-    nid = list_and_choose(cur, 'SELECT NUM_CAPTEUR, NOM_CAPTEUR FROM CAPTEUR ORDER BY NOM_CAPTEUR', "NUM_CAPTEUR")
+    nid = choose(cur, "CAPTEUR")
     if nid is None: return
     name_def = cur.execute('SELECT NOM_CAPTEUR FROM CAPTEUR WHERE NUM_CAPTEUR=?',(nid,)).fetchone()[0]
     new_name = input_txt("Nouveau nom (vide = garder) : ", default=name_def)
     # changer liaisons ?
     if input_txt("Changer salle/gateway/type/réseau ? (o/N) : ").lower() == "o":
-        sid = list_and_choose(cur, 'SELECT NUM_SALLE, NOM_SALLE FROM SALLE ORDER BY NOM_SALLE', "NUM_SALLE")
+        sid = choose(cur, "SALLE")
         if sid is None: return
-        gid = list_and_choose(cur, 'SELECT NUM_GATEWAY, NOM_GATEWAY FROM GATEWAY ORDER BY NOM_GATEWAY', "NUM_GATEWAY")
+        gid = choose(cur, "GATEWAY")
         if gid is None: return
-        tid = list_and_choose(cur, 'SELECT NUM_TYPE, NOM_TYPE || " (" || UNITE || ")" FROM TYPE ORDER BY NOM_TYPE', "NUM_TYPE")
+        tid = choose(cur, "TYPE")
         if tid is None: return
-        rid = list_and_choose(cur, 'SELECT NUM_RESEAU, TYPE_RESEAU FROM RESEAU ORDER BY TYPE_RESEAU', "NUM_RESEAU")
+        rid = choose(cur, "RESEAU")
         if rid is None: return
         cur.execute("""
             UPDATE CAPTEUR
             SET NOM_CAPTEUR=?, NUM_SALLE=?, NUM_GATEWAY=?, NUM_TYPE=?, NUM_RESEAU=?
             WHERE NUM_CAPTEUR=?
         """, (new_name, sid, gid, tid, rid, nid))
+        db.commit(); topology_cache.invalidate()
     else:
         cur.execute('UPDATE CAPTEUR SET NOM_CAPTEUR=? WHERE NUM_CAPTEUR=?', (new_name, nid))
-    db.commit(); print("OK.")
+        db.commit(); topology_cache.rename("CAPTEUR", nid, new_name)
+    print("OK.")
 
 def update_gateway(cur, db):
-    nid = list_and_choose(cur, 'SELECT NUM_GATEWAY, NOM_GATEWAY FROM GATEWAY ORDER BY NOM_GATEWAY', "NUM_GATEWAY")
+    nid = choose(cur, "GATEWAY")
     if nid is None: return
     name_def = cur.execute('SELECT NOM_GATEWAY FROM GATEWAY WHERE NUM_GATEWAY=?',(nid,)).fetchone()[0]
     new_name = input_txt("Nouveau nom (vide = garder) : ", default=name_def)
     if input_txt("Changer salle/serveur ? (o/N) : ").lower() == "o":
-        sid = list_and_choose(cur, 'SELECT NUM_SALLE, NOM_SALLE FROM SALLE ORDER BY NOM_SALLE', "NUM_SALLE")
+        sid = choose(cur, "SALLE")
         if sid is None: return
-        sv = list_and_choose(cur, 'SELECT NUM_SERVEUR, ADRESSE_IP FROM SERVEUR ORDER BY ADRESSE_IP', "NUM_SERVEUR")
+        sv = choose(cur, "SERVEUR")
         if sv is None: return
         cur.execute('UPDATE GATEWAY SET NOM_GATEWAY=?, NUM_SALLE=?, NUM_SERVEUR=? WHERE NUM_GATEWAY=?',
                     (new_name, sid, sv, nid))
+        db.commit(); topology_cache.invalidate()
     else:
         cur.execute('UPDATE GATEWAY SET NOM_GATEWAY=? WHERE NUM_GATEWAY=?', (new_name, nid))
-    db.commit(); print("OK.")
+        db.commit(); topology_cache.rename("GATEWAY", nid, new_name)
+    print("OK.")
 
 def update_serveur(cur, db):
-    nid = list_and_choose(cur, 'SELECT NUM_SERVEUR, ADRESSE_IP FROM SERVEUR ORDER BY ADRESSE_IP', "NUM_SERVEUR")
+    nid = choose(cur, "SERVEUR")
     if nid is None: return
     ip_def = cur.execute('SELECT ADRESSE_IP FROM SERVEUR WHERE NUM_SERVEUR=?',(nid,)).fetchone()[0]
     new_ip = input_txt("Nouvelle IP (vide = garder) : ", default=ip_def)
     cur.execute('UPDATE SERVEUR SET ADRESSE_IP=? WHERE NUM_SERVEUR=?', (new_ip, nid))
-    db.commit(); print("OK.")
+    db.commit(); topology_cache.rename("SERVEUR", nid, new_ip); print("OK.")
 
 def update_type(cur, db):
-    nid = list_and_choose(cur, 'SELECT NUM_TYPE, NOM_TYPE || " (" || UNITE || ")" FROM TYPE ORDER BY NOM_TYPE', "NUM_TYPE")
+    nid = choose(cur, "TYPE")
     if nid is None: return
     nom_def, uni_def = cur.execute('SELECT NOM_TYPE, UNITE FROM TYPE WHERE NUM_TYPE=?',(nid,)).fetchone()
     new_nom = input_txt("Nouveau nom (vide = garder) : ", default=nom_def)
     new_uni = input_txt("Nouvelle unité (vide = garder) : ", default=uni_def)
     cur.execute('UPDATE TYPE SET NOM_TYPE=?, UNITE=? WHERE NUM_TYPE=?', (new_nom, new_uni, nid))
-    db.commit(); print("OK.")
+    db.commit(); topology_cache.rename("TYPE", nid, new_nom, new_uni); print("OK.")
 
 def update_reseau(cur, db):
-    nid = list_and_choose(cur, 'SELECT NUM_RESEAU, TYPE_RESEAU FROM RESEAU ORDER BY TYPE_RESEAU', "NUM_RESEAU")
+    nid = choose(cur, "RESEAU")
     if nid is None: return
     name_def, debit_def = cur.execute('SELECT TYPE_RESEAU, DEBIT_RESEAU FROM RESEAU WHERE NUM_RESEAU=?',(nid,)).fetchone()
     new_name = input_txt("Nouveau type (vide = garder) : ", default=name_def)
     s = input_txt(f"Nouveau débit (vide = garder {debit_def}) : ", default=str(debit_def))
     new_debit = int(s) if s.strip() != "" else debit_def
     cur.execute('UPDATE RESEAU SET TYPE_RESEAU=?, DEBIT_RESEAU=? WHERE NUM_RESEAU=?', (new_name, new_debit, nid))
-    db.commit(); print("OK.")
+    db.commit(); topology_cache.rename("RESEAU", nid, new_name); print("OK.")
 
 def update_application(cur, db):
-    nid = list_and_choose(cur, 'SELECT NUM_APP, NOM_APP FROM APPLICATION ORDER BY NOM_APP', "NUM_APP")
+    nid = choose(cur, "APPLICATION")
     if nid is None: return
-    app_def = cur.execute('SELECT NOM_APP FROM APPLICATION WHERE NUM_APP=?',(nid,)).fetchone()[0]
+    app_def = cur.execute('SELECT NOM_APPLICATION FROM APPLICATION WHERE NUM_APPLICATION=?',(nid,)).fetchone()[0]
     new_name = input_txt("Nouveau nom (vide = garder) : ", default=app_def)
-    cur.execute('UPDATE APPLICATION SET NOM_APP=? WHERE NUM_APP=?', (new_name, nid))
-    db.commit(); print("OK.")
+    cur.execute('UPDATE APPLICATION SET NOM_APPLICATION=? WHERE NUM_APPLICATION=?', (new_name, nid))
+    db.commit(); topology_cache.rename("APPLICATION", nid, new_name); print("OK.")
 
-# ------------------ DELETE (simple, avec petites cascades) ------------------
+# ------------------ DELETE (cascades ensemblistes) ------------------
+
+# Pour chaque table : (table cible, condition) dans l'ordre d'exécution.
+# `:ids` (voir _IDS) : une seule requête DELETE par table, quel que soit
+# le nombre de lignes.
+_GW_SALLES = f"SELECT NUM_GATEWAY FROM GATEWAY WHERE NUM_SALLE IN {_IDS}"
+_SALLES_BAT = f"SELECT NUM_SALLE FROM SALLE WHERE NUM_BATIMENT IN {_IDS}"
+CASCADES = {
+    "CAPTEUR": [
+        ("CAPTEUR", f"NUM_CAPTEUR IN {_IDS}"),
+    ],
+    "GATEWAY": [
+        ("CAPTEUR", f"NUM_GATEWAY IN {_IDS}"),
+        ("GATEWAY", f"NUM_GATEWAY IN {_IDS}"),
+    ],
+    "SALLE": [
+        ("CAPTEUR", f"NUM_SALLE IN {_IDS} OR NUM_GATEWAY IN ({_GW_SALLES})"),
+        ("GATEWAY", f"NUM_SALLE IN {_IDS}"),
+        ("SALLE", f"NUM_SALLE IN {_IDS}"),
+    ],
+    "BATIMENT": [
+        ("CAPTEUR", f"NUM_SALLE IN ({_SALLES_BAT}) OR NUM_GATEWAY IN "
+                    f"(SELECT NUM_GATEWAY FROM GATEWAY WHERE NUM_SALLE IN ({_SALLES_BAT}))"),
+        ("GATEWAY", f"NUM_SALLE IN ({_SALLES_BAT})"),
+        ("SALLE", f"NUM_BATIMENT IN {_IDS}"),
+        ("BATIMENT", f"NUM_BATIMENT IN {_IDS}"),
+    ],
+    "SERVEUR": [
+        ("APP_SRV_CONNEXION", f"NUM_SERVEUR IN {_IDS}"),
+        ("CAPTEUR", f"NUM_GATEWAY IN (SELECT NUM_GATEWAY FROM GATEWAY WHERE NUM_SERVEUR IN {_IDS})"),
+        ("GATEWAY", f"NUM_SERVEUR IN {_IDS}"),
+        ("SERVEUR", f"NUM_SERVEUR IN {_IDS}"),
+    ],
+    "APPLICATION": [
+        ("APP_SRV_CONNEXION", f"NUM_APPLICATION IN {_IDS}"),
+        ("APPLICATION", f"NUM_APPLICATION IN {_IDS}"),
+    ],
+    "TYPE": [
+        ("CAPTEUR", f"NUM_TYPE IN {_IDS}"),
+        ("TYPE", f"NUM_TYPE IN {_IDS}"),
+    ],
+    "RESEAU": [
+        ("CAPTEUR", f"NUM_RESEAU IN {_IDS}"),
+        ("RESEAU", f"NUM_RESEAU IN {_IDS}"),
+    ],
+}
+
+# Données rattachées à une ligne supprimée (relevés, agrégats) :
+# supprimées juste avant elle, avec la même condition.
+DEPENDANTS = {
+    "CAPTEUR": [("MESURE", "NUM_CAPTEUR"), ("AGREGAT_CAPTEUR", "NUM_CAPTEUR")],
+    "SALLE": [("AGREGAT_SALLE", "NUM_SALLE")],
+    "BATIMENT": [("AGREGAT_BATIMENT", "NUM_BATIMENT")],
+    "TYPE": [("AGREGAT_SALLE", "NUM_TYPE"), ("AGREGAT_BATIMENT", "NUM_TYPE")],
+}
+
+def cascade_delete(cur, table, ids):
+    """Supprime `ids` de `table` et leurs dépendances (sans commit).
+    Renvoie le nombre de lignes supprimées par table."""
+    params = {"ids": json.dumps(sorted(set(ids)))}
+    counts = {}
+    for target, where in CASCADES[table]:
+        for dep, col in DEPENDANTS.get(target, []):
+            n = cur.execute(f"DELETE FROM {dep} WHERE {col} IN "
+                            f"(SELECT {col} FROM {target} WHERE {where})", params).rowcount
+            if n:
+                counts[dep] = counts.get(dep, 0) + n
+        n = cur.execute(f"DELETE FROM {target} WHERE {where}", params).rowcount
+        counts[target] = counts.get(target, 0) + n
+    topology_cache.invalidate()
+    return counts
+
+def delete_many(db, table, ids, writer=None):
+    """Suppression en masse (ex. toute une flotte de serveurs) en une
+    transaction ; par l'écrivain unique s'il y en a un dans le processus."""
+    if writer is not None:
+        return writer.call(cascade_delete, table, ids)
+    with db:
+        return cascade_delete(db.cursor(), table, ids)
+
+def print_counts(counts):
+    print("OK. (" + ", ".join(f"{t}: {n}" for t, n in counts.items()) + ")")
 
 def del_capteur(cur, db):
-    nid = list_and_choose(cur, 'SELECT NUM_CAPTEUR, NOM_CAPTEUR FROM CAPTEUR ORDER BY NOM_CAPTEUR', "NUM_CAPTEUR")
+    nid = choose(cur, "CAPTEUR")
     if nid is None: return
-    cur.execute('DELETE FROM CAPTEUR WHERE NUM_CAPTEUR=?', (nid,)); db.commit(); print("OK.")
+    print_counts(delete_many(db, "CAPTEUR", [nid]))
 
 def del_gateway(cur, db):
-    nid = list_and_choose(cur, 'SELECT NUM_GATEWAY, NOM_GATEWAY FROM GATEWAY ORDER BY NOM_GATEWAY', "NUM_GATEWAY")
+    nid = choose(cur, "GATEWAY")
     if nid is None: return
-    cur.execute('DELETE FROM CAPTEUR WHERE NUM_GATEWAY=?', (nid,))
-    cur.execute('DELETE FROM GATEWAY WHERE NUM_GATEWAY=?', (nid,))
-    db.commit(); print("OK. (capteurs liés supprimés)")
+    print_counts(delete_many(db, "GATEWAY", [nid]))
 
 def del_salle(cur, db):
-    nid = list_and_choose(cur, 'SELECT NUM_SALLE, NOM_SALLE FROM SALLE ORDER BY NOM_SALLE', "NUM_SALLE")
+    nid = choose(cur, "SALLE")
     if nid is None: return
-    # supprime capteurs + gateways de la salle
-    for (gid,) in cur.execute('SELECT NUM_GATEWAY FROM GATEWAY WHERE NUM_SALLE=?', (nid,)).fetchall():
-        cur.execute('DELETE FROM CAPTEUR WHERE NUM_GATEWAY=?', (gid,))
-        cur.execute('DELETE FROM GATEWAY WHERE NUM_GATEWAY=?', (gid,))
-    cur.execute('DELETE FROM CAPTEUR WHERE NUM_SALLE=?', (nid,))
-    cur.execute('DELETE FROM SALLE WHERE NUM_SALLE=?', (nid,))
-    db.commit(); print("OK.")
+    print_counts(delete_many(db, "SALLE", [nid]))
 
 def del_batiment(cur, db):
-    nid = list_and_choose(cur, 'SELECT NUM_BATIMENT, NOM_BATIMENT FROM BATIMENT ORDER BY NOM_BATIMENT', "NUM_BATIMENT")
+    nid = choose(cur, "BATIMENT")
     if nid is None: return
-    # supprimer toutes les salles (et dépendances)
-    salles = cur.execute('SELECT NUM_SALLE FROM SALLE WHERE NUM_BATIMENT=?', (nid,)).fetchall()
-    for (sid,) in salles:
-        for (gid,) in cur.execute('SELECT NUM_GATEWAY FROM GATEWAY WHERE NUM_SALLE=?', (sid,)).fetchall():
-            cur.execute('DELETE FROM CAPTEUR WHERE NUM_GATEWAY=?', (gid,))
-            cur.execute('DELETE FROM GATEWAY WHERE NUM_GATEWAY=?', (gid,))
-        cur.execute('DELETE FROM CAPTEUR WHERE NUM_SALLE=?', (sid,))
-        cur.execute('DELETE FROM SALLE WHERE NUM_SALLE=?', (sid,))
-    cur.execute('DELETE FROM BATIMENT WHERE NUM_BATIMENT=?', (nid,))
-    db.commit(); print("OK.")
+    print_counts(delete_many(db, "BATIMENT", [nid]))
 
 def del_serveur(cur, db):
-    nid = list_and_choose(cur, 'SELECT NUM_SERVEUR, ADRESSE_IP FROM SERVEUR ORDER BY ADRESSE_IP', "NUM_SERVEUR")
+    nid = choose(cur, "SERVEUR")
     if nid is None: return
-    if table_exists(cur, "CONNEXION"):
-        cur.execute('DELETE FROM CONNEXION WHERE NUM_SERVEUR=?', (nid,))
-    for (gid,) in cur.execute('SELECT NUM_GATEWAY FROM GATEWAY WHERE NUM_SERVEUR=?', (nid,)).fetchall():
-        cur.execute('DELETE FROM CAPTEUR WHERE NUM_GATEWAY=?', (gid,))
-    cur.execute('DELETE FROM GATEWAY WHERE NUM_SERVEUR=?', (nid,))
-    cur.execute('DELETE FROM SERVEUR WHERE NUM_SERVEUR=?', (nid,))
-    db.commit(); print("OK.")
+    print_counts(delete_many(db, "SERVEUR", [nid]))
 
 def del_application(cur, db):
-    nid = list_and_choose(cur, 'SELECT NUM_APP, NOM_APP FROM APPLICATION ORDER BY NOM_APP', "NUM_APP")
+    nid = choose(cur, "APPLICATION")
     if nid is None: return
-    if table_exists(cur, "CONNEXION"):
-        cur.execute('DELETE FROM CONNEXION WHERE NUM_APP=?', (nid,))
-    cur.execute('DELETE FROM APPLICATION WHERE NUM_APP=?', (nid,))
-    db.commit(); print("OK.")
+    print_counts(delete_many(db, "APPLICATION", [nid]))
 
 def del_type(cur, db):
-    nid = list_and_choose(cur, 'SELECT NUM_TYPE, NOM_TYPE || " (" || UNITE || ")" FROM TYPE ORDER BY NOM_TYPE', "NUM_TYPE")
+    nid = choose(cur, "TYPE")
     if nid is None: return
-    cur.execute('DELETE FROM CAPTEUR WHERE NUM_TYPE=?', (nid,))
-    cur.execute('DELETE FROM TYPE WHERE NUM_TYPE=?', (nid,))
-    db.commit(); print("OK. (capteurs liés supprimés)")
+    print_counts(delete_many(db, "TYPE", [nid]))
 
 def del_reseau(cur, db):
-    nid = list_and_choose(cur, 'SELECT NUM_RESEAU, TYPE_RESEAU FROM RESEAU ORDER BY TYPE_RESEAU', "NUM_RESEAU")
+    nid = choose(cur, "RESEAU")
     if nid is None: return
-    cur.execute('DELETE FROM CAPTEUR WHERE NUM_RESEAU=?', (nid,))
-    cur.execute('DELETE FROM RESEAU WHERE NUM_RESEAU=?', (nid,))
-    db.commit(); print("OK. (capteurs liés supprimés)")
+    print_counts(delete_many(db, "RESEAU", [nid]))
+
+def del_lot(cur, db):
+    """Suppression de plusieurs IDs d'une même table (ex. : 101,102,103)."""
+    table = input_txt(f"Table ({'/'.join(CASCADES)}) : ").upper()
+    if table not in CASCADES:
+        print("Table inconnue."); return
+    ids = input_ids("IDs séparés par des virgules : ")
+    if not ids: return
+    print_counts(delete_many(db, table, ids))
+
+# ------------------ Intégrité référentielle ------------------
+
+# PRAGMA foreign_keys reste désactivé (chargements sans ordre parent -> enfant,
+# bases existantes déjà orphelines) : ce contrôle ensembliste en tient lieu.
+INTEGRITY_SAMPLES = 10
+# Règles transverses : (nom, table, colonne montrée, condition de faute, réparation)
+_GW_SALLE = "(SELECT G.NUM_SALLE FROM GATEWAY G WHERE G.NUM_GATEWAY = CAPTEUR.NUM_GATEWAY)"
+INTEGRITY_RULES = [
+    ("CAPTEUR.NUM_SALLE = salle de sa gateway", "CAPTEUR", "NUM_CAPTEUR",
+     f"{_GW_SALLE} IS NOT CAPTEUR.NUM_SALLE AND {_GW_SALLE} IS NOT NULL",
+     f"UPDATE CAPTEUR SET NUM_SALLE = {_GW_SALLE} WHERE {{pred}}"),
+]
+
+def integrity_checks(cur):
+    """Une anti-jointure (NOT EXISTS sur la clé du parent) par clé étrangère
+    déclarée, parents avant enfants, puis les données rattachées sans clé
+    déclarée (relevés, agrégats) et les règles transverses. Réparation :
+    « cascade » (cascade_delete) ou ordre SQL ensembliste."""
+    checks = []
+    fks = [(table, fk[3], fk[2], fk[4]) for table in TABLES
+           for fk in cur.execute(f"PRAGMA foreign_key_list({table})").fetchall()]
+    fks += [(dep, col, parent, col) for parent, deps in DEPENDANTS.items()
+            for dep, col in deps if table_exists(cur, dep)]
+    for table, col, parent, pcol in fks:
+        pred = f"NOT EXISTS (SELECT 1 FROM {parent} P WHERE P.{pcol} = {table}.{col})"
+        repair = "cascade" if table in CASCADES else "DELETE FROM {table} WHERE {pred}"
+        checks.append((f"{table}.{col} -> {parent}", table, AUTO_ID.get(table, col), pred, repair))
+    return checks + INTEGRITY_RULES
+
+def check_integrity(cur, samples=INTEGRITY_SAMPLES):
+    """Rapport : par contrôle, lignes fautives, durée et premiers exemples."""
+    report = []
+    for name, table, show, pred, _ in integrity_checks(cur):
+        t0 = time.perf_counter()
+        n, first = 0, []
+        for (v,) in cur.execute(f"SELECT {show} FROM {table} WHERE {pred}"):
+            n += 1
+            if len(first) < samples:
+                first.append(v)
+        report.append({"controle": name, "lignes": n, "ms": (time.perf_counter() - t0) * 1000,
+                       "exemples": first})
+    if table_exists(cur, "INVENTAIRE"):
+        t0 = time.perf_counter()
+        missing, extra = check_inventaire(cur)
+        report.append({"controle": "INVENTAIRE = jointure", "lignes": missing + extra,
+                       "ms": (time.perf_counter() - t0) * 1000, "exemples": []})
+    return report
+
+def repair_integrity(db, dry_run=False):
+    """Réparation en une transaction, dans l'ordre des contrôles : orphelins
+    supprimés (avec leurs dépendances), capteurs ramenés dans la salle de
+    leur gateway, inventaire recalculé s'il diverge. Tout est annulé si un
+    contrôle échoue encore après coup, ou à la fin en simulation.
+    Renvoie le nombre de lignes touchées par table."""
+    cur = db.cursor()
+    counts = {}
+    db.commit()
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        for _, table, show, pred, repair in integrity_checks(cur):
+            if repair == "cascade":
+                ids = [r[0] for r in cur.execute(f"SELECT {show} FROM {table} WHERE {pred}")]
+                done = cascade_delete(cur, table, ids) if ids else {}
+            else:
+                done = {table: cur.execute(repair.format(table=table, pred=pred)).rowcount}
+            for t, n in done.items():
+                if n:
+                    counts[t] = counts.get(t, 0) + n
+        if table_exists(cur, "INVENTAIRE") and any(check_inventaire(cur)):
+            counts["INVENTAIRE"] = rebuild_inventaire(cur)
+        left = [r["controle"] for r in check_integrity(cur, samples=0) if r["lignes"]]
+        if left:
+            raise RuntimeError("contrôles toujours en échec après réparation : " + ", ".join(left))
+        cur.execute("ROLLBACK" if dry_run else "COMMIT")
+    except BaseException:
+        cur.execute("ROLLBACK")
+        raise
+    topology_cache.invalidate()
+    return counts
+
+def show_integrity(report):
+    head = ("Contrôle", "Lignes", "ms", "Exemples")
+    rows = [(r["controle"], r["lignes"], round(r["ms"], 1),
+             ", ".join(map(str, r["exemples"])) + (" ..." if r["lignes"] > len(r["exemples"]) else ""))
+            for r in report]
+    print(draw_page(head, rows, col_widths(head, rows)))
+
+# ------------------ Import en masse (CSV / JSONL) ------------------
+
+# table : (clé primaire, colonnes de données (la 1re = nom), références FK)
+ENTITES = {
+    "BATIMENT":    ("NUM_BATIMENT", ["NOM_BATIMENT"], {}),
+    "SALLE":       ("NUM_SALLE", ["NOM_SALLE"], {"NUM_BATIMENT": "BATIMENT"}),
+    "SERVEUR":     ("NUM_SERVEUR", ["ADRESSE_IP"], {}),
+    "APPLICATION": ("NUM_APPLICATION", ["NOM_APPLICATION"], {}),
+    "TYPE":        ("NUM_TYPE", ["NOM_TYPE", "UNITE"], {}),
+    "RESEAU":      ("NUM_RESEAU", ["TYPE_RESEAU", "DEBIT_RESEAU"], {}),
+    "GATEWAY":     ("NUM_GATEWAY", ["NOM_GATEWAY"],
+                    {"NUM_SALLE": "SALLE", "NUM_SERVEUR": "SERVEUR"}),
+    "CAPTEUR":     ("NUM_CAPTEUR", ["NOM_CAPTEUR"],
+                    {"NUM_SALLE": "SALLE", "NUM_GATEWAY": "GATEWAY",
+                     "NUM_TYPE": "TYPE", "NUM_RESEAU": "RESEAU"}),
+    "APP_SRV_CONNEXION": (None, [], {"NUM_APPLICATION": "APPLICATION", "NUM_SERVEUR": "SERVEUR"}),
+}
+INT_COLS = {"DEBIT_RESEAU"}
+IMPORT_BATCH = 10000
+AMBIGU = object()      # plusieurs lignes portent ce nom
+
+def insert_sql(table):
+    """INSERT dans l'ordre des valeurs produites par Importer.convert."""
+    key, cols, refs = ENTITES[table]
+    names = cols + list(refs) + ([key] if key else [])
+    return f"INSERT INTO {table}({', '.join(names)}) VALUES ({', '.join('?' * len(names))})"
+
+def read_records(path):
+    """Lit un CSV (avec entête) ou un JSONL ligne par ligne, sans tout charger."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith((".jsonl", ".json", ".ndjson")):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+class Importer:
+    """Charge des lignes par lots (executemany, une transaction par lot).
+    Les références se donnent par ID (NUM_SALLE=2001) ou par nom (SALLE=TD1 ;
+    une salle peut être qualifiée par BATIMENT=...). Les lignes invalides
+    vont dans le fichier de rejets (JSONL) sans interrompre le chargement."""
+
+    def __init__(self, db, batch=IMPORT_BATCH, rejects=None):
+        self.db, self.cur = db, db.cursor()
+        self.batch = batch
+        self.rejects = rejects
+        self.names, self.ids = {}, {}
+        self.alloc = IdAllocator(db, block=max(batch, ID_BLOCK))
+
+    def _load(self, table):
+        if table in self.ids:
+            return
+        key, cols, _ = ENTITES[table]
+        names, ids = {}, set()
+        sql = f"SELECT {key}, {cols[0]} FROM {table}"
+        if table == "SALLE":
+            sql = "SELECT S.NUM_SALLE, S.NOM_SALLE, B.NOM_BATIMENT FROM SALLE S JOIN BATIMENT B USING (NUM_BATIMENT)"
+        for r in self.cur.execute(sql):
+            self._remember(table, names, ids, r)
+        self.names[table], self.ids[table] = names, ids
+
+    @staticmethod
+    def _remember(table, names, ids, r):
+        ids.add(r[0])
+        keys = [r[1]] + ([(r[2], r[1])] if table == "SALLE" else [])
+        for k in keys:
+            names[k] = AMBIGU if k in names and names[k] != r[0] else r[0]
+
+    def _ref(self, table, col, row):
+        """ID référencé par `row` (colonne FK ou nom de la table)."""
+        self._load(table)
+        v = row.get(col)
+        if v not in (None, ""):
+            rid = int(v)
+            if rid not in self.ids[table]:
+                raise ValueError(f"{col}={rid} inconnu")
+            return rid
+        name = row.get(table)
+        if name in (None, ""):
+            raise ValueError(f"{col} ou {table} manquant")
+        rid = None
+        if table == "SALLE" and row.get("BATIMENT"):
+            rid = self.names["SALLE"].get((row["BATIMENT"], name))
+        if rid is None:
+            rid = self.names[table].get(name)
+        if rid is None:
+            raise ValueError(f"{table} '{name}' inconnu")
+        if rid is AMBIGU:
+            raise ValueError(f"{table} '{name}' ambigu (préciser {col})")
+        return rid
+
+    def convert(self, table, row):
+        """Dictionnaire lu -> tuple de valeurs dans l'ordre des colonnes."""
+        key, cols, refs = ENTITES[table]
+        values = []
+        for c in cols:
+            v = row.get(c)
+            if v in (None, ""):
+                raise ValueError(f"{c} manquant")
+            values.append(int(v) if c in INT_COLS else str(v))
+        values += [self._ref(t, c, row) for c, t in refs.items()]
+        if key is not None:
+            v = row.get(key)
+            values.append(int(v) if v not in (None, "") else self.alloc.next(table))
+        return tuple(values)
+
+    def _reject(self, table, lineno, row, err):
+        if self.rejects is not None:
+            self.rejects.write(json.dumps({"table": table, "ligne": lineno, "erreur": str(err),
+                                           "donnees": row}, ensure_ascii=False, default=str) + "\n")
+
+    def _flush(self, table, sql, batch):
+        """Insère un lot ; en cas de conflit, rejoue ligne à ligne pour isoler les fautives."""
+        try:
+            with self.db:
+                self.cur.executemany(sql, [v for _, _, v in batch])
+            return batch
+        except sqlite3.DatabaseError:
+            pass
+        done = []
+        with self.db:
+            self.cur.execute("BEGIN")
+            for item in batch:
+                try:
+                    self.cur.execute("SAVEPOINT ligne")
+                    self.cur.execute(sql, item[2])
+                    self.cur.execute("RELEASE ligne")
+                    done.append(item)
+                except sqlite3.DatabaseError as e:
+                    self.cur.execute("ROLLBACK TO ligne"); self.cur.execute("RELEASE ligne")
+                    self._reject(table, item[0], item[1], e)
+        return done
+
+    def _commit_names(self, table, done):
+        # SALLE : cache rechargé en fin de fichier (noms qualifiés par bâtiment)
+        if table in self.ids and table != "SALLE":
+            for _, _, v in done:
+                self._remember(table, self.names[table], self.ids[table], (v[-1], v[0]))
+
+    def run(self, table, records):
+        """Importe `records` dans `table`. Renvoie (insérées, rejetées, secondes)."""
+        sql = insert_sql(table)
+        ok = ko = 0
+        t0 = time.perf_counter()
+        batch = []
+        for lineno, row in enumerate(records, 1):
+            try:
+                batch.append((lineno, row, self.convert(table, row)))
+            except (ValueError, TypeError) as e:
+                self._reject(table, lineno, row, e); ko += 1
+            if len(batch) >= self.batch:
+                done = self._flush(table, sql, batch)
+                self._commit_names(table, done)
+                ok += len(done); ko += len(batch) - len(done); batch = []
+        if batch:
+            done = self._flush(table, sql, batch)
+            self._commit_names(table, done)
+            ok += len(done); ko += len(batch) - len(done)
+        if table == "SALLE":
+            self.ids.pop("SALLE", None)   # noms qualifiés à recharger
+        self.alloc.release()
+        topology_cache.invalidate()
+        return ok, ko, time.perf_counter() - t0
+
+# ordre de chargement : les tables référencées d'abord
+IMPORT_ORDER = ["BATIMENT", "SALLE", "SERVEUR", "APPLICATION", "TYPE", "RESEAU",
+                "GATEWAY", "CAPTEUR", "APP_SRV_CONNEXION"]
+
+def import_files(db, specs, batch=IMPORT_BATCH, rejects_path="rejets.jsonl"):
+    """specs : liste de 'TABLE=fichier' ou 'fichier' (table = nom du fichier)."""
+    jobs = []
+    for spec in specs:
+        table, _, path = spec.rpartition("=")
+        if not table:
+            table = os.path.splitext(os.path.basename(path))[0]
+        table = table.upper()
+        if table not in ENTITES:
+            raise ValueError(f"Table inconnue : {table}")
+        jobs.append((IMPORT_ORDER.index(table), table, path))
+    total_ko = 0
+    with open(rejects_path, "w", encoding="utf-8") as rej:
+        imp = Importer(db, batch=batch, rejects=rej)
+        for _, table, path in sorted(jobs):
+            ok, ko, dt = imp.run(table, read_records(path))
+            total_ko += ko
+            print(f"{table:<18} {ok:>9} lignes, {ko:>6} rejets, {dt:7.2f} s, "
+                  f"{ok / dt if dt else 0:,.0f} lignes/s")
+    if total_ko:
+        print(f"Rejets : {rejects_path}")
+    else:
+        os.remove(rejects_path)
+
+# ------------------ Scripts d'opérations (insert / update / delete) ------------------
+
+# Une opération par enregistrement (liste JSON, JSONL, YAML ou CSV à entête) :
+#   {"op": "insert", "table": "CAPTEUR", "NOM_CAPTEUR": "T1", "SALLE": "TD1", "GATEWAY": "GW1", ...}
+#   {"op": "update", "table": "CAPTEUR", "CAPTEUR": "T1", "RESEAU": "LoRaWAN"}
+#   {"op": "delete", "table": "SALLE", "NUM_SALLE": 2004}
+# Références comme pour l'import : par ID (NUM_SALLE) ou par nom (SALLE).
+# Pour update / delete, la ligne visée est donnée de la même façon dans la
+# table de l'opération ; les autres champs sont les nouvelles valeurs.
+SCRIPT_OPS = ("insert", "update", "delete")
+KEY_TABLES = {key: t for t, (key, _, _) in ENTITES.items() if key}
+
+def read_script(path):
+    """Opérations d'un script : liste JSON, JSONL, YAML (PyYAML) ou CSV."""
+    low = path.lower()
+    if low.endswith((".yaml", ".yml")):
+        if yaml is None:
+            raise RuntimeError("Script YAML : module PyYAML absent (pip install pyyaml).")
+        with open(path, encoding="utf-8") as f:
+            ops = yaml.safe_load(f) or []
+    elif low.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            try:
+                ops = json.load(f)
+            except json.JSONDecodeError:      # JSONL nommé .json
+                return list(read_records(path))
+    else:
+        return list(read_records(path))
+    if isinstance(ops, dict):
+        ops = ops.get("operations", [ops])
+    return ops
+
+def script_fields(table):
+    key, cols, refs = ENTITES[table]
+    fields = {"OP", "TABLE", table, *cols, *refs, *refs.values()} | ({key} if key else set())
+    return fields | ({"BATIMENT"} if "SALLE" in fields else set())
+
+class ScriptPlan(Importer):
+    """Valide un script entier avant toute écriture. Les IDs et noms cités
+    sont chargés en une requête par table ; les insertions reçoivent leur ID
+    d'avance, si bien qu'une ligne insérée peut être citée plus bas par son
+    nom. Chaque opération devient (ligne, op, table, sql, paramètres) ;
+    les erreurs sont toutes collectées dans self.errors."""
+
+    def __init__(self, db, dry_run=False):
+        super().__init__(db)
+        self.dry_run = dry_run
+        self.errors = []
+
+    @staticmethod
+    def normalize(row):
+        if not isinstance(row, dict):
+            raise ValueError("opération attendue sous forme d'objet")
+        row = {str(k).upper(): v for k, v in row.items() if v not in (None, "")}
+        row["OP"] = str(row.get("OP", "")).lower()
+        row["TABLE"] = table = str(row.get("TABLE", "")).upper()
+        if row["OP"] not in SCRIPT_OPS:
+            raise ValueError(f"op '{row['OP']}' inconnue ({', '.join(SCRIPT_OPS)})")
+        if table not in ENTITES:
+            raise ValueError(f"table '{table}' inconnue")
+        extra = set(row) - script_fields(table)
+        if extra:
+            raise ValueError(f"champ(s) inconnu(s) pour {table} : {', '.join(sorted(extra))}")
+        for t in ENTITES:
+            if t in row:
+                row[t] = str(row[t])
+        return row
+
+    def prefetch(self, rows):
+        """Une requête par table pour toutes les lignes citées par ID ou par nom."""
+        ids = {t: set() for t in KEY_TABLES.values()}
+        names = {t: set() for t in ids}
+        for row in rows:
+            for k, v in row.items():
+                if k in KEY_TABLES:
+                    with contextlib.suppress(ValueError, TypeError):
+                        ids[KEY_TABLES[k]].add(int(v))
+                elif k in names:
+                    names[k].add(v)
+        for table in ids:
+            key, cols, _ = ENTITES[table]
+            self.names[table], self.ids[table] = {}, set()
+            if not (ids[table] or names[table]):
+                continue
+            sql = f"SELECT T.{key}, T.{cols[0]} FROM {table} T"
+            if table == "SALLE":
+                sql = "SELECT T.NUM_SALLE, T.NOM_SALLE, B.NOM_BATIMENT FROM SALLE T LEFT JOIN BATIMENT B USING (NUM_BATIMENT)"
+            sql += f" WHERE T.{key} IN {_IDS} OR T.{cols[0]} IN (SELECT value FROM json_each(:noms))"
+            for r in self.cur.execute(sql, {"ids": json.dumps(sorted(ids[table])),
+                                            "noms": json.dumps(sorted(names[table]))}):
+                self._remember(table, self.names[table], self.ids[table], r)
+
+    def reserve(self, rows):
+        """IDs des insertions sans clé : un bloc exact par table."""
+        need = {}
+        for row in rows:
+            key = ENTITES[row["TABLE"]][0]
+            if row["OP"] == "insert" and key and key not in row:
+                need[row["TABLE"]] = need.get(row["TABLE"], 0) + 1
+        for table, n in need.items():
+            first = reserve_ids(self.db, table, n, dry_run=self.dry_run or bool(self.errors))
+            self.alloc.ranges[table] = [first, first + n]
+
+    def _ref(self, table, col, row):
+        rid = super()._ref(table, col, row)
+        if rid not in self.ids[table]:
+            raise ValueError(f"{table} {rid} supprimé plus haut dans le script")
+        return rid
+
+    def compile_op(self, row):
+        op, table = row["OP"], row["TABLE"]
+        key, cols, refs = ENTITES[table]
+        if op == "insert":
+            values = self.convert(table, row)
+            if key is not None:
+                if key in row and values[-1] in self.ids[table]:
+                    raise ValueError(f"{key}={values[-1]} existe déjà")
+                self._remember(table, self.names[table], self.ids[table],
+                               (values[-1], values[0], row.get("BATIMENT")))
+            return op, table, insert_sql(table), values
+        if key is None:       # APP_SRV_CONNEXION : pas de clé propre
+            if op == "update":
+                raise ValueError(f"{table} : rien à modifier (delete puis insert)")
+            return (op, table, f"DELETE FROM {table} WHERE " + " AND ".join(f"{c}=?" for c in refs),
+                    tuple(self._ref(t, c, row) for c, t in refs.items()))
+        target = self._ref(table, key, row)
+        if op == "delete":
+            self.ids[table].discard(target)
+            return op, table, None, target
+        sets, values = [], []
+        for c in cols:
+            if c in row:
+                sets.append(c)
+                values.append(int(row[c]) if c in INT_COLS else str(row[c]))
+        for c, t in refs.items():
+            if c in row or t in row:
+                sets.append(c)
+                values.append(self._ref(t, c, row))
+        if not sets:
+            raise ValueError("aucune colonne à modifier")
+        if cols[0] in sets:
+            self._remember(table, self.names[table], self.ids[table], (target, values[0], None))
+        return (op, table, f"UPDATE {table} SET {', '.join(c + '=?' for c in sets)} WHERE {key}=?",
+                tuple(values) + (target,))
+
+    def compile(self, records):
+        """Enregistrements lus -> plan exécutable (vide si self.errors)."""
+        rows = []
+        for lineno, rec in enumerate(records, 1):
+            try:
+                rows.append((lineno, self.normalize(rec)))
+            except ValueError as e:
+                self.errors.append((lineno, str(e)))
+        self.prefetch(r for _, r in rows)
+        self.reserve(r for _, r in rows)
+        plan = []
+        for lineno, row in rows:
+            try:
+                plan.append((lineno,) + self.compile_op(row))
+            except (ValueError, TypeError) as e:
+                self.errors.append((lineno, str(e)))
+        self.errors.sort()
+        return [] if self.errors else plan
+
+def run_plan(db, plan, chunk=None, dry_run=False):
+    """Exécute le plan en une transaction, ou une par tranche de `chunk`
+    opérations (jamais en simulation : tout est annulé à la fin). Les
+    opérations consécutives de même forme partent en un seul executemany,
+    les suppressions consécutives d'une table en un seul cascade_delete.
+    Une erreur annule la tranche en cours (ValueError avec les lignes fautives ;
+    les tranches précédentes restent validées). Renvoie {(op, table): lignes}."""
+    cur = db.cursor()
+    counts = {}
+    size = len(plan) if dry_run or not chunk else chunk
+    db.commit()
+    for start in range(0, len(plan), size or 1):
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            for (op, table, sql), group in itertools.groupby(plan[start:start + size], key=lambda p: p[1:4]):
+                group = list(group)
+                try:
+                    if sql is None:
+                        res = cascade_delete(cur, table, [g[4] for g in group])
+                    else:
+                        cur.executemany(sql, [g[4] for g in group])
+                        res = {table: cur.rowcount}
+                except sqlite3.DatabaseError as e:
+                    lines = f"{group[0][0]}-{group[-1][0]}" if len(group) > 1 else group[0][0]
+                    raise ValueError(f"ligne(s) {lines} ({op} {table}) : {e}"
+                                     + (f" ; {start} opération(s) déjà validée(s)" if start else "")) from e
+                for t, n in res.items():
+                    counts[(op, t)] = counts.get((op, t), 0) + n
+            cur.execute("ROLLBACK" if dry_run else "COMMIT")
+            if not dry_run:
+                topology_cache.invalidate()
+        except BaseException:
+            cur.execute("ROLLBACK")
+            raise
+    return counts
+
+# ------------------ Mesures (séries temporelles) ------------------
+
+MESURE_BATCH = 50000      # relevés par commit groupé
+MESURE_DELAY = 1.0        # secondes max. entre deux commits
+
+def now_ms():
+    return int(time.time() * 1000)
+
+class MesureBuffer:
+    """Tampon d'ingestion : les relevés s'accumulent en mémoire et sont
+    écrits par executemany, un commit pour `batch` relevés (ou toutes les
+    `delay` secondes). Un même (capteur, instant) reçu deux fois n'est
+    compté qu'une fois (le premier reçu est gardé)."""
+
+    def __init__(self, db, batch=MESURE_BATCH, delay=MESURE_DELAY, writer=None):
+        self.db, self.writer = db, writer      # writer : voir WriterThread
+        self.cur = db.cursor() if db is not None else None
+        self.batch, self.delay = batch, delay
+        self.rows = []
+        self.last = time.monotonic()
+        self.total = 0
+        self.pending = []
+
+    def add(self, num_capteur, horodatage, valeur):
+        self.rows.append((num_capteur, horodatage, valeur))
+        if len(self.rows) >= self.batch or time.monotonic() - self.last >= self.delay:
+            self.flush()
+
+    def add_many(self, readings):
+        for r in readings:
+            self.rows.append(r)
+            if len(self.rows) >= self.batch:
+                self.flush()
+        if time.monotonic() - self.last >= self.delay:
+            self.flush()
+
+    def flush(self):
+        rows, self.rows = self.rows, []
+        self.last = time.monotonic()
+        if not rows:
+            return 0
+        if self.writer is not None:
+            self.pending.append(self.writer.submit(store_readings, rows))
+            return len(rows)
+        with self.db:
+            n = store_readings(self.cur, rows)
+        self.total += n
+        return n
+
+    def close(self):
+        """Vide le tampon et attend les lots confiés à l'écrivain."""
+        self.flush()
+        for f in self.pending:
+            self.total += f.result()
+        self.pending = []
+        return self.total
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def store_readings(cur, rows, now=None):
+    """Écrit un lot de relevés et met à jour les agrégats, dans la
+    transaction de l'appelant. Les relevés plus vieux que la rétention des
+    bruts sont ignorés. Renvoie le nombre de relevés nouveaux."""
+    cur.execute("""CREATE TEMP TABLE IF NOT EXISTS LOT_MESURE (
+                   NUM_CAPTEUR INTEGER, HORODATAGE INTEGER, VALEUR REAL,
+                   primary key (NUM_CAPTEUR, HORODATAGE)) WITHOUT ROWID""")
+    cur.execute("DELETE FROM temp.LOT_MESURE")
+    cur.executemany("INSERT OR IGNORE INTO temp.LOT_MESURE VALUES (?,?,?)", rows)
+    # déjà purgés : l'absence en base ne prouve plus qu'ils sont nouveaux
+    if RETENTION["brut"] is not None:
+        now = now_ms() if now is None else now
+        cur.execute("DELETE FROM temp.LOT_MESURE WHERE HORODATAGE < ?", (now - RETENTION["brut"],))
+    # déjà en base (réémission d'une passerelle) : ni réinséré ni recompté
+    cur.execute("""DELETE FROM temp.LOT_MESURE WHERE EXISTS (
+                   SELECT 1 FROM MESURE M WHERE M.NUM_CAPTEUR = LOT_MESURE.NUM_CAPTEUR
+                   AND M.HORODATAGE = LOT_MESURE.HORODATAGE)""")
+    n = cur.execute("INSERT INTO MESURE SELECT * FROM temp.LOT_MESURE").rowcount
+    update_rollups(cur, "temp.LOT_MESURE")
+    return n
+
+def simulate_readings(capteurs, n, debut=None, pas_ms=1000, seed=0):
+    """Passerelle simulée : n relevés répartis sur `capteurs`, un tour de
+    tous les capteurs toutes les `pas_ms` ms. Générateur de (capteur, ms, valeur)."""
+    rnd = random.Random(seed)
+    debut = now_ms() if debut is None else debut
+    base = {c: rnd.uniform(15.0, 25.0) for c in capteurs}
+    t, produced = debut, 0
+    while produced < n:
+        for c in capteurs:
+            if produced >= n:
+                return
+            base[c] += rnd.uniform(-0.1, 0.1)
+            yield c, t, round(base[c], 2)
+            produced += 1
+        t += pas_ms
+
+def encode_readings(readings):
+    """Format datagramme : une ligne 'capteur;ms;valeur' par relevé."""
+    return "".join(f"{c};{t};{v}\n" for c, t, v in readings).encode()
+
+def decode_readings(data):
+    for line in data.decode(errors="replace").splitlines():
+        try:
+            c, t, v = line.split(";")
+            yield int(c), int(t), float(v)
+        except ValueError:
+            continue      # ligne mal formée : ignorée
+
+def udp_send(readings, host, port, per_datagram=40):
+    """Envoie les relevés en datagrammes UDP (une passerelle réelle ferait pareil)."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        chunk = []
+        for r in readings:
+            chunk.append(r)
+            if len(chunk) >= per_datagram:
+                sock.sendto(encode_readings(chunk), (host, port)); chunk = []
+        if chunk:
+            sock.sendto(encode_readings(chunk), (host, port))
+
+def udp_gateway(db, host="127.0.0.1", port=5684, duree=None, buffer=None):
+    """Reçoit des relevés UDP et les ingère jusqu'à `duree` secondes (ou Ctrl-C)."""
+    buf = buffer or MesureBuffer(db)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind((host, port))
+        sock.settimeout(buf.delay)
+        fin = None if duree is None else time.monotonic() + duree
+        try:
+            while fin is None or time.monotonic() < fin:
+                try:
+                    data, _ = sock.recvfrom(65535)
+                except socket.timeout:
+                    buf.flush(); continue
+                buf.add_many(decode_readings(data))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            buf.flush()
+    return buf.total
+
+def ingest_simulation(db, n, batch=MESURE_BATCH):
+    """Pousse n relevés simulés sur tous les capteurs ; renvoie (n, secondes)."""
+    capteurs = [r[0] for r in db.execute("SELECT NUM_CAPTEUR FROM CAPTEUR ORDER BY NUM_CAPTEUR")]
+    if not capteurs:
+        raise ValueError("Aucun capteur : rien à simuler.")
+    t0 = time.perf_counter()
+    with MesureBuffer(db, batch=batch) as buf:
+        buf.add_many(simulate_readings(capteurs, n))
+    return buf.total, time.perf_counter() - t0
+
+# ------------------ Agrégats & rétention ------------------
+
+MINUTE, HEURE, JOUR = 60_000, 3_600_000, 86_400_000
+RESOLUTIONS = (MINUTE, HEURE, JOUR)
+MAX_POINTS = 500          # points visés quand aucun pas n'est demandé
+# Âge maximal conservé (ms) : "brut" = MESURE ; None = illimité.
+RETENTION = {"brut": 30 * JOUR, MINUTE: 90 * JOUR, HEURE: 730 * JOUR, JOUR: None}
+
+# niveau : (table, colonne d'entité, jointure depuis le lot, colonnes ventilées)
+NIVEAUX = {
+    "capteur": ("AGREGAT_CAPTEUR", "NUM_CAPTEUR", "", ["L.NUM_CAPTEUR"]),
+    "salle": ("AGREGAT_SALLE", "NUM_SALLE",
+              "JOIN CAPTEUR C ON C.NUM_CAPTEUR = L.NUM_CAPTEUR",
+              ["C.NUM_SALLE", "C.NUM_TYPE"]),
+    "batiment": ("AGREGAT_BATIMENT", "NUM_BATIMENT",
+                 "JOIN CAPTEUR C ON C.NUM_CAPTEUR = L.NUM_CAPTEUR "
+                 "JOIN SALLE S ON S.NUM_SALLE = C.NUM_SALLE",
+                 ["S.NUM_BATIMENT", "C.NUM_TYPE"]),
+}
+
+def update_rollups(cur, source):
+    """Cumule les relevés de `source` dans les agrégats (UPSERT) :
+    chaque lot est ajouté, rien n'est recalculé. Le lot est d'abord réduit
+    par (capteur, minute), puis les 9 agrégats partent de ce résumé."""
+    cur.execute("DROP TABLE IF EXISTS temp.LOT_MINUTE")
+    cur.execute(f"""
+        CREATE TEMP TABLE LOT_MINUTE AS
+        SELECT NUM_CAPTEUR, HORODATAGE / {MINUTE} * {MINUTE} AS DEBUT,
+               COUNT(*) AS NB, SUM(VALEUR) AS SOMME, MIN(VALEUR) AS MINI, MAX(VALEUR) AS MAXI
+        FROM {source}
+        GROUP BY NUM_CAPTEUR, HORODATAGE / {MINUTE}""")
+    for table, _, join, keys in NIVEAUX.values():
+        cols = column_names(cur, table)[:len(keys) + 2]      # entité(s), RESOLUTION, DEBUT
+        for r in RESOLUTIONS:
+            cur.execute(f"""
+                INSERT INTO {table}({", ".join(cols)}, NB, SOMME, MINI, MAXI)
+                SELECT {", ".join(keys)}, {r}, L.DEBUT / {r} * {r},
+                       SUM(L.NB), SUM(L.SOMME), MIN(L.MINI), MAX(L.MAXI)
+                FROM temp.LOT_MINUTE L {join}
+                WHERE true
+                GROUP BY {", ".join(keys)}, L.DEBUT / {r}
+                ON CONFLICT DO UPDATE SET
+                    NB = NB + excluded.NB, SOMME = SOMME + excluded.SOMME,
+                    MINI = min(MINI, excluded.MINI), MAXI = max(MAXI, excluded.MAXI)
+            """)
+    cur.execute("DROP TABLE temp.LOT_MINUTE")
+
+def rebuild_rollups(db):
+    """Recalcule tous les agrégats depuis MESURE (après un import brut)."""
+    with db:
+        cur = db.cursor()
+        for table, *_ in NIVEAUX.values():
+            cur.execute(f"DELETE FROM {table}")
+        update_rollups(cur, "MESURE")
+
+def purge(db, retention=RETENTION, now=None):
+    """Applique la rétention ; renvoie le nombre de lignes supprimées par table."""
+    now = now_ms() if now is None else now
+    counts = {}
+    with db:
+        cur = db.cursor()
+        if retention.get("brut") is not None:
+            counts["MESURE"] = cur.execute("DELETE FROM MESURE WHERE HORODATAGE < ?",
+                                           (now - retention["brut"],)).rowcount
+        for r in RESOLUTIONS:
+            if retention.get(r) is None:
+                continue
+            for table, *_ in NIVEAUX.values():
+                n = cur.execute(f"DELETE FROM {table} WHERE RESOLUTION = ? AND DEBUT < ?",
+                                (r, now - retention[r])).rowcount
+                counts[table] = counts.get(table, 0) + n
+    return counts
+
+def choose_resolution(debut, fin, pas=None, now=None, retention=RETENTION):
+    """Résolution la plus grossière <= pas encore conservée à `debut`,
+    ou None s'il faut lire les relevés bruts."""
+    now = now_ms() if now is None else now
+    pas = pas or max((fin - debut) // MAX_POINTS, 1)
+    for r in sorted(RESOLUTIONS, reverse=True):
+        age = retention.get(r)
+        if r <= pas and (age is None or debut >= now - age):
+            return r
+    return None
+
+def query_series(cur, niveau, ident, debut, fin, pas=None, num_type=None, now=None):
+    """Série (début de case, unité, nb, moyenne, min, max) de `niveau`
+    ('capteur', 'salle', 'batiment') sur [debut, fin[, en ms.
+    Renvoie (résolution lue, lignes) ; résolution None = relevés bruts."""
+    table, col, _, _ = NIVEAUX[niveau]
+    r = choose_resolution(debut, fin, pas, now)
+    pas = pas or r or max((fin - debut) // MAX_POINTS, 1)
+    if r is None and niveau != "capteur":
+        r = RESOLUTIONS[0]             # pas de brut par salle : la plus fine
+    if r is None:
+        sql = f"""
+            SELECT M.HORODATAGE / {pas} * {pas} AS D, T.UNITE, COUNT(*),
+                   AVG(M.VALEUR), MIN(M.VALEUR), MAX(M.VALEUR)
+            FROM MESURE M
+            JOIN CAPTEUR C ON C.NUM_CAPTEUR = M.NUM_CAPTEUR
+            JOIN TYPE T    ON T.NUM_TYPE = C.NUM_TYPE
+            WHERE M.NUM_CAPTEUR = :id AND M.HORODATAGE >= :debut AND M.HORODATAGE < :fin
+            GROUP BY D ORDER BY D"""
+    else:
+        type_join = ("JOIN CAPTEUR C ON C.NUM_CAPTEUR = A.NUM_CAPTEUR JOIN TYPE T ON T.NUM_TYPE = C.NUM_TYPE"
+                     if niveau == "capteur" else "JOIN TYPE T ON T.NUM_TYPE = A.NUM_TYPE")
+        filtre = "" if num_type is None else "AND T.NUM_TYPE = :type"
+        sql = f"""
+            SELECT A.DEBUT / {pas} * {pas} AS D, T.UNITE, SUM(A.NB),
+                   SUM(A.SOMME) / SUM(A.NB), MIN(A.MINI), MAX(A.MAXI)
+            FROM {table} A {type_join}
+            WHERE A.{col} = :id AND A.RESOLUTION = {r}
+              AND A.DEBUT >= :debut AND A.DEBUT < :fin {filtre}
+            GROUP BY D, T.NUM_TYPE ORDER BY D, T.NUM_TYPE"""
+    rows = cur.execute(sql, {"id": ident, "debut": debut, "fin": fin, "type": num_type}).fetchall()
+    return r, rows
+
+# ------------------ Concurrence (WAL, écrivain unique) ------------------
+
+BUSY_TIMEOUT = 30.0       # secondes d'attente d'un verrou avant erreur
+GROUP_DELAY = 0.01        # fenêtre max. de regroupement des écritures (s)
+GROUP_MAX = 1000          # opérations max. par commit groupé
+QUEUE_MAX = 64            # file bornée : les producteurs attendent l'écrivain
+READERS = 4
+
+# WriterThread sérialise les écritures d'un même processus (API, charge).
+# La console reste sur sa connexion : un seul utilisateur, une écriture à la
+# fois, et le verrou de SQLite (BEGIN + busy_timeout) la fait attendre
+# l'écrivain d'un autre processus au lieu d'échouer.
+
+def connect(path, timeout=BUSY_TIMEOUT, **kw):
+    """Connexion en écriture : WAL (lecteurs jamais bloqués par l'écrivain),
+    synchronous=NORMAL (fsync au checkpoint, pas à chaque commit)."""
+    db = sqlite3.connect(path, timeout=timeout, **kw)
+    if path != ":memory:":
+        db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+def readonly_uri(path):
+    """URI `mode=ro` : ni création, ni changement de journal_mode."""
+    return "file:" + urllib.parse.quote(os.path.abspath(path)) + "?mode=ro"
+
+def connect_readonly(path, timeout=BUSY_TIMEOUT):
+    db = sqlite3.connect(readonly_uri(path), uri=True, timeout=timeout, check_same_thread=False)
+    db.execute("PRAGMA query_only=1")
+    return db
+
+class ReadPool:
+    """Connexions en lecture seule partagées entre threads (une à la fois)."""
+
+    def __init__(self, path, size=READERS):
+        self.free = queue.Queue()
+        self.all = [connect_readonly(path) for _ in range(size)]
+        for db in self.all:
+            self.free.put(db)
+
+    @contextlib.contextmanager
+    def connection(self):
+        db = self.free.get()
+        try:
+            yield db
+        finally:
+            if db.in_transaction:
+                db.rollback()
+            self.free.put(db)
+
+    def close(self):
+        for db in self.all:
+            db.close()
+
+_STOP = object()
+
+class WriterThread(threading.Thread):
+    """Seul écrivain du processus. Les opérations (fonction(cur, *args))
+    arrivent par une file ; celles reçues pendant `delay` secondes (au plus
+    `max_ops`) partagent une transaction et un seul commit. Chaque opération
+    a son SAVEPOINT : une erreur n'annule qu'elle. Le Future n'est résolu
+    qu'après le commit."""
+
+    def __init__(self, path, delay=GROUP_DELAY, max_ops=GROUP_MAX, max_queue=QUEUE_MAX):
+        super().__init__(name="ecrivain", daemon=True)
+        self.path, self.delay, self.max_ops = path, delay, max_ops
+        self.queue = queue.Queue(max_queue)
+        self.commits = self.ops = 0
+        self.start()
+
+    def submit(self, fn, *args):
+        fut = concurrent.futures.Future()
+        self.queue.put((fn, args, fut))
+        return fut
+
+    def call(self, fn, *args):
+        return self.submit(fn, *args).result()
+
+    def execute(self, sql, params=()):
+        return self.submit(lambda cur: cur.execute(sql, params).rowcount)
+
+    def executemany(self, sql, rows):
+        return self.submit(lambda cur: cur.executemany(sql, rows).rowcount)
+
+    def stop(self):
+        self.queue.put(_STOP)
+        self.join()
+
+    def _collect(self, first):
+        ops, stop = [first], False
+        deadline = time.monotonic() + self.delay
+        while len(ops) < self.max_ops:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            try:
+                op = self.queue.get(timeout=left)
+            except queue.Empty:
+                break
+            if op is _STOP:
+                stop = True; break
+            ops.append(op)
+        return ops, stop
+
+    def _apply(self, cur, ops):
+        results = []
+        cur.execute("BEGIN IMMEDIATE")
+        for fn, args, fut in ops:
+            cur.execute("SAVEPOINT op")
+            try:
+                results.append((fut, fn(cur, *args), None))
+                cur.execute("RELEASE op")
+            except Exception as e:
+                cur.execute("ROLLBACK TO op"); cur.execute("RELEASE op")
+                results.append((fut, None, e))
+        cur.execute("COMMIT")
+        return results
+
+    def run(self):
+        db = connect(self.path, isolation_level=None)    # transactions explicites
+        cur = db.cursor()
+        stop = False
+        while not stop:
+            first = self.queue.get()
+            if first is _STOP:
+                break
+            ops, stop = self._collect(first)
+            try:
+                results = self._apply(cur, ops)
+            except Exception as e:          # commit impossible : tout le lot échoue
+                if db.in_transaction:
+                    cur.execute("ROLLBACK")
+                results = [(fut, None, e) for _, _, fut in ops]
+            self.commits += 1
+            self.ops += len(ops)
+            for fut, res, err in results:
+                if err is None:
+                    fut.set_result(res)
+                else:
+                    fut.set_exception(err)
+        db.close()
+
+def load_test(path, ingesters=4, readers=4, seconds=5.0, batch=5000):
+    """Ingestion et lectures simultanées sur le même fichier. Renvoie un
+    dictionnaire de compteurs (relevés, lectures, erreurs, commits)."""
+    writer = WriterThread(path)
+    pool = ReadPool(path, readers)
+    with sqlite3.connect(path) as db:
+        capteurs = [r[0] for r in db.execute("SELECT NUM_CAPTEUR FROM CAPTEUR")]
+    stats = {"releves": 0, "lectures": 0, "erreurs": 0}
+    lock = threading.Lock()
+    t0 = time.monotonic()
+    fin = t0 + seconds
+
+    def ingest(k):
+        # horodatages disjoints par ingesteur
+        gen = simulate_readings(capteurs, 10**12, debut=now_ms() + k, pas_ms=ingesters * 1000, seed=k)
+        buf = MesureBuffer(None, batch=batch, writer=writer)
+        try:
+            while time.monotonic() < fin:
+                buf.add_many(itertools.islice(gen, batch))
+            n = buf.close()
+        except sqlite3.Error:
+            with lock: stats["erreurs"] += 1
+            return
+        with lock: stats["releves"] += n
+
+    def read():
+        views = list(VIEWS)
+        i = 0
+        while time.monotonic() < fin:
+            try:
+                with pool.connection() as db:
+                    keyset_page(db.cursor(), views[i % len(views)])
+                    db.execute("SELECT COUNT(*) FROM MESURE WHERE HORODATAGE >= ?",
+                               (now_ms() - MINUTE,)).fetchone()
+                with lock: stats["lectures"] += 1
+            except sqlite3.Error:
+                with lock: stats["erreurs"] += 1
+            i += 1
+
+    threads = [threading.Thread(target=ingest, args=(k,)) for k in range(ingesters)]
+    threads += [threading.Thread(target=read) for _ in range(readers)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    writer.stop(); pool.close()
+    stats["commits"], stats["ops"] = writer.commits, writer.ops
+    stats["secondes"] = time.monotonic() - t0
+    return stats
+
+# ------------------ API HTTP / JSON (asyncio) ------------------
+
+API_LIMIT = 100           # lignes par page par défaut
+API_LIMIT_MAX = 1000
+STREAM_CHUNK = 500        # lignes par bloc HTTP (Transfer-Encoding: chunked)
+
+class DataVersion:
+    """Compteur de version des données, pour les ETag. PRAGMA data_version
+    change quand une autre connexion a validé une écriture."""
+
+    def __init__(self, path):
+        self.db = connect_readonly(path)
+        self.lock = threading.Lock()
+        self.boot = f"{os.getpid():x}{int(time.time()):x}"
+        self.last, self.n = None, 0
+
+    def etag(self):
+        with self.lock:
+            v = self.db.execute("PRAGMA data_version").fetchone()[0]
+            if v != self.last:
+                self.last, self.n = v, self.n + 1
+            return f'"{self.boot}.{self.n}"'
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip("=")
+
+def decode_cursor(token):
+    return json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+
+def etag_matches(header, etag):
+    """If-None-Match : liste séparée par des virgules, « * », préfixe W/
+    ignoré (comparaison faible, suffisante pour un GET)."""
+    if not header:
+        return False
+    return any(t == "*" or t.removeprefix("W/") == etag
+               for t in (t.strip() for t in header.split(",")))
+
+# Flux Serveur → Gateway → Capteur (même requête que l'ancien show_topologie)
+TOPOLOGIE_SQL = """
+    SELECT SV.NUM_SERVEUR, SV.ADRESSE_IP, G.NUM_GATEWAY, G.NOM_GATEWAY,
+           C.NUM_CAPTEUR, C.NOM_CAPTEUR, R.TYPE_RESEAU
+    FROM SERVEUR SV
+    LEFT JOIN GATEWAY G  ON G.NUM_SERVEUR = SV.NUM_SERVEUR
+    LEFT JOIN CAPTEUR C  ON C.NUM_GATEWAY = G.NUM_GATEWAY
+    LEFT JOIN RESEAU R   ON R.NUM_RESEAU = C.NUM_RESEAU
+    {where}
+    ORDER BY SV.ADRESSE_IP, G.NOM_GATEWAY, C.NOM_CAPTEUR"""
+# Un bloc du flux : même ordre, départagé par les ID, suivi par les index
+# (IDX_SERVEUR_IP, IDX_GATEWAY_SERVEUR, IDX_CAPTEUR_GATEWAY), donc sans tri.
+TOPOLOGIE_PAGE = TOPOLOGIE_SQL.split("ORDER BY")[0] + """ORDER BY SV.ADRESSE_IP, SV.NUM_SERVEUR,
+             G.NOM_GATEWAY, G.NUM_GATEWAY, C.NOM_CAPTEUR, C.NUM_CAPTEUR
+    LIMIT ?"""
+# Reprise après une ligne : reste de la gateway, gateways suivantes du
+# serveur, puis serveurs suivants.
+TOPOLOGIE_SUITE = [
+    ("num_capteur", "SV.NUM_SERVEUR = ? AND G.NUM_GATEWAY = ? AND C.NOM_CAPTEUR >= ?"
+                    " AND (C.NOM_CAPTEUR, C.NUM_CAPTEUR) > (?, ?)", (0, 2, 5, 5, 4)),
+    ("num_gateway", "SV.NUM_SERVEUR = ? AND G.NOM_GATEWAY >= ?"
+                    " AND (G.NOM_GATEWAY, G.NUM_GATEWAY) > (?, ?)", (0, 3, 3, 2)),
+    ("num_serveur", "SV.ADRESSE_IP >= ? AND (SV.ADRESSE_IP, SV.NUM_SERVEUR) > (?, ?)", (1, 1, 0)),
+]
+TOPOLOGIE_COLS = ["num_serveur", "serveur", "num_gateway", "gateway", "num_capteur", "capteur", "reseau"]
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class ApiServer:
+    """Serveur HTTP/1.1 minimal (keep-alive) exposant les vues en JSON.
+    SQLite tourne dans un pool borné de threads, chacun avec une connexion
+    en lecture seule : la boucle asyncio ne fait que de l'E/S réseau.
+
+      GET /batiments | /salles | /capteurs | /gateways  ?limite=N&apres=CURSEUR
+      GET /topologie[?serveur=ID]                       flux chunked
+    Réponses avec ETag ; If-None-Match correspondant -> 304."""
+
+    STATUS = {200: "OK", 304: "Not Modified", 400: "Bad Request",
+              404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+    def __init__(self, path, readers=READERS):
+        self.pool = ReadPool(path, readers)
+        self.executor = concurrent.futures.ThreadPoolExecutor(readers, thread_name_prefix="sqlite")
+        self.version = DataVersion(path)
+        self.slots = None          # asyncio.Semaphore, créé dans la boucle
+        self.readers = readers
+        self.requests = 0
+
+    async def run_db(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def _page(self, view, params, inm):
+        etag = self.version.etag()
+        if etag_matches(inm, etag):
+            return etag, None
+        try:
+            limit = max(1, min(int(params.get("limite", API_LIMIT)), API_LIMIT_MAX))
+            after = decode_cursor(params["apres"]) if "apres" in params else None
+            if after is not None and not (isinstance(after, list) and len(after) == len(VIEWS[view][2])
+                                          and all(isinstance(v, (str, int, float)) for v in after)):
+                raise ValueError("curseur d'une autre vue")
+        except (ValueError, TypeError):
+            raise HttpError(400, "limite / apres invalides")
+        with self.pool.connection() as db:
+            headers, rows, _, last = keyset_page(db.cursor(), view, after=after, limit=limit)
+        body = {"donnees": [dict(zip(headers, r)) for r in rows],
+                "suivant": encode_cursor(last) if len(rows) == limit else None}
+        return etag, json.dumps(body, ensure_ascii=False).encode()
+
+    def _topology_page(self, params, last):
+        """Bloc suivant de /topologie après la ligne `last` (None : début),
+        déjà encodé (le JSON est produit hors de la boucle). La connexion
+        est rendue au pool avant le retour. Renvoie (bloc ou None, dernière ligne)."""
+        only = [("SV.NUM_SERVEUR = ?", int(params["serveur"]))] if "serveur" in params else []
+        if last is None:
+            steps = [([], [])]
+        else:
+            pos = dict(zip(TOPOLOGIE_COLS, last))
+            steps = [([cond], [last[i] for i in idx]) for col, cond, idx in TOPOLOGIE_SUITE
+                     if pos[col] is not None]
+        rows = []
+        with self.pool.connection() as db:
+            for conds, args in steps:
+                conds = [c for c, _ in only] + conds
+                where = "WHERE " + " AND ".join(conds) if conds else ""
+                rows += db.execute(TOPOLOGIE_PAGE.format(where=where),
+                                   [v for _, v in only] + args + [STREAM_CHUNK - len(rows)]).fetchall()
+                if len(rows) >= STREAM_CHUNK:
+                    break
+        if not rows:
+            return None, last
+        return ",".join(json.dumps(dict(zip(TOPOLOGIE_COLS, r)), ensure_ascii=False)
+                        for r in rows).encode(), rows[-1]
+
+    async def respond(self, writer, status, body=b"", etag=None, ctype="application/json"):
+        head = [f"HTTP/1.1 {status} {self.STATUS[status]}", f"Content-Length: {len(body)}"]
+        if body:
+            head.append(f"Content-Type: {ctype}; charset=utf-8")
+        if etag:
+            head.append(f"ETag: {etag}")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+        await writer.drain()
+
+    async def stream_topology(self, writer, params, inm):
+        if "serveur" in params and not params["serveur"].isdigit():
+            raise HttpError(400, "serveur : identifiant entier attendu")
+        etag = await self.run_db(self.version.etag)
+        if etag_matches(inm, etag):
+            return await self.respond(writer, 304, etag=etag)
+        # créneau et connexion le temps d'un bloc seulement : un client lent
+        # (drain) ne bloque pas les autres lecteurs
+        async with self.slots:
+            data, last = await self.run_db(self._topology_page, params, None)
+        writer.write(("HTTP/1.1 200 OK\r\nContent-Type: application/json; charset=utf-8\r\n"
+                      f"ETag: {etag}\r\nTransfer-Encoding: chunked\r\n\r\n").encode())
+        try:
+            first = True
+            while data is not None:
+                chunk = ("[" if first else ",").encode() + data
+                first = False
+                writer.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                await writer.drain()
+                async with self.slots:
+                    data, last = await self.run_db(self._topology_page, params, last)
+            tail = b"[]" if first else b"]"
+            writer.write(f"{len(tail):x}\r\n".encode() + tail + b"\r\n0\r\n\r\n")
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            raise
+        except Exception as e:
+            # en-têtes déjà envoyés : plus de statut possible, la connexion est coupée
+            print(f"Erreur interne dans le flux /topologie : {e!r}", file=sys.stderr)
+            raise ConnectionAbortedError from e
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    method, target, _ = line.decode("latin-1").split(" ", 2)
+                except ValueError:
+                    await self.respond(writer, 400); break
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    k, _, v = h.decode("latin-1").partition(":")
+                    headers[k.strip().lower()] = v.strip()
+                self.requests += 1
+                # corps ignoré (GET uniquement) mais lu : la requête suivante
+                # de la connexion commence juste après
+                size = headers.get("content-length", "0")
+                if not size.isdigit():
+                    await self.respond(writer, 400); break
+                await reader.readexactly(int(size))
+                await self.dispatch(writer, method, target, headers)
+                if (headers.get("connection", "").lower() == "close"
+                        or "transfer-encoding" in headers):   # corps chunked non lu
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, writer, method, target, headers):
+        url = urllib.parse.urlsplit(target)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        view = url.path.strip("/")
+        inm = headers.get("if-none-match")
+        try:
+            if method != "GET":
+                raise HttpError(405, "GET uniquement")
+            if view == "topologie":
+                return await self.stream_topology(writer, params, inm)
+            if view not in VIEWS:
+                raise HttpError(404, f"vues : {', '.join(list(VIEWS) + ['topologie'])}")
+            async with self.slots:
+                etag, body = await self.run_db(self._page, view, params, inm)
+            if body is None:
+                await self.respond(writer, 304, etag=etag)
+            else:
+                await self.respond(writer, 200, body, etag)
+        except HttpError as e:
+            await self.respond(writer, e.status, json.dumps({"erreur": str(e)}).encode())
+        except (ConnectionError, asyncio.IncompleteReadError):
+            raise
+        except Exception as e:
+            print(f"Erreur interne sur {method} {target} : {e!r}", file=sys.stderr)
+            await self.respond(writer, 500, json.dumps({"erreur": "erreur interne"}).encode())
+
+    async def serve(self, host="127.0.0.1", port=8080, ready=None):
+        self.slots = asyncio.Semaphore(self.readers)
+        server = await asyncio.start_server(self.handle, host, port)
+        if ready is not None:
+            ready(server)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown()
+        self.pool.close()
+
+# ------------------ Export en flux (CSV / JSONL / compressé) ------------------
+
+EXPORT_BATCH = 5000          # lignes par fetchmany : la mémoire ne dépend que de ça
+EXPORT_FORMATS = ("csv", "jsonl", "csv.gz", "jsonl.gz", "csv.zst", "jsonl.zst")
+
+def export_source(name):
+    """SQL d'une vue (VIEWS, dans l'ordre d'affichage), de la topologie
+    ou d'un SELECT libre."""
+    if name in VIEWS:
+        select, from_, keys = VIEWS[name]
+        return f"{select} {from_} ORDER BY {', '.join(keys)}"
+    if name == "topologie":
+        return TOPOLOGIE_SQL.format(where="")
+    if name.lstrip("( \n").upper().startswith(("SELECT", "WITH")):
+        return name
+    raise ValueError(f"Source inconnue : {name} (vues : {', '.join(VIEWS)}, topologie, ou SELECT ...)")
+
+def export_format(path):
+    for fmt in sorted(EXPORT_FORMATS, key=len, reverse=True):
+        if path.endswith("." + fmt):
+            return fmt
+    raise ValueError(f"Extension non reconnue : {path} ({', '.join(EXPORT_FORMATS)})")
+
+@contextlib.contextmanager
+def open_export(path, fmt):
+    """Flux texte vers `path`, compressé selon le format. Écrit dans
+    `path`.part puis renomme : jamais de fichier à moitié écrit."""
+    tmp = path + ".part"
+    if fmt.endswith(".gz"):
+        f = gzip.open(tmp, "wt", encoding="utf-8", newline="", compresslevel=6)
+    elif fmt.endswith(".zst"):
+        if zstd is None:
+            raise RuntimeError("Export .zst : module zstandard absent (pip install zstandard).")
+        raw = open(tmp, "wb")
+        f = io.TextIOWrapper(zstd.ZstdCompressor().stream_writer(raw), encoding="utf-8", newline="")
+    else:
+        f = open(tmp, "w", encoding="utf-8", newline="")
+    try:
+        with f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def write_rows(path, cols, batches, progress=None):
+    """Écrit les lots de lignes `batches` (itérable de listes) dans `path`,
+    au format tiré de l'extension. `progress(lignes, secondes)` est appelé
+    après chaque lot. Renvoie (lignes, secondes)."""
+    fmt = export_format(path)
+    t0 = time.perf_counter()
+    n = 0
+    with open_export(path, fmt) as f:
+        if fmt.startswith("csv"):
+            w = csv.writer(f)
+            w.writerow(cols)
+            write = w.writerows
+        else:
+            def write(rows):
+                f.writelines(json.dumps(dict(zip(cols, r)), ensure_ascii=False) + "\n" for r in rows)
+        for rows in batches:
+            write(rows)
+            n += len(rows)
+            if progress:
+                progress(n, time.perf_counter() - t0)
+    return n, time.perf_counter() - t0
+
+def fetch_batches(res, batch=EXPORT_BATCH):
+    while True:
+        rows = res.fetchmany(batch)
+        if not rows:
+            return
+        yield rows
+
+def export_query(cur, sql, path, params=(), batch=EXPORT_BATCH, progress=None):
+    """Lit `sql` par lots de `batch` lignes et les écrit au fil de l'eau."""
+    res = cur.execute(sql, params)
+    return write_rows(path, [d[0] for d in res.description], fetch_batches(res, batch), progress)
+
+def export_many(path, jobs, batch=EXPORT_BATCH, workers=READERS, progress=None):
+    """Exporte plusieurs sources en parallèle, une connexion en lecture
+    seule par thread (WAL : aucun blocage de l'écrivain). Chaque export
+    voit son propre instantané. `jobs` : [(source, fichier)].
+    Renvoie {fichier: (lignes, secondes)}."""
+    def one(source, out):
+        db = connect_readonly(path)
+        try:
+            cb = (lambda n, s: progress(out, n, s)) if progress else None
+            return export_query(db.cursor(), export_source(source), out, batch=batch, progress=cb)
+        finally:
+            db.close()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        futures = {out: ex.submit(one, source, out) for source, out in jobs}
+        return {out: fut.result() for out, fut in futures.items()}
+
+# ------------------ Partitionnement par bâtiment (shards) ------------------
+
+# Un catalogue (fichier --db) garde les tables de référence, la carte
+# bâtiment -> shard et les séquences d'IDs globales (sqlite_sequence,
+# via reserve_ids) ; chaque shard est une base complète qui contient des
+# bâtiments entiers (salles, gateways, capteurs, relevés, agrégats) et une
+# copie des tables de référence, pour que ses jointures restent locales.
+SHARD_DDL = [
+    "CREATE TABLE IF NOT EXISTS SHARD (NUM_SHARD INTEGER primary key, FICHIER TEXT not null)",
+    """CREATE TABLE IF NOT EXISTS SHARD_BATIMENT (
+    NUM_BATIMENT INTEGER primary key, NUM_SHARD INTEGER not null)""",
+    "CREATE INDEX IF NOT EXISTS IDX_SHARD_BATIMENT_SHARD ON SHARD_BATIMENT(NUM_SHARD)",
+]
+REFERENCE = ["TYPE", "RESEAU", "SERVEUR", "APPLICATION", "APP_SRV_CONNEXION"]
+_SALLES_OF = "(SELECT NUM_SALLE FROM {s}.SALLE WHERE NUM_BATIMENT IN (SELECT value FROM json_each(:ids)))"
+# Sous-arbre d'un ensemble de bâtiments, parents d'abord ({s} = schéma lu).
+# Un capteur appartient au bâtiment de sa salle.
+SUBTREE = [
+    ("BATIMENT", "NUM_BATIMENT IN (SELECT value FROM json_each(:ids))"),
+    ("SALLE", "NUM_BATIMENT IN (SELECT value FROM json_each(:ids))"),
+    ("GATEWAY", f"NUM_SALLE IN {_SALLES_OF}"),
+    ("CAPTEUR", f"NUM_SALLE IN {_SALLES_OF}"),
+    ("MESURE", f"NUM_CAPTEUR IN (SELECT NUM_CAPTEUR FROM {{s}}.CAPTEUR WHERE NUM_SALLE IN {_SALLES_OF})"),
+    ("AGREGAT_CAPTEUR", f"NUM_CAPTEUR IN (SELECT NUM_CAPTEUR FROM {{s}}.CAPTEUR WHERE NUM_SALLE IN {_SALLES_OF})"),
+    ("AGREGAT_SALLE", f"NUM_SALLE IN {_SALLES_OF}"),
+    ("AGREGAT_BATIMENT", "NUM_BATIMENT IN (SELECT value FROM json_each(:ids))"),
+]
+SHARD_COUNTS = ["BATIMENT", "SALLE", "GATEWAY", "CAPTEUR", "MESURE"]
+
+def is_catalogue(cur):
+    return table_exists(cur, "SHARD")
+
+def copy_rows(cur, table, src, dst, where="1", params=()):
+    """INSERT INTO dst.table SELECT ... FROM src.table (colonnes nommées)."""
+    cols = ", ".join(column_names(cur, table))
+    return cur.execute(f"INSERT INTO {dst}.{table}({cols}) SELECT {cols} FROM {src}.{table} WHERE {where}",
+                       params).rowcount
+
+def copy_subtree(cur, src, dst, batiments):
+    params = {"ids": json.dumps(sorted(batiments))}
+    return {table: copy_rows(cur, table, src, dst, where.format(s=src), params)
+            for table, where in SUBTREE}
+
+def delete_subtree(cur, batiments):
+    params = {"ids": json.dumps(sorted(batiments))}
+    n = 0
+    for table, where in reversed(SUBTREE):      # enfants d'abord (conditions sur les parents)
+        n += cur.execute(f"DELETE FROM main.{table} WHERE {where.format(s='main')}", params).rowcount
+    topology_cache.invalidate()
+    return n
+
+def shard_path(catalogue, k):
+    root, ext = os.path.splitext(catalogue)
+    return f"{root}.shard{k}{ext or '.db'}"
+
+def plan_shards(cur, n):
+    """Répartit les bâtiments (le plus gros d'abord, vers le shard le moins
+    chargé) ; poids = nombre de capteurs. Renvoie {shard: [bâtiments]}."""
+    weights = cur.execute("""
+        SELECT B.NUM_BATIMENT, count(C.NUM_CAPTEUR) FROM BATIMENT B
+        LEFT JOIN SALLE S ON S.NUM_BATIMENT = B.NUM_BATIMENT
+        LEFT JOIN CAPTEUR C ON C.NUM_SALLE = S.NUM_SALLE
+        GROUP BY B.NUM_BATIMENT ORDER BY 2 DESC, 1""").fetchall()
+    load = [(0, k) for k in range(n)]
+    plan = {k: [] for k in range(n)}
+    for b, w in weights:
+        total, k = heapq.heappop(load)
+        plan[k].append(b)
+        heapq.heappush(load, (total + w, k))
+    return plan
+
+def create_shards(source, catalogue, n):
+    """Découpe `source` (non modifiée) en un catalogue et `n` shards.
+    Renvoie {shard: nombre de capteurs}."""
+    if os.path.exists(catalogue):
+        raise ValueError(f"{catalogue} existe déjà.")
+    with contextlib.closing(connect_readonly(source)) as src:
+        plan = plan_shards(src.cursor(), n)
+    counts = {}
+    for k, batiments in plan.items():
+        path = shard_path(catalogue, k)
+        if os.path.exists(path):
+            raise ValueError(f"{path} existe déjà.")
+        with contextlib.closing(connect(path, uri=True)) as db:
+            migrate(db)
+            cur = db.cursor()
+            cur.execute("ATTACH DATABASE ? AS src", (readonly_uri(source),))
+            with db, bulk_load(cur):
+                for table in REFERENCE:
+                    copy_rows(cur, table, "src", "main")
+                counts[k] = copy_subtree(cur, "src", "main", batiments)["CAPTEUR"]
+            cur.execute("DETACH DATABASE src")
+            cur.execute("ANALYZE")
+    with contextlib.closing(connect(catalogue, uri=True)) as db:
+        migrate(db)
+        cur = db.cursor()
+        cur.execute("ATTACH DATABASE ? AS src", (readonly_uri(source),))
+        with db:
+            for ddl in SHARD_DDL:
+                cur.execute(ddl)
+            for table in REFERENCE:
+                copy_rows(cur, table, "src", "main")
+            for table, key in AUTO_ID.items():       # séquences globales
+                seq = cur.execute(f"""SELECT max(coalesce((SELECT seq FROM src.sqlite_sequence WHERE name = ?), 0),
+                                             coalesce((SELECT max({key}) FROM src.{table}), 0))""",
+                                  (table,)).fetchone()[0]
+                cur.execute("DELETE FROM sqlite_sequence WHERE name = ?", (table,))
+                cur.execute("INSERT INTO sqlite_sequence(name, seq) VALUES (?,?)", (table, seq))
+            cur.executemany("INSERT INTO SHARD(NUM_SHARD, FICHIER) VALUES (?,?)",
+                            [(k, os.path.relpath(shard_path(catalogue, k), os.path.dirname(os.path.abspath(catalogue))))
+                             for k in plan])
+            cur.executemany("INSERT INTO SHARD_BATIMENT(NUM_BATIMENT, NUM_SHARD) VALUES (?,?)",
+                            [(b, k) for k, bs in plan.items() for b in bs])
+        cur.execute("DETACH DATABASE src")
+    return counts
+
+def sort_key(values):
+    """Ordre de tri SQLite (NULL < nombres < texte < blob ; texte BINARY =
+    ordre des points de code) pour fusionner des flux triés par SQLite."""
+    return tuple((0, 0) if v is None else (1, v) if isinstance(v, (int, float))
+                 else (2, v) if isinstance(v, str) else (3, v) for v in values)
+
+def view_sql(view, after=None):
+    """Vue VIEWS triée, avec les colonnes de clé en fin de ligne."""
+    select, from_, keys = VIEWS[view]
+    cols = ", ".join(keys)
+    where = f"WHERE ({cols}) > ({', '.join('?' * len(keys))})" if after else ""
+    return f"{select}, {cols} {from_} {where} ORDER BY {cols}", len(keys)
+
+def _shard_page(path, view, after, limit):
+    """(processus) Première page d'un shard après `after`, clés comprises."""
+    db = connect_readonly(path)
+    try:
+        sql, _ = view_sql(view, after)
+        res = db.execute(sql + " LIMIT ?", list(after or ()) + [limit])
+        return [d[0] for d in res.description], res.fetchall()
+    finally:
+        db.close()
+
+def _shard_counts(path):
+    db = connect_readonly(path)
+    try:
+        return {t: db.execute(f"SELECT count(*) FROM {t}").fetchone()[0] for t in SHARD_COUNTS}
+    finally:
+        db.close()
+
+class ShardRouter:
+    """Écritures vers le shard propriétaire (références : partout), lectures
+    réparties sur les shards (pool de processus) puis fusionnées dans l'ordre.
+    Les IDs sont pris dans les séquences du catalogue : uniques tous shards
+    confondus, y compris après un déplacement de bâtiment."""
+
+    def __init__(self, db, path):
+        self.db, self.cur = db, db.cursor()
+        root = os.path.dirname(os.path.abspath(path))
+        self.files = {k: os.path.join(root, f) for k, f in self.cur.execute("SELECT NUM_SHARD, FICHIER FROM SHARD")}
+        self.conns = {}
+        self.owners = {}            # (table, id) -> shard, pour SALLE / GATEWAY / CAPTEUR
+        self.pool = None
+
+    def shard(self, k):
+        if k not in self.conns:
+            self.conns[k] = connect(self.files[k])
+        return self.conns[k]
+
+    def fan_out(self, fn, *args):
+        """fn(fichier, *args) sur chaque shard, en parallèle : {shard: résultat}."""
+        if self.pool is None:
+            self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=len(self.files))
+        futures = {k: self.pool.submit(fn, path, *args) for k, path in self.files.items()}
+        return {k: f.result() for k, f in futures.items()}
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+        for db in self.conns.values():
+            db.close()
+
+    # --- routage ---
+    def owner(self, table, ident):
+        if table == "BATIMENT":
+            row = self.cur.execute("SELECT NUM_SHARD FROM SHARD_BATIMENT WHERE NUM_BATIMENT = ?",
+                                   (ident,)).fetchone()
+            if row is None:
+                raise KeyError(f"BATIMENT {ident} inconnu")
+            return row[0]
+        k = self.owners.get((table, ident))
+        if k is None:
+            key = AUTO_ID[table]
+            for k in self.files:        # lecture ponctuelle sur la clé primaire
+                if self.shard(k).execute(f"SELECT 1 FROM {table} WHERE {key} = ?", (ident,)).fetchone():
+                    break
+            else:
+                raise KeyError(f"{table} {ident} inconnu")
+            self.owners[(table, ident)] = k
+        return k
+
+    # parents hors références : tous doivent être sur le shard de la ligne
+    PARENTS = {"SALLE": [("NUM_BATIMENT", "BATIMENT")], "GATEWAY": [("NUM_SALLE", "SALLE")],
+               "CAPTEUR": [("NUM_SALLE", "SALLE"), ("NUM_GATEWAY", "GATEWAY")]}
+
+    def _targets(self, table, values=None, ident=None):
+        if table in REFERENCE:
+            return [None] + list(self.files)        # None = catalogue
+        if table == "BATIMENT" and ident is None:   # nouveau bâtiment : shard le moins rempli
+            load = dict(self.cur.execute("SELECT NUM_SHARD, count(*) FROM SHARD_BATIMENT GROUP BY NUM_SHARD"))
+            return [min(self.files, key=lambda k: (load.get(k, 0), k))]
+        k, who = None, None
+        if ident is not None:
+            k, who = self.owner(table, ident), f"{table} {ident}"
+        for col, parent in self.PARENTS.get(table, []):
+            if not values or col not in values:
+                continue
+            kp = self.owner(parent, values[col])
+            if k is not None and kp != k:
+                raise ValueError(f"{parent} {values[col]} est sur le shard {kp}, {who} "
+                                 f"sur le shard {k} : déplacer d'abord (shard deplacer).")
+            k, who = kp, who or f"{parent} {values[col]}"
+        return [k]
+
+    def _db(self, k):
+        return self.db if k is None else self.shard(k)
+
+    # Une écriture de référence est appliquée fichier par fichier (catalogue
+    # puis shards) : une transaction par fichier, pas de commit atomique
+    # global. Les écritures sont idempotentes par ID : relancer suffit.
+
+    def insert(self, table, values):
+        """Insère `values` (dict) ; renvoie l'ID attribué (ou None)."""
+        values = dict(values)
+        targets = self._targets(table, values)
+        key = AUTO_ID.get(table)
+        if key and values.get(key) is None:
+            values[key] = reserve_ids(self.db, table, 1)
+        cols = list(values)
+        sql = f"INSERT INTO {table}({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})"
+        for k in targets:
+            with self._db(k) as db:
+                db.execute(sql, [values[c] for c in cols])
+        if table == "BATIMENT":
+            with self.db:
+                self.db.execute("INSERT INTO SHARD_BATIMENT(NUM_BATIMENT, NUM_SHARD) VALUES (?,?)",
+                                (values[key], targets[0]))
+        elif key:
+            self.owners[(table, values[key])] = targets[0]
+        topology_cache.invalidate()
+        return values.get(key) if key else None
+
+    def update(self, table, ident, values):
+        sets = ", ".join(f"{c} = ?" for c in values)
+        for k in self._targets(table, values, ident):
+            with self._db(k) as db:
+                db.execute(f"UPDATE {table} SET {sets} WHERE {AUTO_ID[table]} = ?", list(values.values()) + [ident])
+        topology_cache.invalidate()
+
+    def delete(self, table, ident):
+        counts = {}
+        for k in self._targets(table, ident=ident):
+            for t, n in delete_many(self._db(k), table, [ident]).items():
+                if t not in REFERENCE or k is None:     # répliques comptées une fois
+                    counts[t] = counts.get(t, 0) + n
+        if table == "BATIMENT":
+            with self.db:
+                self.db.execute("DELETE FROM SHARD_BATIMENT WHERE NUM_BATIMENT = ?", (ident,))
+        self.owners = {}
+        return counts
+
+    # --- lectures réparties ---
+    def page(self, view, after=None, limit=PAGE_SIZE):
+        """Page globale : `limit` lignes par shard au plus, fusion, coupe.
+        Renvoie (entêtes, lignes, clé de reprise ou None)."""
+        n = len(VIEWS[view][2])
+        parts = self.fan_out(_shard_page, view, after, limit)
+        headers = next(iter(parts.values()))[0][:-n]
+        rows = list(itertools.islice(heapq.merge(*(r for _, r in parts.values()),
+                                                 key=lambda r: sort_key(r[-n:])), limit))
+        last = tuple(rows[-1][-n:]) if len(rows) == limit else None
+        return headers, [r[:-n] for r in rows], last
+
+    def counts(self):
+        """{shard: {table: n}} et le total."""
+        per = self.fan_out(_shard_counts)
+        total = {t: sum(c[t] for c in per.values()) for t in SHARD_COUNTS}
+        return per, total
+
+    def _merged(self, sql, key, batch=EXPORT_BATCH):
+        """Noms de colonnes puis lignes de `sql` fusionnées sur tous les
+        shards selon `key(ligne)` (ordre de l'ORDER BY de `sql`). Une
+        connexion en lecture par shard ; mémoire bornée à un lot par shard."""
+        conns = [connect_readonly(p) for p in self.files.values()]
+        try:
+            streams = []
+            for db in conns:
+                res = db.execute(sql)
+                streams.append(itertools.chain.from_iterable(fetch_batches(res, batch)))
+            yield [d[0] for d in res.description]
+            yield from heapq.merge(*streams, key=lambda r: sort_key(key(r)))
+        finally:
+            for db in conns:
+                db.close()
+
+    def stream(self, view):
+        """(entêtes, itérateur de lignes) de toute la vue, dans l'ordre."""
+        sql, n = view_sql(view)
+        it = self._merged(sql, lambda r: r[-n:])
+        return next(it)[:-n], (r[:-n] for r in it)
+
+    def topology(self):
+        """Lignes de TOPOLOGIE_SQL fusionnées (ADRESSE_IP, NOM_GATEWAY,
+        NOM_CAPTEUR). Les serveurs étant répliqués, chaque shard renvoie une
+        ligne « serveur sans gateway » : gardée seulement si aucun shard ne
+        connaît de gateway à ce serveur."""
+        it = self._merged(TOPOLOGIE_SQL.format(where=""), lambda r: (r[1], r[3], r[5]))
+        next(it)
+        for _, rows in itertools.groupby(it, key=lambda r: r[0]):
+            first = next(rows)
+            if first[2] is not None:
+                yield first
+                yield from rows
+                continue
+            rest = (r for r in rows if r[2] is not None)
+            r = next(rest, None)
+            yield first if r is None else r
+            yield from rest
+
+    # --- rééquilibrage ---
+    def move(self, batiment, target):
+        """Déplace un bâtiment (et tout son sous-arbre) vers `target` :
+        copie dans le shard cible, bascule de la carte, suppression dans les
+        autres shards. Relançable : une copie partielle dans la cible est
+        refaite, et un reste dans l'ancien shard (arrêt après la bascule) est
+        supprimé au prochain appel, même si le bâtiment est déjà en place.
+        Renvoie les lignes copiées par table ({} : rien à copier)."""
+        source = self.owner("BATIMENT", batiment)
+        if target not in self.files:
+            raise KeyError(f"shard {target} inconnu")
+        n = {}
+        if source != target:
+            dst = self.shard(target)
+            cur = dst.cursor()
+            dst.commit()
+            cur.execute("ATTACH DATABASE ? AS src", (self.files[source],))
+            try:
+                with dst:
+                    delete_subtree(cur, [batiment])         # reste d'une tentative interrompue
+                    n = copy_subtree(cur, "src", "main", [batiment])
+            finally:
+                cur.execute("DETACH DATABASE src")
+            with self.db:
+                self.db.execute("UPDATE SHARD_BATIMENT SET NUM_SHARD = ? WHERE NUM_BATIMENT = ?",
+                                (target, batiment))
+        for k in self.files:
+            if k == target:
+                continue
+            db = self.shard(k)
+            if db.execute("SELECT 1 FROM BATIMENT WHERE NUM_BATIMENT = ?", (batiment,)).fetchone():
+                with db:
+                    delete_subtree(db.cursor(), [batiment])
+        self.owners = {}
+        return n
+
+# ------------------ Analyse de capacité (NumPy) ------------------
+
+# Modèle : un capteur consomme le débit de son réseau (DEBIT_RESEAU) multiplié
+# par un taux d'activité ; une gateway / un serveur a une capacité fixée
+# (même unité). Tout est calculé par bincount sur des tableaux d'indices.
+CAPA_GATEWAY = 1_000_000
+CAPA_SERVEUR = 20_000_000
+FANOUT_Q = (0.5, 0.9, 0.99)
+
+class CapacityModel:
+    """Affectation capteur -> gateway -> serveur et réseau en tableaux NumPy
+    d'indices denses (-1 = absent). Les simulations ne touchent pas la base."""
+
+    def __init__(self, cur):
+        if np is None:
+            raise RuntimeError("Analyse de capacité : NumPy requis (pip install numpy).")
+        self.gw_ids, gw_srv = self._pairs(cur, "SELECT NUM_GATEWAY, ifnull(NUM_SERVEUR, -1) FROM GATEWAY")
+        self.srv_ids = self._ids(cur, "SELECT NUM_SERVEUR FROM SERVEUR")
+        self.net_ids, debit = self._pairs(cur, "SELECT NUM_RESEAU, ifnull(DEBIT_RESEAU, 0) FROM RESEAU")
+        rows = cur.execute("""SELECT NUM_CAPTEUR, ifnull(NUM_GATEWAY, -1), ifnull(NUM_RESEAU, -1)
+                              FROM CAPTEUR ORDER BY NUM_CAPTEUR""").fetchall()
+        a = np.array(rows, dtype=np.int64).reshape(-1, 3)
+        self.cap_ids = a[:, 0]
+        self.gw_srv = self._index(self.srv_ids, gw_srv)
+        self.net_debit = debit.astype(np.float64)
+        self.cap_gw = self._index(self.gw_ids, a[:, 1])
+        self.cap_net = self._index(self.net_ids, a[:, 2])
+        self.demand = np.where(self.cap_net >= 0, self.net_debit[self.cap_net], 0.0)   # taux = 1
+
+    @staticmethod
+    def _ids(cur, sql):
+        return np.array(sorted(r[0] for r in cur.execute(sql)), dtype=np.int64)
+
+    @staticmethod
+    def _pairs(cur, sql):
+        a = np.array(sorted(cur.execute(sql).fetchall()), dtype=np.int64).reshape(-1, 2)
+        return a[:, 0], a[:, 1]
+
+    @staticmethod
+    def _index(ids, values):
+        """Position de chaque valeur dans `ids` (trié), -1 si absente."""
+        pos = np.searchsorted(ids, values)
+        pos = np.minimum(pos, max(len(ids) - 1, 0))
+        ok = (len(ids) > 0) & (ids[pos] == values) if len(ids) else np.zeros(len(values), bool)
+        return np.where(ok, pos, -1)
+
+    def loads(self, taux=1.0, cap_gw=None, keep=None, gw_srv=None):
+        """Charges et effectifs par gateway, serveur et réseau. `cap_gw`,
+        `keep` (masque des capteurs restants) et `gw_srv` remplacent
+        l'affectation courante pour une simulation. Les absents (-1, ou
+        hors `keep`) tombent dans une case en plus, ignorée."""
+        cap_gw = self.cap_gw if cap_gw is None else cap_gw
+        gw_srv = self.gw_srv if gw_srv is None else gw_srv
+        ng, ns, nn = len(self.gw_ids), len(self.srv_ids), len(self.net_ids)
+        g = np.where(cap_gw >= 0, cap_gw, ng)
+        r = self.cap_net if keep is None else np.where(keep, self.cap_net, -1)
+        r = np.where(r >= 0, r, nn)
+        if keep is not None:
+            g = np.where(keep, g, ng)
+        gw_load = np.bincount(g, weights=self.demand, minlength=ng + 1)[:ng] * taux
+        gw_n = np.bincount(g, minlength=ng + 1)[:ng]
+        sv = np.where(gw_srv >= 0, gw_srv, ns)
+        return {"gw_load": gw_load, "gw_n": gw_n,
+                "srv_load": np.bincount(sv, weights=gw_load, minlength=ns + 1)[:ns],
+                "srv_gw": np.bincount(sv, minlength=ns + 1)[:ns],
+                "srv_n": np.bincount(sv, weights=gw_n, minlength=ns + 1)[:ns].astype(np.int64),
+                "net_load": np.bincount(r, weights=self.demand, minlength=nn + 1)[:nn] * taux,
+                "net_n": np.bincount(r, minlength=nn + 1)[:nn]}
+
+    @staticmethod
+    def fanout(counts):
+        """Distribution d'un effectif (capteurs par gateway, ...)."""
+        if not len(counts):
+            return {}
+        q = np.quantile(counts, FANOUT_Q)
+        return {"min": int(counts.min()), "moyenne": round(float(counts.mean()), 2),
+                **{f"p{int(x * 100)}": float(v) for x, v in zip(FANOUT_Q, q)}, "max": int(counts.max())}
+
+    def move(self, n, src, dst):
+        """Affectation où les `n` premiers capteurs de la gateway `src`
+        passent sur `dst` (IDs de gateway)."""
+        s, d = self._index(self.gw_ids, np.array([src, dst]))
+        if s < 0 or d < 0:
+            raise KeyError(f"gateway {src if s < 0 else dst} inconnue")
+        cap_gw = self.cap_gw.copy()
+        moved = np.flatnonzero(cap_gw == s)[:n]
+        cap_gw[moved] = d
+        return cap_gw, len(moved)
+
+    def remove_server(self, srv):
+        """Comme del_serveur : ses gateways et leurs capteurs disparaissent.
+        Renvoie (masque des capteurs restants, gw_srv, gateways, capteurs)."""
+        (k,) = self._index(self.srv_ids, np.array([srv]))
+        if k < 0:
+            raise KeyError(f"serveur {srv} inconnu")
+        gone_gw = self.gw_srv == k
+        gw_srv = np.where(gone_gw, -1, self.gw_srv)
+        keep = ~((self.cap_gw >= 0) & gone_gw[np.maximum(self.cap_gw, 0)])
+        return keep, gw_srv, int(gone_gw.sum()), int((~keep).sum())
+
+def capacity_report(model, load, capa_gw=CAPA_GATEWAY, capa_srv=CAPA_SERVEUR, top=10):
+    """Résumé JSON-able : saturation par gateway / serveur, réseaux, fan-out."""
+    def ranked(ids, charge, capa, extra):
+        util = charge / capa
+        order = np.argsort(-util, kind="stable")[:top]
+        return [{"id": int(ids[i]), "charge": float(charge[i]), "marge": float(capa - charge[i]),
+                 "utilisation": round(float(util[i]), 4), **{k: int(v[i]) for k, v in extra.items()}}
+                for i in order]
+    return {
+        "gateways": {
+            "total": len(model.gw_ids),
+            "saturees": int((load["gw_load"] > capa_gw).sum()),
+            "marge_totale": float((capa_gw - load["gw_load"]).clip(min=0).sum()),
+            "plus_chargees": ranked(model.gw_ids, load["gw_load"], capa_gw, {"capteurs": load["gw_n"]}),
+            "fanout_capteurs": CapacityModel.fanout(load["gw_n"]),
+        },
+        "serveurs": {
+            "total": len(model.srv_ids),
+            "satures": int((load["srv_load"] > capa_srv).sum()),
+            "plus_charges": ranked(model.srv_ids, load["srv_load"], capa_srv,
+                                   {"gateways": load["srv_gw"], "capteurs": load["srv_n"]}),
+            "fanout_gateways": CapacityModel.fanout(load["srv_gw"]),
+        },
+        "reseaux": [{"id": int(r), "debit": float(model.net_debit[i]), "capteurs": int(load["net_n"][i]),
+                     "charge": float(load["net_load"][i])} for i, r in enumerate(model.net_ids)],
+    }
+
+# ------------------ Jeux de données synthétiques & benchmarks ------------------
+
+TYPES_STD = [("Température", "°C"), ("Humidité", "%"), ("Pression", "mBar"), ("Luminosité", "Lux")]
+RESEAUX_STD = [("LoRaWAN", 100), ("Sigfox", 10), ("NB-IOT", 2000), ("WiFi", 50000)]
+
+def generate_fixture(db, batiments=10, salles=10, gateways=2, capteurs=20,
+                     serveurs=10, applications=5, connexions=3, seed=0):
+    """Remplit une base vide : `salles` par bâtiment, `gateways` par salle,
+    `capteurs` par gateway (dans la salle de leur gateway), `connexions`
+    serveurs par application. Reproductible pour une même graine.
+    Chargement sans index ni triggers (voir bulk_load)."""
+    cur = db.cursor()
+    if cur.execute("SELECT 1 FROM BATIMENT LIMIT 1").fetchone():
+        raise ValueError("La base n'est pas vide.")
+    rnd = random.Random(seed)
+    t0 = time.perf_counter()
+    db.commit()
+    with db, bulk_load(cur):
+        cur.executemany("INSERT INTO TYPE(NUM_TYPE, NOM_TYPE, UNITE) VALUES (?,?,?)",
+                        [(i + 1, n, u) for i, (n, u) in enumerate(TYPES_STD)])
+        cur.executemany("INSERT INTO RESEAU(NUM_RESEAU, TYPE_RESEAU, DEBIT_RESEAU) VALUES (?,?,?)",
+                        [(i + 1, n, d) for i, (n, d) in enumerate(RESEAUX_STD)])
+        cur.executemany("INSERT INTO SERVEUR(NUM_SERVEUR, ADRESSE_IP) VALUES (?,?)",
+                        ((i, f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}") for i in range(1, serveurs + 1)))
+        cur.executemany("INSERT INTO APPLICATION(NUM_APPLICATION, NOM_APPLICATION) VALUES (?,?)",
+                        ((i, f"App {i}") for i in range(1, applications + 1)))
+        k = min(connexions, serveurs)
+        cur.executemany("INSERT INTO APP_SRV_CONNEXION(NUM_APPLICATION, NUM_SERVEUR) VALUES (?,?)",
+                        ((a, sv) for a in range(1, applications + 1)
+                         for sv in rnd.sample(range(1, serveurs + 1), k)))
+        cur.executemany("INSERT INTO BATIMENT(NUM_BATIMENT, NOM_BATIMENT) VALUES (?,?)",
+                        ((b, f"Batiment {b}") for b in range(1, batiments + 1)))
+        n_salles = batiments * salles
+        cur.executemany("INSERT INTO SALLE(NUM_SALLE, NUM_BATIMENT, NOM_SALLE) VALUES (?,?,?)",
+                        ((s, (s - 1) // salles + 1, f"Salle {(s - 1) % salles + 1}")
+                         for s in range(1, n_salles + 1)))
+        n_gw = n_salles * gateways
+        gw_srv = [rnd.randint(1, serveurs) for _ in range(n_gw)]
+        cur.executemany("INSERT INTO GATEWAY(NUM_GATEWAY, NUM_SERVEUR, NUM_SALLE, NOM_GATEWAY) VALUES (?,?,?,?)",
+                        ((g, gw_srv[g - 1], (g - 1) // gateways + 1, f"GW{g}") for g in range(1, n_gw + 1)))
+        cur.executemany("""INSERT INTO CAPTEUR(NUM_CAPTEUR, NUM_SALLE, NUM_GATEWAY, NUM_TYPE, NUM_RESEAU, NOM_CAPTEUR)
+                           VALUES (?,?,?,?,?,?)""",
+                        ((c, (g - 1) // gateways + 1, g, rnd.randint(1, len(TYPES_STD)),
+                          rnd.randint(1, len(RESEAUX_STD)), f"Cap{c}")
+                         for g in range(1, n_gw + 1)
+                         for c in range((g - 1) * capteurs + 1, g * capteurs + 1)))
+    cur.execute("ANALYZE")
+    db.commit()
+    topology_cache.invalidate()
+    return n_gw * capteurs, time.perf_counter() - t0
+
+@contextlib.contextmanager
+def scripted_input(answers, out):
+    """Rejoue des réponses aux input() des menus ; la sortie va dans `out`."""
+    it = iter(answers)
+
+    def fake(msg=""):
+        try:
+            return str(next(it))
+        except StopIteration:
+            return "q"          # fin de pagination / annulation
+    saved = builtins.input
+    builtins.input = fake
+    try:
+        with contextlib.redirect_stdout(out):
+            yield
+    finally:
+        builtins.input = saved
+
+class LineCounter(io.TextIOBase):
+    """Sortie jetée, lignes comptées."""
+    def __init__(self):
+        self.lines = 0
+
+    def write(self, s):
+        self.lines += s.count("\n")
+        return len(s)
+
+def _ids(cur, table, n, offset=0, desc=False):
+    key = AUTO_ID[table]
+    return [r[0] for r in cur.execute(
+        f"SELECT {key} FROM {table} ORDER BY {key} {'DESC' if desc else ''} LIMIT ? OFFSET ?",
+        (n, offset))]
+
+def _pick(cur, table, i, desc=False):
+    """Réponse au sélecteur : « #ID » (choix direct, quelle que soit la taille)."""
+    ids = _ids(cur, table, 1, offset=0 if desc else i, desc=desc)
+    return f"#{ids[0]}" if ids else None
+
+def _free_link(cur):
+    row = cur.execute("""SELECT A.NUM_APPLICATION, S.NUM_SERVEUR FROM APPLICATION A, SERVEUR S
+                          WHERE NOT EXISTS (SELECT 1 FROM APP_SRV_CONNEXION X
+                                            WHERE X.NUM_APPLICATION = A.NUM_APPLICATION
+                                              AND X.NUM_SERVEUR = S.NUM_SERVEUR)
+                          LIMIT 1""").fetchone() or (None, None)
+    return [f"#{x}" if x is not None else None for x in row]
+
+# (nom, fonction, réponses(cur, i)) : réponses aux prompts, calculées avant
+# la mesure. Les suppressions prennent les derniers IDs pour ne pas gêner.
+BENCH_OPS = [
+    ("show_batiments", show_batiments, lambda cur, i: ["q"]),
+    ("show_salles", show_salles, lambda cur, i: ["q"]),
+    ("show_capteurs", show_capteurs, lambda cur, i: ["q"]),
+    ("show_gateways", show_gateways, lambda cur, i: ["q"]),
+    ("show_topologie", show_topologie, lambda cur, i: ["s", _pick(cur, "SERVEUR", i), "q", "q", "q"]),
+    ("insert_batiment", insert_batiment, lambda cur, i: [f"Bench B{i}"]),
+    ("insert_salle", insert_salle, lambda cur, i: [f"Bench S{i}", _pick(cur, "BATIMENT", i)]),
+    ("insert_type", insert_type, lambda cur, i: [f"Bench T{i}", "u"]),
+    ("insert_reseau", insert_reseau, lambda cur, i: [f"Bench R{i}", 1000]),
+    ("insert_serveur", insert_serveur, lambda cur, i: [f"192.0.2.{i}"]),
+    ("insert_gateway", insert_gateway, lambda cur, i: [f"Bench GW{i}", _pick(cur, "SALLE", i),
+                                                       _pick(cur, "SERVEUR", i)]),
+    ("insert_capteur", insert_capteur, lambda cur, i: [f"Bench C{i}", _pick(cur, "SALLE", i),
+                                                       _pick(cur, "GATEWAY", i), _pick(cur, "TYPE", 0),
+                                                       _pick(cur, "RESEAU", 0)]),
+    ("insert_application", insert_application, lambda cur, i: [f"Bench App{i}"]),
+    ("insert_connexion", insert_connexion, lambda cur, i: _free_link(cur)),
+    ("update_batiment", update_batiment, lambda cur, i: [_pick(cur, "BATIMENT", i), f"Bench B{i}'"]),
+    ("update_salle", update_salle, lambda cur, i: [_pick(cur, "SALLE", i), f"Bench S{i}'", "n"]),
+    ("update_capteur", update_capteur, lambda cur, i: [_pick(cur, "CAPTEUR", i), f"Bench C{i}'", "n"]),
+    ("update_gateway", update_gateway, lambda cur, i: [_pick(cur, "GATEWAY", i), f"Bench GW{i}'", "n"]),
+    ("update_serveur", update_serveur, lambda cur, i: [_pick(cur, "SERVEUR", i), f"198.51.100.{i}"]),
+    ("update_type", update_type, lambda cur, i: [_pick(cur, "TYPE", 0), "", ""]),
+    ("update_reseau", update_reseau, lambda cur, i: [_pick(cur, "RESEAU", 0), "", ""]),
+    ("update_application", update_application, lambda cur, i: [_pick(cur, "APPLICATION", i), f"Bench App{i}'"]),
+    ("del_capteur", del_capteur, lambda cur, i: [_pick(cur, "CAPTEUR", i, desc=True)]),
+    ("del_gateway", del_gateway, lambda cur, i: [_pick(cur, "GATEWAY", i, desc=True)]),
+    ("del_salle", del_salle, lambda cur, i: [_pick(cur, "SALLE", i, desc=True)]),
+    ("del_batiment", del_batiment, lambda cur, i: [_pick(cur, "BATIMENT", i, desc=True)]),
+    ("del_application", del_application, lambda cur, i: [_pick(cur, "APPLICATION", i, desc=True)]),
+    ("del_serveur", del_serveur, lambda cur, i: [_pick(cur, "SERVEUR", i, desc=True)]),
+    ("del_reseau", del_reseau, lambda cur, i: [_pick(cur, "RESEAU", i, desc=True)]),
+    ("del_type", del_type, lambda cur, i: [_pick(cur, "TYPE", i, desc=True)]),
+]
+
+def percentile(values, q):
+    v = sorted(values)
+    return v[min(len(v) - 1, int(round(q * (len(v) - 1))))] if v else 0.0
+
+def run_benchmarks(path, repeat=5, only=None):
+    """Chronomètre chaque opération sur une copie de `path`.
+    Renvoie {op: {p50_ms, p99_ms, lignes_s, rss_mo}}."""
+    work = path + ".bench"
+    with sqlite3.connect(path) as src, sqlite3.connect(work) as dst:
+        src.backup(dst)
+    results = {}
+    try:
+        with sqlite3.connect(work) as db:
+            cur = db.cursor()
+            for name, fn, answers in BENCH_OPS:
+                if only and name not in only:
+                    continue
+                times, rows = [], 0
+                for i in range(repeat):
+                    script = answers(cur, i)
+                    if any(a is None for a in script):
+                        break               # plus rien à modifier / supprimer
+                    out = LineCounter()
+                    changes = db.total_changes
+                    with scripted_input(script, out):
+                        t0 = time.perf_counter()
+                        fn(cur) if name.startswith("show_") else fn(cur, db)
+                        times.append(time.perf_counter() - t0)
+                    rows += (db.total_changes - changes) if not name.startswith("show_") else out.lines
+                total = sum(times)
+                results[name] = {
+                    "p50_ms": round(percentile(times, 0.50) * 1000, 3),
+                    "p99_ms": round(percentile(times, 0.99) * 1000, 3),
+                    "lignes_s": round(rows / total, 1) if total else 0.0,
+                    "rss_mo": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                    "n": len(times),
+                }
+    finally:
+        for ext in ("", "-wal", "-shm", "-journal"):
+            if os.path.exists(work + ext):
+                os.remove(work + ext)
+    topology_cache.invalidate()
+    return results
+
+def compare_baseline(results, baseline, tolerance=0.20):
+    """Opérations dont le p50 dépasse la référence de plus de `tolerance`."""
+    slow = []
+    for name, r in results.items():
+        ref = baseline.get(name)
+        if ref and ref["p50_ms"] > 0 and r["p50_ms"] > ref["p50_ms"] * (1 + tolerance):
+            slow.append((name, ref["p50_ms"], r["p50_ms"]))
+    return slow
+
+# ------------------ Traçage des requêtes ------------------
+
+SLOW_MS = 50.0                 # seuil du journal des requêtes lentes
+SLOW_LOG = ".requetes-lentes.jsonl"   # suffixe : journal à côté de la base
+PROGRESS_STEPS = 1000          # instructions VM entre deux appels du progress handler
+HIST_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000)   # bornes sup. des cases (ms)
+SCAN_TABLES = ("CAPTEUR", "GATEWAY", "SALLE")
+ENTRY_PREFIXES = ("show_", "insert_", "update_", "del_", "cmd_", "menu_")
+
+def _normalize(sql):
+    return " ".join(sql.split())
+
+class QueryTracer:
+    """Statistiques par requête : latences (histogramme), lignes rendues,
+    instructions VM (progress handler), appels par fonction, plan si SCAN.
+    L'ordre SQL réellement exécuté (paramètres substitués) vient de
+    set_trace_callback ; il sert au journal des requêtes lentes (fichier
+    `slow_log`, aucun si None)."""
+
+    def __init__(self, slow_ms=SLOW_MS, slow_log=None):
+        self.slow_ms, self.slow_log = slow_ms, slow_log
+        self.stats = {}
+        self.current = None             # enregistrement en cours (progress handler)
+        self.others = {}                # ordres hors curseur tracé : triggers, BEGIN/COMMIT...
+        self.cursors = weakref.WeakSet()
+        self.db = None
+        self.quiet = False              # pendant nos propres EXPLAIN
+
+    def install(self, db):
+        self.db = db
+        db.set_trace_callback(self._trace)
+        db.set_progress_handler(self._tick, PROGRESS_STEPS)
+
+    def uninstall(self):
+        self.flush()
+        self.db.set_trace_callback(None)
+        self.db.set_progress_handler(None, 0)
+
+    def _trace(self, sql):
+        if self.quiet:
+            return
+        rec = self.current
+        if (rec is not None and rec["running"] and rec["expanded"] is None
+                and sql[:6].upper() == rec["sql"][:6].upper()):
+            rec["expanded"] = sql       # et non le BEGIN implicite qui le précède
+        else:
+            key = _normalize(sql)[:200]
+            self.others[key] = self.others.get(key, 0) + 1
+
+    def _tick(self):
+        if self.current is not None:
+            self.current["steps"] += PROGRESS_STEPS
+        return 0
+
+    @staticmethod
+    def caller():
+        """Première fonction « d'entrée » (show_*, insert_*, ...) dans la pile,
+        sinon l'appelant direct du curseur."""
+        f = sys._getframe(1)
+        while isinstance(f.f_locals.get("self"), (QueryTracer, TracedCursor, TracedConnection)):
+            f = f.f_back
+        first = f.f_code.co_name
+        while f is not None:
+            if f.f_code.co_name.startswith(ENTRY_PREFIXES):
+                return f.f_code.co_name
+            f = f.f_back
+        return first
+
+    def start(self, sql, params):
+        rec = {"sql": _normalize(sql), "params": params, "expanded": None, "ms": 0.0,
+               "rows": 0, "steps": 0, "caller": self.caller(), "running": True}
+        self.current = rec
+        return rec
+
+    def finish(self, rec):
+        if self.current is rec:
+            self.current = None
+        st = self.stats.get(rec["sql"])
+        if st is None:
+            st = self.stats[rec["sql"]] = {"n": 0, "ms": 0.0, "max_ms": 0.0, "lignes": 0, "vm": 0,
+                                           "hist": [0] * (len(HIST_MS) + 1), "appelants": {},
+                                           "plan": None}
+            st["plan"] = self.full_scan_plan(rec["sql"], rec["params"])
+        ms = rec["ms"]
+        st["n"] += 1
+        st["ms"] += ms
+        st["max_ms"] = max(st["max_ms"], ms)
+        st["lignes"] += rec["rows"]
+        st["vm"] += rec["steps"]
+        st["hist"][bisect.bisect_left(HIST_MS, ms)] += 1
+        st["appelants"][rec["caller"]] = st["appelants"].get(rec["caller"], 0) + 1
+        if ms >= self.slow_ms and self.slow_log:
+            with open(self.slow_log, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"t": time.strftime("%Y-%m-%dT%H:%M:%S"), "ms": round(ms, 3),
+                                    "lignes": rec["rows"], "appelant": rec["caller"],
+                                    "sql": rec["expanded"] or rec["sql"]}, ensure_ascii=False) + "\n")
+
+    def full_scan_plan(self, sql, params):
+        """EXPLAIN QUERY PLAN si la requête parcourt CAPTEUR / GATEWAY / SALLE
+        en entier (alias compris) ; None sinon."""
+        if not sql.split(None, 1)[0].upper() in ("SELECT", "WITH", "UPDATE", "DELETE", "INSERT"):
+            return None
+        names = set(SCAN_TABLES)
+        for m in re.finditer(r"\b(%s)\s+(?:AS\s+)?(\w+)" % "|".join(SCAN_TABLES), sql, re.I):
+            names.add(m.group(2).upper())
+        self.quiet = True
+        try:
+            plan = [r[3] for r in sqlite3.Cursor(self.db).execute("EXPLAIN QUERY PLAN " + sql,
+                                                                  params or ())]
+        except sqlite3.Error:
+            return None
+        finally:
+            self.quiet = False
+        scans = [d for d in plan if d.startswith("SCAN ") and d.split()[1].upper() in names]
+        return plan if scans else None
+
+    def flush(self):
+        for c in list(self.cursors):
+            c.finish()
+
+    def report(self):
+        self.flush()
+        return {"requetes": self.stats, "hors_curseur": self.others,
+                "seuil_lent_ms": self.slow_ms, "cases_ms": list(HIST_MS) + ["inf"]}
+
+    def export(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2, ensure_ascii=False)
+
+class TracedCursor(sqlite3.Cursor):
+    """Curseur chronométré : exécution + lectures jusqu'au prochain execute."""
+    tracer = None
+    rec = None
+
+    def _run(self, method, sql, params):
+        self.finish()
+        tr = self.tracer = self.connection.tracer
+        if tr is None:
+            return method(sql, params)
+        self.rec = rec = tr.start(sql, params)
+        tr.cursors.add(self)
+        t0 = time.perf_counter()
+        try:
+            return method(sql, params)
+        finally:
+            rec["ms"] += (time.perf_counter() - t0) * 1000
+            rec["running"] = False
+            if self.description is None:        # pas de lignes à lire
+                rec["rows"] = max(self.rowcount, 0)
+                self.finish()
+
+    def execute(self, sql, params=()):
+        return self._run(super().execute, sql, params)
+
+    def executemany(self, sql, seq):
+        it = iter(seq)
+        first = next(it, None)          # gardé pour l'EXPLAIN, sans tout matérialiser
+        seq = itertools.chain([first], it) if first is not None else ()
+        return self._run(lambda s, _: super(TracedCursor, self).executemany(s, seq), sql, first)
+
+    def _timed(self, method, *a):
+        rec = self.rec
+        if rec is None:
+            return method(*a)
+        t0 = time.perf_counter()
+        self.tracer.current, rec["running"] = rec, True
+        try:
+            return method(*a)
+        finally:
+            rec["ms"] += (time.perf_counter() - t0) * 1000
+            rec["running"] = False
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is not None and self.rec is not None:
+            self.rec["rows"] += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(super().fetchmany, size or self.arraysize)
+        if self.rec is not None:
+            self.rec["rows"] += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        if self.rec is not None:
+            self.rec["rows"] += len(rows)
+        self.finish()
+        return rows
+
+    def __next__(self):
+        rec = self.rec
+        if rec is None:
+            return super().__next__()
+        t0 = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            row = None
+        rec["ms"] += (time.perf_counter() - t0) * 1000
+        if row is None:
+            self.finish()
+            raise StopIteration
+        rec["rows"] += 1
+        return row
+
+    def finish(self):
+        rec, self.rec = self.rec, None
+        if rec is not None:
+            self.tracer.cursors.discard(self)
+            self.tracer.finish(rec)
+
+    def close(self):
+        self.finish()
+        super().close()
+
+class TracedConnection(sqlite3.Connection):
+    """Connexion dont tous les curseurs (y compris db.execute) sont tracés."""
+    tracer = None
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq):
+        return self.cursor().executemany(sql, seq)
+
+def connect_traced(path, tracer, **kw):
+    db = connect(path, factory=TracedConnection, **kw)
+    db.tracer = tracer
+    tracer.install(db)
+    return db
+
+def show_trace_stats(tracer, limit=20):
+    """Requêtes les plus coûteuses (temps cumulé), puis plans SCAN."""
+    rep = tracer.report()["requetes"]
+    top = sorted(rep.items(), key=lambda kv: -kv[1]["ms"])[:limit]
+    head = ("Requête", "n", "total ms", "moy. ms", "max ms", "lignes", "VM", "appelants")
+    rows = [(sql[:60], s["n"], round(s["ms"], 2), round(s["ms"] / s["n"], 3), round(s["max_ms"], 2),
+             s["lignes"], s["vm"], ", ".join(f"{k}×{v}" for k, v in
+                                             sorted(s["appelants"].items(), key=lambda kv: -kv[1])[:3]))
+            for sql, s in top]
+    if not rows:
+        print("Aucune requête tracée.")
+        return
+    print(draw_page(head, rows, col_widths(head, rows)))
+    for sql, s in top:
+        if s["plan"]:
+            print(f"\nSCAN complet : {sql[:100]}")
+            for d in s["plan"]:
+                print("   ", d)
+
+# ------------------ Instantané en mémoire ------------------
+
+SNAPSHOT_INTERVAL = 30.0       # secondes entre deux écritures sur disque (si modifié)
+BACKUP_PAGES = 1024            # pages copiées par pas de l'API backup
+SNAPSHOT_JOURNAL = ".journal-memoire"
+WRITE_WORDS = ("INSERT", "UPDATE", "DELETE", "REPLACE", "WITH", "CREATE", "DROP", "ALTER")
+DDL_WORDS = ("CREATE", "DROP", "ALTER")
+
+def _first_word(sql):
+    m = re.match(r"\s*(\w+)", sql)
+    return m.group(1).upper() if m else ""
+
+def read_journal(path):
+    """Enregistrements du journal ; une dernière ligne tronquée (arrêt brutal
+    pendant l'écriture) est ignorée."""
+    recs = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                recs.append(json.loads(line))
+            except ValueError:
+                break
+    return recs
+
+def replay_journal(db, recs):
+    """Rejoue les ordres journalisés en une transaction. Un identifiant attribué
+    autrement qu'en mémoire (écriture concurrente sur le fichier) annule tout."""
+    n = 0
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        for r in recs:
+            if "lot" in r:
+                db.executemany(r["sql"], r["lot"])
+                n += len(r["lot"])
+            elif "sql" in r:
+                c = db.execute(r["sql"], r["params"])
+                if "id" in r and c.lastrowid != r["id"]:
+                    raise ValueError(f"identifiant {c.lastrowid} au lieu de {r['id']} : {r['sql'][:80]}")
+                n += 1
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    return n
+
+def recover_journal(db, path):
+    """Au démarrage : rejoue le journal laissé par une session --memoire
+    interrompue avant son écriture sur disque. Si l'interruption a eu lieu
+    pendant une écriture (marqueur sans « echec » derrière), on ne sait pas
+    si le fichier la contient déjà : journal mis de côté, rien n'est rejoué."""
+    jpath = path + SNAPSHOT_JOURNAL
+    if not os.path.exists(jpath):
+        return
+    recs = read_journal(jpath)
+    marks = [r for r in recs if "sql" not in r]
+    if marks and "echec" not in marks[-1]:
+        os.replace(jpath, jpath + ".suspect")
+        print(f"Attention : session en mémoire interrompue pendant l'écriture sur disque ; "
+              f"journal conservé dans {jpath}.suspect (non rejoué).")
+        return
+    try:
+        n = replay_journal(db, recs)
+    except (sqlite3.Error, ValueError) as e:
+        os.replace(jpath, jpath + ".suspect")
+        print(f"Attention : rejeu du journal impossible ({e}) ; conservé dans {jpath}.suspect.")
+        return
+    os.remove(jpath)
+    topology_cache.invalidate()
+    print(f"Journal de la session en mémoire rejoué : {n} ordre(s).")
+
+class SnapshotCursor(TracedCursor):
+    """Curseur tracé qui journalise ses écritures réussies : SQL + paramètres
+    (le SQL développé de set_trace_callback arrondit les REAL à 15 chiffres)."""
+
+    def execute(self, sql, params=()):
+        snap = self.connection.snapshot
+        if snap is None or _first_word(sql) not in WRITE_WORDS:
+            return super().execute(sql, params)
+        before = self.connection.total_changes
+        super().execute(sql, params)
+        snap.record(self, sql, params, before)
+        return self
+
+    def executemany(self, sql, seq):
+        snap = self.connection.snapshot
+        if snap is None or _first_word(sql) not in WRITE_WORDS:
+            return super().executemany(sql, seq)
+        before, lot = self.connection.total_changes, []
+        super().executemany(sql, (lot.append(p) or p for p in seq))
+        snap.record(self, sql, lot, before, many=True)
+        return self
+
+class SnapshotConnection(TracedConnection):
+    snapshot = None
+
+    def cursor(self, factory=SnapshotCursor):
+        return super().cursor(factory)
+
+class MemorySnapshot:
+    """Copie :memory: du fichier (API backup) pour la console. Les écritures
+    validées sont journalisées (JSONL + fsync) puis recopiées sur disque par
+    pas de BACKUP_PAGES : toutes les `interval` secondes entre deux actions du
+    menu, à la demande et à la sortie. Si le fichier a été modifié entre-temps
+    par un autre processus (PRAGMA data_version), le journal y est rejoué au
+    lieu d'écraser ses changements, puis l'instantané est rechargé."""
+
+    def __init__(self, disk, path, interval=SNAPSHOT_INTERVAL, tracer=None):
+        self.disk, self.interval, self.tracer = disk, interval, tracer
+        self.jpath = path + SNAPSHOT_JOURNAL
+        self.log = open(self.jpath, "a", encoding="utf-8")
+        self.pending, self.savepoints, self.begun = [], [], False
+        self.dirty = False
+        self.mem = sqlite3.connect(":memory:", factory=SnapshotConnection)
+        self.mem.tracer = tracer
+        if tracer is not None:
+            tracer.install(self.mem)
+        self.mem.set_trace_callback(self._trace)
+        self.mem.snapshot = self
+        self.load()
+
+    def load(self):
+        t0 = time.perf_counter()
+        self.disk.backup(self.mem, pages=BACKUP_PAGES)
+        self.version = self.disk.execute("PRAGMA data_version").fetchone()[0]
+        self.dirty, self.last = False, time.monotonic()
+        topology_cache.invalidate()
+        return (time.perf_counter() - t0) * 1000
+
+    # --- journal ---
+
+    def record(self, cur, sql, params, before, many=False):
+        word = _first_word(sql)
+        if word in DDL_WORDS:
+            if re.match(r"\s*\w+\s+TEMP(ORARY)?\b", sql, re.I):
+                return
+        elif self.mem.total_changes == before:
+            return                      # SELECT en WITH, ou aucune ligne touchée
+        rec = {"sql": sql, "lot" if many else "params": params}
+        if not many and word in ("INSERT", "REPLACE") and cur.rowcount == 1:
+            rec["id"] = cur.lastrowid   # vérifié au rejeu
+        self.pending.append(rec)
+        if not self.mem.in_transaction:
+            self._commit()              # autocommit (DDL hors transaction)
+
+    def _trace(self, sql):
+        if self.tracer is not None:
+            self.tracer._trace(sql)
+        word = _first_word(sql)
+        if word == "BEGIN":
+            self.begun = True
+        elif word in ("COMMIT", "END"):
+            self._commit()
+        elif word == "ROLLBACK":
+            m = re.match(r"\s*ROLLBACK\s+(?:TRANSACTION\s+)?TO\s+(?:SAVEPOINT\s+)?(\w+)", sql, re.I)
+            if m is None:
+                self.pending.clear()
+                self.savepoints.clear()
+                self.begun = False
+            else:
+                for name, mark in reversed(self.savepoints):
+                    if name == m.group(1).lower():
+                        del self.pending[mark:]
+                        break
+        elif word == "SAVEPOINT":
+            name = sql.split()[1].lower()
+            self.savepoints.append((name, len(self.pending)))
+        elif word == "RELEASE":
+            name = sql.split()[-1].lower()
+            while self.savepoints and self.savepoints.pop()[0] != name:
+                pass
+            if not self.savepoints and not self.begun:
+                self._commit()          # RELEASE du savepoint extérieur = COMMIT
+
+    def _commit(self):
+        self.begun = False
+        self.savepoints.clear()
+        if self.pending:
+            self._log(*self.pending)
+            self.pending.clear()
+            self.dirty = True
+
+    def _log(self, *recs):
+        self.log.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in recs))
+        self.log.flush()
+        os.fsync(self.log.fileno())
+
+    # --- écriture sur disque ---
+
+    def write_back(self):
+        """Recopie l'instantané sur disque. Renvoie la durée en ms, 0 s'il n'y
+        avait rien à écrire, None si impossible (transaction ouverte, conflit)."""
+        if self.mem.in_transaction:
+            return None
+        if not self.dirty:
+            return 0
+        t0 = time.perf_counter()
+        external = self.disk.execute("PRAGMA data_version").fetchone()[0] != self.version
+        try:
+            if external:
+                self._log({"rejeu": time.time()})
+                self.log.flush()
+                replay_journal(self.disk, read_journal(self.jpath))
+                self.load()
+            else:
+                self._log({"backup": time.time()})
+                self.mem.backup(self.disk, pages=BACKUP_PAGES)
+        except (sqlite3.Error, ValueError) as e:
+            self._log({"echec": str(e)})
+            print(f"Attention : écriture sur disque impossible ({e}) ; "
+                  f"modifications conservées dans {self.jpath}.")
+            return None
+        self.log.truncate(0)
+        os.fsync(self.log.fileno())
+        self.version = self.disk.execute("PRAGMA data_version").fetchone()[0]
+        self.dirty, self.last = False, time.monotonic()
+        return (time.perf_counter() - t0) * 1000
+
+    def tick(self):
+        if self.dirty and time.monotonic() - self.last >= self.interval:
+            self.write_back()
+
+    def refresh(self):
+        """Recharge depuis le disque, après y avoir écrit nos modifications."""
+        if self.write_back() is None:
+            return None
+        return self.load()
+
+    def close(self):
+        """À la sortie (y compris Ctrl-C / SIGTERM) : transaction en cours
+        annulée, dernière écriture sur disque sans se laisser interrompre."""
+        if self.mem.in_transaction:
+            self.mem.rollback()
+        old = signal.signal(signal.SIGINT, signal.SIG_IGN)
+        try:
+            ok = self.write_back() is not None
+        finally:
+            signal.signal(signal.SIGINT, old)
+            self.mem.close()
+            self.log.close()
+        if ok and os.path.getsize(self.jpath) == 0:
+            os.remove(self.jpath)
+
+def snapshot_tick(db):
+    snap = getattr(db, "snapshot", None)
+    if snap is not None:
+        snap.tick()
 
 # ------------------ Menus ------------------
 
 def menu_afficher(cur):
     while True:
+        snapshot_tick(cur.connection)
         print(f"""
 Base : {DB}
   /Affichage :
@@ -425,6 +4029,7 @@ Base : {DB}
     3 - Capteurs
     4 - Gateways
     5 - Topologie
+    8 - Statistiques des requêtes
     9 - SQL libre
     0 - Retour
 """)
@@ -434,10 +4039,20 @@ Base : {DB}
         elif c == "3": show_capteurs(cur)
         elif c == "4": show_gateways(cur)
         elif c == "5": show_topologie(cur)
+        elif c == "8":
+            tracer = getattr(cur.connection, "tracer", None)
+            if tracer is None:
+                print("Traçage désactivé (relancer avec --trace).")
+                continue
+            show_trace_stats(tracer)
+            path = input_txt("Exporter en JSON vers (vide = non) : ")
+            if path:
+                tracer.export(path)
+                print(f"Statistiques écrites dans {path}")
         elif c == "9":
             sql = input_txt("SQL> ")
             try:
-                draw_query(cur, sql)
+                draw_query(cur, sql, pause=True)
             except Exception as e:
                 print("Erreur SQL :", e)
         elif c == "0": return
@@ -445,6 +4060,7 @@ Base : {DB}
 
 def menu_inserer(cur, db):
     while True:
+        snapshot_tick(cur.connection)
         print(f"""
 Base : {DB}
   /Insertion :
@@ -474,6 +4090,7 @@ Base : {DB}
 
 def menu_modifier(cur, db):
     while True:
+        snapshot_tick(cur.connection)
         print(f"""
 Base : {DB}
   /Modification :
@@ -501,6 +4118,7 @@ Base : {DB}
 
 def menu_supprimer(cur, db):
     while True:
+        snapshot_tick(cur.connection)
         print(f"""
 Base : {DB}
   /Suppression :
@@ -512,6 +4130,7 @@ Base : {DB}
     6 - Application
     7 - Type
     8 - Réseau
+    9 - Plusieurs IDs d'une table
     0 - Retour
 """)
         c = input_txt("Choix : ")
@@ -523,33 +4142,525 @@ Base : {DB}
         elif c == "6": del_application(cur, db)
         elif c == "7": del_type(cur, db)
         elif c == "8": del_reseau(cur, db)
+        elif c == "9": del_lot(cur, db)
         elif c == "0": return
         else: print("Choix invalide.")
 
 # ------------------ Main ------------------
 
-def main():
-    print("TP2")
-    with sqlite3.connect(DB) as db:
-        cur = db.cursor()
-        while True:
-            print(f"""
-Base : {DB}
+def menu_principal(db):
+    cur = db.cursor()
+    snap = getattr(db, "snapshot", None)
+    extra = """  8 - Écrire l'instantané sur disque
+  9 - Recharger depuis le disque
+""" if snap else ""
+    while True:
+        snapshot_tick(db)
+        print(f"""
+Base : {DB}{" (instantané en mémoire)" if snap else ""}
   1 - Afficher
   2 - Insérer
   3 - Modifier
   4 - Supprimer
-  0 - Quitter
+{extra}  0 - Quitter
 """)
-            ch = input_txt("Choix : ")
-            if   ch == "1": menu_afficher(cur)
-            elif ch == "2": menu_inserer(cur, db)
-            elif ch == "3": menu_modifier(cur, db)
-            elif ch == "4": menu_supprimer(cur, db)
-            elif ch == "0":
-                print("Au revoir."); break
+        ch = input_txt("Choix : ")
+        if   ch == "1": menu_afficher(cur)
+        elif ch == "2": menu_inserer(cur, db)
+        elif ch == "3": menu_modifier(cur, db)
+        elif ch == "4": menu_supprimer(cur, db)
+        elif ch == "8" and snap:
+            ms = snap.write_back()
+            if ms is not None:
+                print(f"Écrit sur {DB} ({ms:.1f} ms)." if ms else "Rien à écrire.")
+        elif ch == "9" and snap:
+            ms = snap.refresh()
+            if ms is not None:
+                print(f"Instantané rechargé depuis {DB} ({ms:.1f} ms).")
+        elif ch == "0":
+            print("Au revoir."); break
+        else:
+            print("Choix invalide.")
+
+def cmd_import(db, args):
+    import_files(db, args.fichiers, batch=args.lot, rejects_path=args.rejets)
+
+def cmd_simuler(db, args):
+    if args.udp:
+        host, _, port = args.udp.rpartition(":")
+        capteurs = [r[0] for r in db.execute("SELECT NUM_CAPTEUR FROM CAPTEUR")]
+        udp_send(simulate_readings(capteurs, args.mesures), host or "127.0.0.1", int(port))
+        print(f"{args.mesures} relevés envoyés vers {args.udp}.")
+        return
+    n, dt = ingest_simulation(db, args.mesures, batch=args.lot)
+    print(f"{n} relevés en {dt:.2f} s : {n / dt if dt else 0:,.0f} relevés/s")
+
+def cmd_passerelle(db, args):
+    print(f"Écoute UDP {args.hote}:{args.port} (Ctrl-C pour arrêter)")
+    n = udp_gateway(db, args.hote, args.port, duree=args.duree,
+                    buffer=MesureBuffer(db, batch=args.lot))
+    print(f"{n} relevés ingérés.")
+
+def cmd_purger(db, args):
+    retention = dict(RETENTION)
+    if args.brut is not None:
+        retention["brut"] = args.brut * JOUR
+    for table, n in purge(db, retention).items():
+        print(f"{table:<18} {n:>9} lignes supprimées")
+
+def cmd_serie(db, args):
+    fin = now_ms()
+    debut = fin - int(args.jours * JOUR)
+    pas = args.pas * 1000 if args.pas else None
+    r, rows = query_series(db.cursor(), args.niveau, args.id, debut, fin, pas, args.type)
+    print(f"Résolution lue : {r // 1000 if r else 'brut'} s")
+    tbl = [("Début", "Unité", "Nb", "Moyenne", "Min", "Max")]
+    tbl += [(time.strftime("%Y-%m-%d %H:%M", time.localtime(d / 1000)), u, n, round(m, 2), lo, hi)
+            for d, u, n, m, lo, hi in rows]
+    print(draw_page(tbl[0], tbl[1:], col_widths(tbl[0], tbl[1:])))
+
+def cmd_charge(db, args):
+    db.commit()
+    st = load_test(DB, args.ingesteurs, args.lecteurs, args.secondes)
+    print(f"{st['releves']} relevés ({st['releves'] / st['secondes']:,.0f}/s), "
+          f"{st['lectures']} lectures, {st['ops']} écritures en {st['commits']} commits, "
+          f"{st['erreurs']} erreurs")
+
+def cmd_api(db, args):
+    db.commit()
+    api = ApiServer(DB, args.lecteurs)
+    print(f"API sur http://{args.hote}:{args.port}/ (Ctrl-C pour arrêter)")
+    try:
+        asyncio.run(api.serve(args.hote, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.close()
+
+def cmd_exporter(db, args):
+    sources = list(args.sources) + ([args.sql] if args.sql else [])
+    if not sources:
+        sys.exit("Rien à exporter : donner une ou plusieurs vues, ou --sql.")
+    if args.sortie and len(sources) > 1:
+        sys.exit("--sortie ne vaut que pour une seule source.")
+    jobs = []
+    for s in sources:
+        base = "requete" if s is args.sql else s
+        jobs.append((s, args.sortie or os.path.join(args.dossier, f"{base}.{args.format}")))
+    try:
+        for s, out in jobs:            # erreurs signalées avant de lancer quoi que ce soit
+            export_source(s)
+            if export_format(out).endswith(".zst") and zstd is None:
+                raise ValueError("export .zst : module zstandard absent (pip install zstandard)")
+    except ValueError as e:
+        sys.exit(f"Erreur : {e}")
+    lock = threading.Lock()
+    last = {}
+
+    def progress(out, n, secs):
+        with lock:
+            if secs - last.get(out, -1) >= 1.0:        # une ligne par seconde et par fichier
+                last[out] = secs
+                print(f"  {out} : {n} lignes ({n / secs:,.0f}/s)", file=sys.stderr)
+
+    db.commit()
+    done = export_many(DB, jobs, args.lot, args.paralleles, progress)
+    for out, (n, secs) in done.items():
+        print(f"{out} : {n} lignes en {secs:.2f} s")
+
+def cmd_shard(db, args):
+    if args.action == "creer":
+        db.commit()
+        counts = create_shards(DB, args.catalogue, args.shards)
+        for k, n in counts.items():
+            print(f"{shard_path(args.catalogue, k)} : {n} capteurs")
+        print(f"Catalogue : {args.catalogue}  (python TP2.py --db {args.catalogue} shard ...)")
+        return
+    if not is_catalogue(db.cursor()):
+        sys.exit(f"{DB} n'est pas un catalogue de shards (python TP2.py --db SOURCE shard creer ...).")
+    router = ShardRouter(db, DB)
+    try:
+        if args.action == "compter":
+            per, total = router.counts()
+            rows = [[k, router.files[k]] + [c[t] for t in SHARD_COUNTS] for k, c in sorted(per.items())]
+            rows.append(["", "TOTAL"] + [total[t] for t in SHARD_COUNTS])
+            head = ["Shard", "Fichier"] + SHARD_COUNTS
+            print(draw_page(head, rows, col_widths(head, rows)))
+        elif args.action == "lister":
+            if args.sortie:
+                headers, rows = router.stream(args.vue)
+                n, secs = write_rows(args.sortie, headers, (list(b) for b in iter(
+                    lambda: list(itertools.islice(rows, EXPORT_BATCH)), [])))
+                print(f"{args.sortie} : {n} lignes en {secs:.2f} s")
+                return
+            after = None
+            while True:
+                headers, rows, after = router.page(args.vue, after, args.limite)
+                print(draw_page(headers, rows, col_widths(headers, rows)))
+                if after is None or input_txt("[s]uivante / [q]uitter : ", default="s").lower() == "q":
+                    return
+        elif args.action == "topologie":
+            print("\n== Topologie : Serveur → Gateway → Capteur ==")
+            srv = gw = None
+            for num_srv, ip, num_gw, nom_gw, num_cap, nom_cap, reseau in router.topology():
+                if num_srv != srv:
+                    srv, gw = num_srv, None
+                    print(f"Serveur : {ip}")
+                    if num_gw is None:
+                        print("  (aucune gateway)")
+                if num_gw is not None and num_gw != gw:
+                    gw = num_gw
+                    print(f"  Gateway : {nom_gw}")
+                if num_cap is not None:
+                    print(f"    Capteur : {nom_cap} ({reseau or '?'})")
+        elif args.action == "deplacer":
+            t0 = time.perf_counter()
+            n = router.move(args.batiment, args.vers)
+            print(f"BATIMENT {args.batiment} -> shard {args.vers} : "
+                  + (", ".join(f"{t}: {c}" for t, c in n.items()) if n else "déjà en place")
+                  + f" ({time.perf_counter() - t0:.2f} s)")
+        elif args.action == "inserer":
+            values = dict(kv.split("=", 1) for kv in args.valeurs)
+            values = {k: int(v) if k.startswith("NUM_") or k in INT_COLS else v for k, v in values.items()}
+            print(f"{args.table} : ID {router.insert(args.table, values)}")
+        elif args.action == "supprimer":
+            print_counts(router.delete(args.table, args.id))
+    except (KeyError, ValueError) as e:
+        sys.exit(f"Erreur : {e.args[0]}")
+    finally:
+        router.close()
+
+def cmd_capacite(db, args):
+    try:
+        t0 = time.perf_counter()
+        model = CapacityModel(db.cursor())
+        t_load = time.perf_counter() - t0
+    except RuntimeError as e:
+        sys.exit(f"Erreur : {e}")
+    t0 = time.perf_counter()
+    base = model.loads(args.taux)
+    rep = {"capteurs": len(model.cap_ids),
+           "actuel": capacity_report(model, base, args.capa_gateway, args.capa_serveur, args.top)}
+    try:
+        if args.deplacer:
+            n, src, dst = args.deplacer
+            cap_gw, moved = model.move(n, src, dst)
+            sim = model.loads(args.taux, cap_gw=cap_gw)
+            rep["simulation"] = {"deplaces": moved, "de": src, "vers": dst,
+                                 **capacity_report(model, sim, args.capa_gateway, args.capa_serveur, args.top)}
+        if args.sans_serveur is not None:
+            keep, gw_srv, n_gw, n_cap = model.remove_server(args.sans_serveur)
+            sim = model.loads(args.taux, keep=keep, gw_srv=gw_srv)
+            rep["simulation"] = {"serveur_supprime": args.sans_serveur, "gateways_perdues": n_gw,
+                                 "capteurs_perdus": n_cap,
+                                 **capacity_report(model, sim, args.capa_gateway, args.capa_serveur, args.top)}
+    except KeyError as e:
+        sys.exit(f"Erreur : {e.args[0]}")
+    t_calc = time.perf_counter() - t0
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rep, f, indent=2, ensure_ascii=False)
+    for titre, r in [("Actuel", rep["actuel"])] + ([("Simulation", rep["simulation"])] if "simulation" in rep else []):
+        print(f"\n== {titre} ==")
+        if titre == "Simulation":
+            print({k: v for k, v in r.items() if not isinstance(v, (dict, list))})
+        g, s = r["gateways"], r["serveurs"]
+        print(f"Gateways : {g['total']}, saturées : {g['saturees']}, fan-out capteurs : {g['fanout_capteurs']}")
+        rows = [(x["id"], x["capteurs"], x["charge"], x["marge"], f"{x['utilisation']:.1%}") for x in g["plus_chargees"]]
+        head = ("Gateway", "Capteurs", "Charge", "Marge", "Utilisation")
+        if rows:
+            print(draw_page(head, rows, col_widths(head, rows)))
+        print(f"Serveurs : {s['total']}, saturés : {s['satures']}, fan-out gateways : {s['fanout_gateways']}")
+        rows = [(x["id"], x["gateways"], x["capteurs"], x["charge"], x["marge"], f"{x['utilisation']:.1%}")
+                for x in s["plus_charges"]]
+        head = ("Serveur", "Gateways", "Capteurs", "Charge", "Marge", "Utilisation")
+        if rows:
+            print(draw_page(head, rows, col_widths(head, rows)))
+        rows = [(x["id"], x["debit"], x["capteurs"], x["charge"]) for x in r["reseaux"]]
+        head = ("Réseau", "Débit", "Capteurs", "Charge")
+        if rows:
+            print(draw_page(head, rows, col_widths(head, rows)))
+    print(f"\n{len(model.cap_ids)} capteurs : chargement {t_load:.2f} s, calculs {t_calc * 1000:.1f} ms")
+
+def cmd_generer(db, args):
+    n, dt = generate_fixture(db, args.batiments, args.salles, args.gateways, args.capteurs,
+                             args.serveurs, args.applications, args.connexions, args.graine)
+    print(f"{n} capteurs générés en {dt:.2f} s dans {DB}")
+
+def cmd_inventaire(db, args):
+    cur = db.cursor()
+    if args.reconstruire:
+        t0 = time.perf_counter()
+        with db:
+            n = rebuild_inventaire(cur)
+        print(f"INVENTAIRE reconstruit : {n} capteurs en {time.perf_counter() - t0:.2f} s")
+    missing, extra = check_inventaire(cur)
+    if missing or extra:
+        print(f"INCOHÉRENT : {missing} ligne(s) absente(s) ou périmée(s), {extra} en trop "
+              "(python TP2.py inventaire --reconstruire)")
+        sys.exit(1)
+    print("INVENTAIRE cohérent avec la jointure.")
+
+def cmd_changements(db, args):
+    cur = db.cursor()
+    if args.compacter:
+        with db:
+            n = compact_changes(cur)
+        print(f"{n} changement(s) compacté(s) ; dernier SEQ : {last_change(cur)}", file=sys.stderr)
+        return
+    since = args.depuis
+    if since is None:
+        since = (consumer_position(cur, args.consommateur) if args.consommateur else None) or 0
+    out = sys.stdout
+    try:
+        while True:
+            for batch in tail_changes(cur, since, args.lot):
+                out.write("".join(json.dumps(ch, ensure_ascii=False) + "\n" for ch in batch))
+                out.flush()
+                since = batch[-1]["seq"]
+                if args.consommateur:
+                    with db:
+                        ack_changes(cur, args.consommateur, since)
+            if args.suivre is None:
+                break
+            time.sleep(args.suivre)
+    except LookupError as e:
+        sys.exit(str(e))
+    except KeyboardInterrupt:
+        pass
+
+def cmd_integrite(db, args):
+    cur = db.cursor()
+    t0 = time.perf_counter()
+    report = check_integrity(cur, args.exemples)
+    show_integrity(report)
+    bad = sum(r["lignes"] for r in report)
+    print(f"{bad} ligne(s) en faute, contrôle en {time.perf_counter() - t0:.2f} s")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if bad and args.reparer:
+        t0 = time.perf_counter()
+        counts = repair_integrity(db, dry_run=args.simulation)
+        verb = "seraient touchées" if args.simulation else "touchées"
+        print(f"Réparation{' (simulation, annulée)' if args.simulation else ''} en "
+              f"{time.perf_counter() - t0:.2f} s ; lignes {verb} : "
+              + (", ".join(f"{t} {n}" for t, n in counts.items()) or "aucune"))
+        bad = 0 if not args.simulation else bad
+    if bad:
+        sys.exit(1)
+
+def cmd_script(db, args):
+    t0 = time.perf_counter()
+    try:
+        records = read_script(args.fichier)
+    except (OSError, ValueError, RuntimeError, csv.Error) + ((yaml.YAMLError,) if yaml else ()) as e:
+        sys.exit(f"Erreur : {e}")
+    t1 = time.perf_counter()
+    script = ScriptPlan(db, dry_run=args.simulation)
+    plan = script.compile(records)
+    t2 = time.perf_counter()
+    print(f"{len(records)} opération(s) lue(s) en {t1 - t0:.2f} s, validées en {t2 - t1:.2f} s")
+    if script.errors:
+        for lineno, err in script.errors[:args.erreurs]:
+            print(f"  ligne {lineno} : {err}")
+        if len(script.errors) > args.erreurs:
+            print(f"  ... et {len(script.errors) - args.erreurs} autre(s)")
+        sys.exit(f"{len(script.errors)} erreur(s) : rien n'a été écrit.")
+    try:
+        counts = run_plan(db, plan, chunk=args.lot, dry_run=args.simulation)
+    except ValueError as e:
+        sys.exit(f"Erreur, transaction annulée : {e}")
+    dt = time.perf_counter() - t2
+    head = ("Opération", "Table", "Lignes")
+    rows = [(op, t, n) for (op, t), n in counts.items()]
+    if rows:
+        print(draw_page(head, rows, col_widths(head, rows)))
+    mode = f"{-(-len(plan) // args.lot)} transaction(s)" if args.lot and not args.simulation else "une transaction"
+    print(f"{'Simulation (annulée)' if args.simulation else 'Appliqué'} en {dt:.2f} s, {mode}, "
+          f"{len(plan) / dt if dt else 0:,.0f} opérations/s")
+
+def cmd_bench(db, args):
+    db.commit()
+    res = run_benchmarks(DB, args.repetitions, args.operations)
+    rows = [(k, v["n"], v["p50_ms"], v["p99_ms"], v["lignes_s"], v["rss_mo"]) for k, v in res.items()]
+    head = ("Opération", "n", "p50 ms", "p99 ms", "lignes/s", "RSS max Mo")
+    print(draw_page(head, rows, col_widths(head, rows)))
+    if args.sauver:
+        with open(args.base, "w", encoding="utf-8") as f:
+            json.dump(res, f, indent=2, ensure_ascii=False)
+        print(f"Référence enregistrée : {args.base}")
+    elif os.path.exists(args.base):
+        with open(args.base, encoding="utf-8") as f:
+            slow = compare_baseline(res, json.load(f), args.tolerance)
+        for name, ref, now in slow:
+            print(f"RÉGRESSION {name} : p50 {ref} ms -> {now} ms")
+        if slow:
+            sys.exit(1)
+        print("Aucune régression par rapport à la référence.")
+
+def parse_args(argv):
+    p = argparse.ArgumentParser(prog="TP2", description="Gestion de la base IoT.")
+    p.add_argument("--db", default=DB, help=f"fichier SQLite (défaut : {DB})")
+    p.add_argument("--trace", action="store_true", help="tracer les requêtes (statistiques, requêtes lentes)")
+    p.add_argument("--lent-ms", type=float, default=SLOW_MS, help="seuil des requêtes lentes")
+    p.add_argument("--journal-lent", help=f"journal des requêtes lentes (JSONL ; défaut : BASE{SLOW_LOG}, "
+                   "\"\" pour le désactiver)")
+    p.add_argument("--trace-json", help="statistiques des requêtes écrites à la sortie")
+    p.add_argument("--memoire", action="store_true",
+                   help="console sur une copie en mémoire, réécrite périodiquement sur disque")
+    p.add_argument("--ecriture-differee", type=float, default=SNAPSHOT_INTERVAL, metavar="SECONDES",
+                   help="intervalle des écritures sur disque en mode --memoire")
+    sub = p.add_subparsers(dest="commande")
+    sp = sub.add_parser("import", help="import en masse CSV / JSONL")
+    sp.add_argument("fichiers", nargs="+", help="TABLE=fichier.csv|.jsonl (ou fichier nommé comme la table)")
+    sp.add_argument("--lot", type=int, default=IMPORT_BATCH, help="lignes par transaction")
+    sp.add_argument("--rejets", default="rejets.jsonl", help="fichier des lignes rejetées")
+    sp.set_defaults(func=cmd_import)
+    sp = sub.add_parser("simuler", help="relevés simulés (ingestion directe ou envoi UDP)")
+    sp.add_argument("--mesures", type=int, default=1_000_000)
+    sp.add_argument("--lot", type=int, default=MESURE_BATCH, help="relevés par commit")
+    sp.add_argument("--udp", metavar="HOTE:PORT", help="envoyer à une passerelle au lieu d'écrire")
+    sp.set_defaults(func=cmd_simuler)
+    sp = sub.add_parser("passerelle", help="reçoit des relevés UDP et les ingère")
+    sp.add_argument("--hote", default="127.0.0.1")
+    sp.add_argument("--port", type=int, default=5684)
+    sp.add_argument("--duree", type=float, help="arrêt après N secondes")
+    sp.add_argument("--lot", type=int, default=MESURE_BATCH, help="relevés par commit")
+    sp.set_defaults(func=cmd_passerelle)
+    sp = sub.add_parser("purger", help="applique la rétention des relevés et agrégats")
+    sp.add_argument("--brut", type=float, help="âge max. des relevés bruts, en jours")
+    sp.set_defaults(func=cmd_purger)
+    sp = sub.add_parser("serie", help="série agrégée d'un capteur / salle / bâtiment")
+    sp.add_argument("niveau", choices=list(NIVEAUX))
+    sp.add_argument("id", type=int)
+    sp.add_argument("--jours", type=float, default=1.0, help="fenêtre jusqu'à maintenant")
+    sp.add_argument("--pas", type=int, help="largeur de case en secondes")
+    sp.add_argument("--type", type=int, help="NUM_TYPE (salle / bâtiment)")
+    sp.set_defaults(func=cmd_serie)
+    sp = sub.add_parser("charge", help="ingesteurs + lecteurs simultanés (WAL, écrivain unique)")
+    sp.add_argument("--ingesteurs", type=int, default=4)
+    sp.add_argument("--lecteurs", type=int, default=READERS)
+    sp.add_argument("--secondes", type=float, default=5.0)
+    sp.set_defaults(func=cmd_charge)
+    sp = sub.add_parser("api", help="API HTTP/JSON en lecture (asyncio)")
+    sp.add_argument("--hote", default="127.0.0.1")
+    sp.add_argument("--port", type=int, default=8080)
+    sp.add_argument("--lecteurs", type=int, default=READERS, help="threads / connexions SQLite")
+    sp.set_defaults(func=cmd_api)
+    sp = sub.add_parser("exporter", help="exporte des vues ou un SELECT en CSV / JSONL (compressé)")
+    sp.add_argument("sources", nargs="*", help=f"vues : {', '.join(VIEWS)}, topologie")
+    sp.add_argument("--sql", help="SELECT libre (exporté dans requete.FORMAT)")
+    sp.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    sp.add_argument("--dossier", default=".", help="répertoire des fichiers produits")
+    sp.add_argument("--sortie", help="fichier de sortie (une seule source ; format tiré de l'extension)")
+    sp.add_argument("--lot", type=int, default=EXPORT_BATCH, help="lignes par fetchmany")
+    sp.add_argument("--paralleles", type=int, default=READERS, help="exports simultanés")
+    sp.set_defaults(func=cmd_exporter)
+    sp = sub.add_parser("shard", help="partitionnement par bâtiment sur plusieurs fichiers")
+    ss = sp.add_subparsers(dest="action", required=True)
+    a = ss.add_parser("creer", help="découpe --db (inchangée) en un catalogue + N shards")
+    a.add_argument("catalogue", help="fichier catalogue à créer (ex. parc.db -> parc.shard0.db, ...)")
+    a.add_argument("--shards", type=int, default=4)
+    ss.add_parser("compter", help="effectifs par shard (en parallèle)")
+    a = ss.add_parser("lister", help="vue fusionnée de tous les shards")
+    a.add_argument("vue", nargs="?", default="capteurs", choices=list(VIEWS))
+    a.add_argument("--limite", type=int, default=PAGE_SIZE, help="lignes par page")
+    a.add_argument("--sortie", help="export complet (csv, jsonl, .gz ...) au lieu de l'affichage")
+    ss.add_parser("topologie", help="topologie serveur -> gateway -> capteur fusionnée")
+    a = ss.add_parser("deplacer", help="déplace un bâtiment (et son sous-arbre) vers un shard")
+    a.add_argument("batiment", type=int)
+    a.add_argument("vers", type=int, help="NUM_SHARD cible")
+    a = ss.add_parser("inserer", help="insertion routée : TABLE COL=VAL ...")
+    a.add_argument("table", choices=list(AUTO_ID) + ["APP_SRV_CONNEXION"])
+    a.add_argument("valeurs", nargs="+", metavar="COL=VAL")
+    a = ss.add_parser("supprimer", help="suppression routée (cascade dans le shard)")
+    a.add_argument("table", choices=list(AUTO_ID))
+    a.add_argument("id", type=int)
+    sp.set_defaults(func=cmd_shard)
+    sp = sub.add_parser("capacite", help="charge / marge par gateway, serveur, réseau (NumPy) et simulations")
+    sp.add_argument("--taux", type=float, default=1.0, help="part du débit réseau consommée par capteur")
+    sp.add_argument("--capa-gateway", type=float, default=CAPA_GATEWAY)
+    sp.add_argument("--capa-serveur", type=float, default=CAPA_SERVEUR)
+    sp.add_argument("--top", type=int, default=10, help="gateways / serveurs les plus chargés affichés")
+    sp.add_argument("--deplacer", type=int, nargs=3, metavar=("N", "GW_SRC", "GW_DST"),
+                    help="simule le déplacement de N capteurs d'une gateway à une autre")
+    sp.add_argument("--sans-serveur", type=int, metavar="NUM_SERVEUR",
+                    help="simule del_serveur (gateways et capteurs rattachés perdus)")
+    sp.add_argument("--json", help="rapport complet en JSON")
+    sp.set_defaults(func=cmd_capacite)
+    sp = sub.add_parser("inventaire", help="vérifie (ou reconstruit) l'inventaire matérialisé")
+    sp.add_argument("--reconstruire", action="store_true", help="recalcule toute la table")
+    sp.set_defaults(func=cmd_inventaire)
+    sp = sub.add_parser("changements", help="journal des changements (JSONL) depuis un SEQ, par lots")
+    sp.add_argument("--depuis", type=int, help="dernier SEQ déjà traité (défaut : position du consommateur, sinon 0)")
+    sp.add_argument("--consommateur", help="nom : position reprise puis acquittée après chaque lot")
+    sp.add_argument("--lot", type=int, default=CDC_BATCH, help="changements par lecture")
+    sp.add_argument("--suivre", type=float, metavar="SECONDES", help="attendre les suivants (intervalle de relecture)")
+    sp.add_argument("--compacter", action="store_true", help="compacter le journal maintenant")
+    sp.set_defaults(func=cmd_changements)
+    sp = sub.add_parser("integrite", help="contrôle ensembliste des clés étrangères et règles (réparation)")
+    sp.add_argument("--reparer", action="store_true", help="corrige tout en une transaction")
+    sp.add_argument("--simulation", action="store_true", help="avec --reparer : compte puis annule")
+    sp.add_argument("--exemples", type=int, default=INTEGRITY_SAMPLES, help="identifiants montrés par contrôle")
+    sp.add_argument("--json", help="rapport en JSON")
+    sp.set_defaults(func=cmd_integrite)
+    sp = sub.add_parser("script", help="applique un script d'opérations insert / update / delete")
+    sp.add_argument("fichier", help="opérations en .json (liste), .jsonl, .yaml ou .csv")
+    sp.add_argument("--lot", type=int, help="opérations par transaction (défaut : tout en une)")
+    sp.add_argument("--simulation", action="store_true", help="valide et exécute puis annule")
+    sp.add_argument("--erreurs", type=int, default=20, help="erreurs de validation affichées")
+    sp.set_defaults(func=cmd_script)
+    sp = sub.add_parser("generer", help="remplit une base vide avec une topologie synthétique")
+    sp.add_argument("--batiments", type=int, default=10)
+    sp.add_argument("--salles", type=int, default=10, help="par bâtiment")
+    sp.add_argument("--gateways", type=int, default=2, help="par salle")
+    sp.add_argument("--capteurs", type=int, default=20, help="par gateway")
+    sp.add_argument("--serveurs", type=int, default=10)
+    sp.add_argument("--applications", type=int, default=5)
+    sp.add_argument("--connexions", type=int, default=3, help="serveurs par application")
+    sp.add_argument("--graine", type=int, default=0)
+    sp.set_defaults(func=cmd_generer)
+    sp = sub.add_parser("bench", help="chronomètre show_* / insert_* / update_* / del_*")
+    sp.add_argument("--repetitions", type=int, default=5)
+    sp.add_argument("--operations", nargs="*", help="sous-ensemble (ex. show_capteurs del_batiment)")
+    sp.add_argument("--base", default="bench_baseline.json", help="fichier de référence")
+    sp.add_argument("--sauver", action="store_true", help="enregistrer comme nouvelle référence")
+    sp.add_argument("--tolerance", type=float, default=0.20, help="écart p50 toléré (0.2 = +20 %%)")
+    sp.set_defaults(func=cmd_bench)
+    args = p.parse_args(argv)
+    if args.memoire and args.commande:
+        p.error("--memoire ne s'applique qu'à la console (sans sous-commande)")
+    return args
+
+def main(argv=None):
+    global DB
+    args = parse_args(argv)
+    DB = args.db
+    tracer = None
+    if args.trace or args.trace_json:
+        tracer = QueryTracer(args.lent_ms, DB + SLOW_LOG if args.journal_lent is None else args.journal_lent)
+    traced = tracer is not None and not args.memoire      # en mémoire : c'est la copie qui est tracée
+    with (connect_traced(DB, tracer) if traced else connect(DB)) as db:
+        try:
+            migrate(db)                 # le journal a été écrit sur le dernier schéma
+            recover_journal(db, DB)
+            if args.commande:
+                args.func(db, args)
+            elif args.memoire:
+                snap = MemorySnapshot(db, DB, args.ecriture_differee, tracer)
+                signal.signal(signal.SIGTERM, lambda *_: sys.exit(128 + signal.SIGTERM))
+                print("TP2 (instantané en mémoire)")
+                try:
+                    menu_principal(snap.mem)
+                finally:
+                    snap.close()
             else:
-                print("Choix invalide.")
+                print("TP2")
+                menu_principal(db)
+        finally:
+            if tracer and args.trace_json:
+                tracer.export(args.trace_json)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
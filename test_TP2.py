@@ -0,0 +1,850 @@
+"""Tests de comportement de TP2 (python -m pytest -q).
+
+Chaque test part d'une petite base : 2 bâtiments, 2 salles par bâtiment,
+2 gateways par salle, 3 capteurs par gateway (IDs 1..24), 3 serveurs
+(gateway g sur le serveur (g - 1) % 3 + 1), 2 applications.
+"""
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+
+import pytest
+
+import TP2
+
+
+def fill(db):
+    db.executemany("INSERT INTO TYPE(NUM_TYPE, NOM_TYPE, UNITE) VALUES (?,?,?)",
+                   [(1, "Température", "°C"), (2, "Humidité", "%")])
+    db.executemany("INSERT INTO RESEAU(NUM_RESEAU, TYPE_RESEAU, DEBIT_RESEAU) VALUES (?,?,?)",
+                   [(1, "WiFi", 54), (2, "LoRa", 1)])
+    db.executemany("INSERT INTO SERVEUR(NUM_SERVEUR, ADRESSE_IP) VALUES (?,?)",
+                   [(i, f"10.0.0.{i}") for i in (1, 2, 3)])
+    db.executemany("INSERT INTO APPLICATION(NUM_APPLICATION, NOM_APPLICATION) VALUES (?,?)",
+                   [(1, "App 1"), (2, "App 2")])
+    db.executemany("INSERT INTO APP_SRV_CONNEXION(NUM_APPLICATION, NUM_SERVEUR) VALUES (?,?)",
+                   [(1, 1), (1, 2), (2, 2), (2, 3)])
+    db.executemany("INSERT INTO BATIMENT(NUM_BATIMENT, NOM_BATIMENT) VALUES (?,?)",
+                   [(b, f"Batiment {b}") for b in (1, 2)])
+    db.executemany("INSERT INTO SALLE(NUM_SALLE, NUM_BATIMENT, NOM_SALLE) VALUES (?,?,?)",
+                   [(s, (s - 1) // 2 + 1, f"Salle {s}") for s in range(1, 5)])
+    db.executemany("INSERT INTO GATEWAY(NUM_GATEWAY, NUM_SERVEUR, NUM_SALLE, NOM_GATEWAY) VALUES (?,?,?,?)",
+                   [(g, (g - 1) % 3 + 1, (g - 1) // 2 + 1, f"GW{g}") for g in range(1, 9)])
+    db.executemany("""INSERT INTO CAPTEUR(NUM_CAPTEUR, NUM_SALLE, NUM_GATEWAY, NUM_TYPE, NUM_RESEAU, NOM_CAPTEUR)
+                      VALUES (?,?,?,?,?,?)""",
+                   [(c, (c - 1) // 6 + 1, (c - 1) // 3 + 1, c % 2 + 1, c % 2 + 1, f"Cap{c}")
+                    for c in range(1, 25)])
+
+
+@pytest.fixture
+def path(tmp_path):
+    p = str(tmp_path / "iot.db")
+    with sqlite3.connect(p) as db:
+        TP2.migrate(db)
+        fill(db)
+    db.close()
+    TP2.topology_cache.invalidate()
+    return p
+
+
+@pytest.fixture
+def db(path):
+    db = sqlite3.connect(path)
+    yield db
+    db.close()
+    TP2.topology_cache.invalidate()
+
+
+def count(db, table, where="1", params=()):
+    return db.execute(f"SELECT count(*) FROM {table} WHERE {where}", params).fetchone()[0]
+
+
+# ------------------ Schéma ------------------
+
+def test_migrate_idempotent(db):
+    assert TP2.schema_version(db.cursor()) == TP2.SCHEMA_VERSION
+    TP2.migrate(db)
+    assert TP2.schema_version(db.cursor()) == TP2.SCHEMA_VERSION
+
+
+def test_cles_etrangeres_indexees(db):
+    for (table,) in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+        firsts = {db.execute(f"PRAGMA index_info({i[1]})").fetchone()[2]
+                  for i in db.execute(f"PRAGMA index_list({table})")}
+        pk = [r[1] for r in db.execute(f"PRAGMA table_info({table})") if r[5] == 1]
+        for fk in db.execute(f"PRAGMA foreign_key_list({table})"):
+            assert fk[3] in firsts | set(pk), (table, fk[3])
+
+
+# ------------------ Suppressions en cascade ------------------
+
+def test_cascade_batiment(db):
+    counts = TP2.delete_many(db, "BATIMENT", [1])
+    assert counts["SALLE"] == 2 and counts["GATEWAY"] == 4 and counts["CAPTEUR"] == 12
+    assert count(db, "CAPTEUR") == 12
+    assert count(db, "GATEWAY", "NUM_SALLE NOT IN (SELECT NUM_SALLE FROM SALLE)") == 0
+
+
+def test_cascade_serveur_plusieurs_ids(db):
+    gws = count(db, "GATEWAY", "NUM_SERVEUR IN (1, 2)")
+    counts = TP2.delete_many(db, "SERVEUR", [1, 2, 2])
+    assert counts["GATEWAY"] == gws
+    assert count(db, "APP_SRV_CONNEXION", "NUM_SERVEUR IN (1, 2)") == 0
+    assert count(db, "CAPTEUR", "NUM_GATEWAY NOT IN (SELECT NUM_GATEWAY FROM GATEWAY)") == 0
+
+
+# ------------------ Pagination par clé ------------------
+
+def test_keyset_couvre_la_vue_une_fois(db):
+    cur, seen, after = db.cursor(), [], None
+    while True:
+        _, rows, first, last = TP2.keyset_page(cur, "capteurs", after=after, limit=5)
+        seen += rows
+        if len(rows) < 5:
+            break
+        after = last
+    assert len(seen) == 24 and len(set(seen)) == 24
+    _, back, _, _ = TP2.keyset_page(cur, "capteurs", before=first, limit=5)
+    assert back == seen[15:20]               # page précédant la dernière (20..23)
+
+
+# ------------------ Import en masse ------------------
+
+def test_import_rejets(db, tmp_path):
+    src = tmp_path / "CAPTEUR.csv"
+    src.write_text("NOM_CAPTEUR,NUM_SALLE,NUM_GATEWAY,TYPE,RESEAU\n"
+                   "Neuf,1,1,Humidité,WiFi\n"
+                   "Perdu,1,999,Humidité,WiFi\n", encoding="utf-8")
+    rejets = tmp_path / "rejets.jsonl"
+    TP2.import_files(db, [str(src)], rejects_path=str(rejets))
+    assert count(db, "CAPTEUR", "NOM_CAPTEUR = 'Neuf'") == 1
+    lines = [json.loads(l) for l in rejets.read_text(encoding="utf-8").splitlines()]
+    assert [(r["ligne"], r["donnees"]["NOM_CAPTEUR"]) for r in lines] == [(2, "Perdu")]
+    assert "NUM_GATEWAY=999" in lines[0]["erreur"]
+
+
+def test_import_rend_les_ids_inutilises(db, tmp_path):
+    src = tmp_path / "BATIMENT.csv"
+    src.write_text("NOM_BATIMENT\nA\nB\n", encoding="utf-8")
+    TP2.import_files(db, [str(src)], rejects_path=str(tmp_path / "rejets.jsonl"))
+    nid = db.execute("INSERT INTO BATIMENT(NOM_BATIMENT) VALUES ('C')").lastrowid
+    assert [r[0] for r in db.execute("SELECT NUM_BATIMENT FROM BATIMENT ORDER BY 1")] == [1, 2, 3, 4, nid]
+    assert nid == 5
+
+
+# ------------------ Identifiants ------------------
+
+def test_blocs_reserves_disjoints(db, path):
+    other = sqlite3.connect(path)
+    a, b = TP2.IdAllocator(db, block=10), TP2.IdAllocator(other, block=10)
+    ids = [a.next("SALLE"), b.next("SALLE"), a.next("SALLE"), b.next("SALLE")]
+    other.close()
+    assert ids == [5, 15, 6, 16]
+    with db:
+        nid = db.execute("INSERT INTO SALLE(NUM_BATIMENT, NOM_SALLE) VALUES (1, 'x')").lastrowid
+    assert nid == 25                         # au-dessus des deux blocs
+
+
+def test_ids_non_rendus_apres_un_autre_ecrivain(db, path):
+    alloc = TP2.IdAllocator(db, block=100)
+    assert alloc.next("SALLE") == 5
+    other = sqlite3.connect(path)
+    first = TP2.reserve_ids(other, "SALLE", 10)     # au-dessus du bloc
+    other.close()
+    alloc.release()
+    assert first == 105
+    assert db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'SALLE'").fetchone()[0] == 114
+
+
+# ------------------ Relevés ------------------
+
+T0 = TP2.now_ms() // TP2.JOUR * TP2.JOUR     # minuit (UTC) du jour : dans la rétention
+
+
+def test_tampon_releves(db):
+    with TP2.MesureBuffer(db, batch=2, delay=3600) as buf:
+        buf.add(1, T0, 1.0)
+        assert count(db, "MESURE") == 0
+        buf.add(1, T0 + 1000, 2.0)           # lot plein : écrit
+        assert count(db, "MESURE") == 2
+        buf.add(1, T0, 5.0)                  # déjà reçu : ignoré
+    assert buf.total == 2 and count(db, "MESURE") == 2
+    assert db.execute("SELECT VALEUR FROM MESURE WHERE HORODATAGE = ?", (T0,)).fetchone()[0] == 1.0
+
+
+# ------------------ Agrégats ------------------
+
+def test_agregats_cumules_sans_doublon(db):
+    cur = db.cursor()
+    with db:
+        assert TP2.store_readings(cur, [(1, T0, 1.0)]) == 1
+    with db:   # réémission du premier relevé + un nouveau dans la même minute
+        assert TP2.store_readings(cur, [(1, T0, 1.0), (1, T0 + 1000, 3.0)]) == 1
+    for table, col, key in (("AGREGAT_CAPTEUR", "NUM_CAPTEUR", 1), ("AGREGAT_SALLE", "NUM_SALLE", 1),
+                            ("AGREGAT_BATIMENT", "NUM_BATIMENT", 1)):
+        for res in TP2.RESOLUTIONS:
+            row = db.execute(f"SELECT NB, SOMME, MINI, MAXI FROM {table} WHERE {col} = ? AND RESOLUTION = ?",
+                             (key, res)).fetchone()
+            assert row == (2, 4.0, 1.0, 3.0), (table, res)
+
+
+def test_releves_hors_retention_ignores(db):
+    vieux = T0 - 31 * TP2.JOUR
+    with db:
+        assert TP2.store_readings(db.cursor(), [(1, vieux, 1.0), (1, T0, 2.0)]) == 1
+    assert count(db, "AGREGAT_CAPTEUR", "DEBUT < ?", (T0 - TP2.JOUR,)) == 0
+
+
+def test_cascade_releves_et_agregats(db):
+    with db:
+        TP2.store_readings(db.cursor(), [(1, T0, 1.0), (7, T0, 2.0), (13, T0, 3.0)])
+    counts = TP2.delete_many(db, "BATIMENT", [1])
+    assert counts["MESURE"] == 2
+    assert count(db, "AGREGAT_BATIMENT", "NUM_BATIMENT = 1") == 0
+    assert count(db, "AGREGAT_SALLE", "NUM_SALLE IN (1, 2)") == 0
+    assert count(db, "AGREGAT_BATIMENT", "NUM_BATIMENT = 2") == 3
+    counts = TP2.delete_many(db, "TYPE", [2])             # capteur 13 : type 2
+    assert count(db, "AGREGAT_SALLE", "NUM_TYPE = 2") == 0
+    assert count(db, "AGREGAT_BATIMENT", "NUM_TYPE = 2") == 0 and counts["AGREGAT_BATIMENT"] == 3
+
+
+def test_purge_retention(db):
+    cur = db.cursor()
+    with db:
+        TP2.store_readings(cur, [(1, T0, 1.0), (1, T0 + TP2.MINUTE, 2.0)])
+    counts = TP2.purge(db, now=T0 + 31 * TP2.JOUR)
+    assert counts["MESURE"] == 2 and count(db, "MESURE") == 0
+    assert count(db, "AGREGAT_CAPTEUR", "RESOLUTION = ?", (TP2.MINUTE,)) == 2
+
+
+# ------------------ Cache de topologie ------------------
+
+def test_topologie_sous_arbres(db):
+    g = TP2.topology_cache.get(db.cursor())
+    for sv in (1, 2, 3):
+        expected = [r[0] for r in db.execute("""SELECT C.NUM_CAPTEUR FROM CAPTEUR C
+            JOIN GATEWAY G USING (NUM_GATEWAY) WHERE G.NUM_SERVEUR = ? ORDER BY C.NOM_CAPTEUR""", (sv,))]
+        assert g.capteurs_of_server(sv) == expected
+    assert g.capteurs_of_gateway(2) == [4, 5, 6]
+    assert sorted(g.applications_of_gateway(2)) == [1, 2]      # gateway 2 -> serveur 2
+    assert g.servers_of_application(2) == [2, 3]
+
+
+def test_topologie_renommage_et_suppression(db):
+    cur = db.cursor()
+    g = TP2.topology_cache.get(cur)
+    TP2.topology_cache.rename("SERVEUR", 1, "10.9.9.9")
+    assert TP2.topology_cache.get(cur) is g and g.srv_name[g.srv_idx[1]] == "10.9.9.9"
+    TP2.delete_many(db, "GATEWAY", [1])
+    g2 = TP2.topology_cache.get(cur)
+    assert g2 is not g and 1 not in g2.cap_idx and g2.capteurs_of_gateway(1) == []
+
+
+# ------------------ Écrivain unique ------------------
+
+def test_ecrivain_groupe_les_commits(db, path):
+    w = TP2.WriterThread(path, delay=0.2)
+    try:
+        sql = "INSERT INTO BATIMENT(NOM_BATIMENT) VALUES (?)"
+        futs = [w.execute(sql, ("A",)), w.execute("INSERT INTO INCONNUE VALUES (1)"),
+                w.execute(sql, ("B",))]
+        assert futs[0].result() == 1 and futs[2].result() == 1
+        with pytest.raises(sqlite3.OperationalError):
+            futs[1].result()                 # seule l'opération fautive est annulée
+    finally:
+        w.stop()
+    assert (w.commits, w.ops) == (1, 3)
+    assert count(db, "BATIMENT", "NOM_BATIMENT IN ('A', 'B')") == 2
+    assert db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_suppression_par_ecrivain(db, path):
+    w = TP2.WriterThread(path)
+    try:
+        counts = TP2.delete_many(None, "GATEWAY", [1], writer=w)
+    finally:
+        w.stop()
+    assert counts == {"CAPTEUR": 3, "GATEWAY": 1} and w.ops == 1
+    assert count(db, "CAPTEUR") == 21
+
+
+# ------------------ API HTTP ------------------
+
+class FakeWriter:
+    def __init__(self):
+        self.data = b""
+
+    def write(self, b):
+        self.data += b
+
+    async def drain(self):
+        pass
+
+    def status(self):
+        return int(self.data.split(b" ", 2)[1])
+
+    def json(self):
+        return json.loads(self.data.split(b"\r\n\r\n", 1)[1])
+
+
+@pytest.fixture
+def api(path):
+    srv = TP2.ApiServer(path, readers=1)
+    yield srv
+    srv.close()
+
+
+def call(srv, target, method="GET", **headers):
+    async def go():
+        srv.slots = asyncio.Semaphore(1)
+        w = FakeWriter()
+        await srv.dispatch(w, method, target, {k.lower().replace("_", "-"): v for k, v in headers.items()})
+        return w
+    return asyncio.run(go())
+
+
+def test_api_pages_et_erreurs(api):
+    first = call(api, "/capteurs?limite=20").json()
+    rest = call(api, "/capteurs?apres=" + first["suivant"]).json()
+    assert len(first["donnees"]) == 20 and len(rest["donnees"]) == 4
+    assert call(api, "/inconnue").status() == 404
+    assert call(api, "/batiments", method="POST").status() == 405
+
+
+def test_api_etag(api):
+    etag = call(api, "/batiments").data.split(b"ETag: ")[1].split(b"\r\n")[0].decode()
+    assert call(api, "/batiments", if_none_match=etag).status() == 304
+    assert call(api, "/batiments", if_none_match=f'"autre", W/{etag}').status() == 304
+    assert call(api, "/batiments", if_none_match="*").status() == 304
+    assert call(api, "/batiments", if_none_match='"autre"').status() == 200
+
+
+@pytest.mark.parametrize("target", [
+    "/topologie?serveur=abc",
+    "/capteurs?apres=" + TP2.encode_cursor(["x"]),
+    "/capteurs?apres=" + TP2.encode_cursor([[1], 2, 3, 4]),
+    "/batiments?apres=eyJhIjoxfQ",
+    "/batiments?apres=!!!",
+])
+def test_api_400(api, target):
+    assert call(api, target).status() == 400
+
+
+def test_api_limite_bornee(api):
+    for limite, n in (("0", 1), ("-1", 1), ("100000", 2)):
+        assert len(call(api, f"/batiments?limite={limite}").json()["donnees"]) == n
+
+
+def test_api_topologie_par_blocs(api, db, monkeypatch):
+    db.execute("INSERT INTO SERVEUR(NUM_SERVEUR, ADRESSE_IP) VALUES (4, '10.0.0.0')")   # sans gateway
+    db.execute("INSERT INTO GATEWAY(NUM_SERVEUR, NUM_SALLE, NOM_GATEWAY) VALUES (1, 1, 'GW0')")
+    db.commit()
+    monkeypatch.setattr(TP2, "STREAM_CHUNK", 4)
+    drains = []
+
+    class SlowClient(FakeWriter):
+        async def drain(self):            # ni créneau ni connexion tenus pendant l'attente
+            drains.append((api.slots.locked(), api.pool.free.qsize()))
+
+    async def go():
+        api.slots = asyncio.Semaphore(1)
+        w = SlowClient()
+        await api.dispatch(w, "GET", "/topologie", {})
+        return w
+    body = asyncio.run(go()).data.split(b"\r\n\r\n", 1)[1]
+    data = b""
+    while True:
+        size, _, body = body.partition(b"\r\n")
+        if int(size, 16) == 0:
+            break
+        data, body = data + body[:int(size, 16)], body[int(size, 16) + 2:]
+    expected = [dict(zip(TP2.TOPOLOGIE_COLS, r)) for r in db.execute(TP2.TOPOLOGIE_SQL.format(where=""))]
+    assert json.loads(data) == expected and len(expected) == 26
+    assert len(drains) == 8 and set(drains) == {(False, 1)}
+
+
+def test_api_corps_lu_avant_405(api):
+    async def go():
+        api.slots = asyncio.Semaphore(1)
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"POST /batiments HTTP/1.1\r\nContent-Length: 5\r\n\r\nhello"
+                         b"GET /batiments HTTP/1.1\r\nConnection: close\r\n\r\n")
+        reader.feed_eof()
+        w = FakeWriter()
+        w.close = lambda: None
+        await api.handle(reader, w)
+        return w.data
+    data = asyncio.run(go())
+    assert data.startswith(b"HTTP/1.1 405") and data.count(b"HTTP/1.1 200") == 1
+
+
+def test_api_500(api, monkeypatch):
+    monkeypatch.setattr(TP2, "keyset_page", lambda *a, **k: 1 / 0)
+    assert call(api, "/batiments").status() == 500
+
+
+# ------------------ Générateur et bancs d'essai ------------------
+
+def test_generateur_reproductible(tmp_path):
+    dumps = []
+    for name in ("a.db", "b.db"):
+        db = TP2.connect(str(tmp_path / name))
+        TP2.migrate(db)
+        n, _ = TP2.generate_fixture(db, batiments=3, salles=2, gateways=2, capteurs=4, serveurs=5)
+        assert n == 48 == count(db, "CAPTEUR", "NUM_SALLE = (SELECT NUM_SALLE FROM GATEWAY G "
+                                               "WHERE G.NUM_GATEWAY = CAPTEUR.NUM_GATEWAY)")
+        dumps.append([db.execute(f"SELECT * FROM {t} ORDER BY 1, 2").fetchall() for t in TP2.TABLES])
+        with pytest.raises(ValueError):
+            TP2.generate_fixture(db)
+        db.close()
+    assert dumps[0] == dumps[1]
+
+
+def test_bench_sur_une_copie(db, path):
+    before = list(db.iterdump())
+    results = TP2.run_benchmarks(path, repeat=2, only={"show_batiments", "insert_batiment", "del_capteur"})
+    assert set(results) == {"show_batiments", "insert_batiment", "del_capteur"}
+    assert all(r["n"] == 2 for r in results.values())
+    assert list(db.iterdump()) == before
+    assert TP2.compare_baseline(results, {k: {"p50_ms": 1e6} for k in results}) == []
+    assert [s[0] for s in TP2.compare_baseline(results, {"show_batiments": {"p50_ms": 1e-6}})] == ["show_batiments"]
+
+
+# ------------------ Traçage des requêtes ------------------
+
+def test_traceur_lignes_appelant_et_plan(path, tmp_path):
+    log = tmp_path / "lentes.jsonl"
+    tracer = TP2.QueryTracer(slow_ms=0, slow_log=str(log))
+    db = TP2.connect_traced(path, tracer)
+
+    def show_noms(cur):
+        return [r for r in cur.execute("SELECT NOM_CAPTEUR FROM CAPTEUR C WHERE C.NOM_CAPTEUR LIKE ?", ("Cap1%",))]
+    assert len(show_noms(db.cursor())) == 11
+    db.execute("SELECT NOM_BATIMENT FROM BATIMENT WHERE NUM_BATIMENT = ?", (1,)).fetchall()
+    rep = tracer.report()["requetes"]
+    db.close()
+    scan = rep["SELECT NOM_CAPTEUR FROM CAPTEUR C WHERE C.NOM_CAPTEUR LIKE ?"]
+    assert (scan["n"], scan["lignes"], scan["appelants"]) == (1, 11, {"show_noms": 1})
+    assert scan["plan"] and rep["SELECT NOM_BATIMENT FROM BATIMENT WHERE NUM_BATIMENT = ?"]["plan"] is None
+    slow = [json.loads(l) for l in log.read_text(encoding="utf-8").splitlines()]
+    assert "LIKE 'Cap1%'" in slow[0]["sql"]     # paramètres substitués
+
+
+def test_journal_lent_a_cote_de_la_base(path, tmp_path, monkeypatch):
+    cwd = tmp_path / "ailleurs"
+    cwd.mkdir()
+    monkeypatch.chdir(cwd)
+    TP2.main(["--db", path, "--lent-ms", "0", "--trace-json", str(tmp_path / "t.json"), "inventaire"])
+    assert os.listdir(cwd) == []
+    with open(path + TP2.SLOW_LOG, encoding="utf-8") as f:
+        assert json.loads(f.readline())["ms"] >= 0
+
+
+def test_traceur_sur_demande(path, monkeypatch):
+    monkeypatch.setattr("builtins.input", lambda *_: "0")
+    TP2.main(["--db", path, "--lent-ms", "0"])              # console sans --trace
+    assert not os.path.exists(path + TP2.SLOW_LOG)
+    TP2.main(["--db", path, "--lent-ms", "0", "--trace"])
+    assert os.path.exists(path + TP2.SLOW_LOG)
+
+
+# ------------------ Sélection d'entités ------------------
+
+def test_recherche_par_prefixe_paginee(db):
+    cur = db.cursor()
+    rows, _ = TP2.picker_page(cur, "CAPTEUR", "cap1")
+    assert [r[1] for r in rows] == ["Cap1"] + [f"Cap{i}" for i in range(10, 20)]
+    assert rows[0][2] == "GW1"                                # contexte : la gateway
+    pages, after = [], None
+    while True:
+        page, after = TP2.picker_page(cur, "CAPTEUR", "cap1", after, limit=4)
+        pages += page
+        if len(page) < 4:
+            break
+    assert pages == rows
+    assert [r[0] for r in TP2.picker_page(cur, "SERVEUR", "10.0.0.2")[0]] == [2]
+
+
+def test_choix_par_id(db, monkeypatch):
+    monkeypatch.setattr(TP2, "PAGE_SIZE", 5)                  # CAPTEUR devient « grande » table
+    with TP2.scripted_input(["#99", "#7"], io.StringIO()):
+        assert TP2.choose(db.cursor(), "CAPTEUR") == 7
+    with TP2.scripted_input(["3"], io.StringIO()):
+        assert TP2.choose(db.cursor(), "BATIMENT") is None    # ID inexistant, puis « q »
+
+
+# ------------------ Inventaire matérialisé ------------------
+
+def test_inventaire_colonnes_typees(db):
+    types = {r[1]: r[2] for r in db.execute("PRAGMA table_info(INVENTAIRE)")}
+    assert all(t == ("INTEGER" if c.startswith("NUM_") else "TEXT") for c, t in types.items())
+
+
+@pytest.mark.parametrize("table, col", [("GATEWAY", "NUM_GATEWAY"), ("SALLE", "NUM_SALLE"),
+                                        ("TYPE", "NUM_TYPE"), ("SERVEUR", "NUM_SERVEUR")])
+def test_inventaire_triggers_indexes(db, table, col):
+    # « I.NUM_X = OLD.NUM_X » des triggers : sans type, la colonne serait
+    # convertie et l'index ignoré (parcours complet par ligne modifiée)
+    plan = " ".join(r[3] for r in db.execute(
+        f"EXPLAIN QUERY PLAN SELECT 1 FROM {table} P JOIN INVENTAIRE I ON I.{col} = P.{col} WHERE P.{col} = 1"))
+    assert "SEARCH I USING" in plan
+
+
+def test_inventaire_suit_les_renommages(db):
+    with db:
+        db.execute("UPDATE GATEWAY SET NOM_GATEWAY = 'GWx' WHERE NUM_GATEWAY = 1")
+        db.execute("UPDATE CAPTEUR SET NUM_GATEWAY = 2 WHERE NUM_CAPTEUR = 3")
+        db.execute("UPDATE GATEWAY SET NUM_SERVEUR = 3 WHERE NUM_GATEWAY = 2")
+    assert count(db, "INVENTAIRE", "NOM_GATEWAY = 'GWx'") == 2
+    assert count(db, "INVENTAIRE", "NUM_GATEWAY = 2 AND ADRESSE_IP = '10.0.0.3'") == 4
+    assert TP2.check_inventaire(db.cursor()) == (0, 0)
+    TP2.delete_many(db, "SALLE", [1])
+    assert count(db, "INVENTAIRE") == 18 and TP2.check_inventaire(db.cursor()) == (0, 0)
+
+
+# ------------------ Export ------------------
+
+def test_export_aller_retour(db, path, tmp_path):
+    sql = "SELECT NUM_CAPTEUR, NOM_CAPTEUR, NOM_TYPE, UNITE FROM INVENTAIRE ORDER BY NUM_CAPTEUR"
+    expected = db.execute(sql).fetchall()
+    csv_gz, jsonl = str(tmp_path / "inv.csv.gz"), str(tmp_path / "inv.jsonl")
+    done = TP2.export_many(path, [(sql, csv_gz), (sql, jsonl)], batch=5)
+    assert {k: n for k, (n, _) in done.items()} == {csv_gz: 24, jsonl: 24}
+    with gzip.open(csv_gz, "rt", encoding="utf-8", newline="") as f:
+        head, *rows = list(csv.reader(f))
+    assert head == ["NUM_CAPTEUR", "NOM_CAPTEUR", "NOM_TYPE", "UNITE"]
+    assert rows == [[str(v) for v in r] for r in expected]
+    with open(jsonl, encoding="utf-8") as f:
+        assert [tuple(json.loads(l).values()) for l in f] == expected
+    assert not [p for p in os.listdir(tmp_path) if p.endswith(".part")]
+
+
+def test_export_echec_sans_fichier(db, tmp_path):
+    out = str(tmp_path / "x.csv")
+    with pytest.raises(sqlite3.OperationalError):
+        TP2.export_query(db.cursor(), "SELECT 1 UNION ALL SELECT abs(-9223372036854775808)", out, batch=1)
+    assert os.listdir(tmp_path) == ["iot.db"]
+
+
+# ------------------ Shards ------------------
+
+@pytest.fixture
+def router(path, tmp_path):
+    cat = str(tmp_path / "cat.db")
+    TP2.create_shards(path, cat, 2)
+    db = TP2.connect(cat)
+    r = TP2.ShardRouter(db, cat)
+    yield r
+    r.close()
+    db.close()
+
+
+def test_shards_lectures_fusionnees(router, db):
+    per, total = router.counts()
+    assert total["BATIMENT"] == 2 and total["CAPTEUR"] == 24
+    assert sorted(c["CAPTEUR"] for c in per.values()) == [12, 12]
+    headers, rows, last = router.page("capteurs", limit=30)
+    _, expected, _, _ = TP2.keyset_page(db.cursor(), "capteurs", limit=30)
+    assert rows == expected and last is None
+
+
+def test_shards_ecritures_routees(router):
+    b = router.owner("BATIMENT", 1)
+    assert router.owner("BATIMENT", 2) != b
+    nid = router.insert("SALLE", {"NUM_BATIMENT": 1, "NOM_SALLE": "Neuve"})
+    assert nid == 5 and router.owner("SALLE", nid) == b
+    router.insert("TYPE", {"NOM_TYPE": "Pression", "UNITE": "mBar"})
+    assert all(router.shard(k).execute("SELECT 1 FROM TYPE WHERE NUM_TYPE = 3").fetchone() for k in router.files)
+    with pytest.raises(ValueError, match="déplacer d'abord"):
+        router.update("GATEWAY", 1, {"NUM_SALLE": 3})       # salle 3 : bâtiment 2, autre shard
+
+
+def test_shards_capteur_suit_sa_gateway(router):
+    with pytest.raises(ValueError, match="déplacer d'abord"):   # gateway 5 : salle 3, autre shard
+        router.insert("CAPTEUR", {"NUM_SALLE": 1, "NUM_GATEWAY": 5, "NUM_TYPE": 1,
+                                  "NUM_RESEAU": 1, "NOM_CAPTEUR": "Orphelin"})
+    with pytest.raises(ValueError, match="déplacer d'abord"):
+        router.update("CAPTEUR", 1, {"NUM_GATEWAY": 5})
+    router.update("CAPTEUR", 1, {"NUM_GATEWAY": 2})
+    assert router.owner("CAPTEUR", 1) == router.owner("GATEWAY", 2)
+
+
+def test_shards_deplacement(router):
+    source = router.owner("BATIMENT", 1)
+    target = 1 - source
+    assert router.move(1, target)["CAPTEUR"] == 12
+    assert router.owner("BATIMENT", 1) == target
+    assert router.shard(source).execute("SELECT count(*) FROM CAPTEUR").fetchone()[0] == 0
+    per, total = router.counts()
+    assert per[target]["CAPTEUR"] == 24 and total["SALLE"] == 4
+    assert not router.move(1, target)
+
+
+def test_shards_deplacement_interrompu_apres_bascule(router, monkeypatch):
+    source = router.owner("BATIMENT", 1)
+    target = 1 - source
+    real, calls = TP2.delete_subtree, []
+
+    def crash(cur, batiments):
+        calls.append(cur.connection)
+        if len(calls) == 2:                   # suppression à la source
+            raise KeyboardInterrupt
+        return real(cur, batiments)
+    monkeypatch.setattr(TP2, "delete_subtree", crash)
+    with pytest.raises(KeyboardInterrupt):
+        router.move(1, target)
+    monkeypatch.undo()
+    assert router.owner("BATIMENT", 1) == target
+    assert router.counts()[1]["CAPTEUR"] == 36                 # sous-arbre en double
+    assert router.move(1, target) == {}
+    per, total = router.counts()
+    assert total["CAPTEUR"] == 24 and per[source]["BATIMENT"] == 0
+
+
+def test_shards_source_non_modifiee(path, tmp_path):
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=DELETE")
+    db.close()
+    before = os.path.getmtime(path)
+    counts = TP2.create_shards(path, str(tmp_path / "cat.db"), 2)
+    assert sum(counts.values()) == 24
+    db = sqlite3.connect(path)
+    assert db.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    db.close()
+    assert not os.path.exists(path + "-wal") and os.path.getmtime(path) == before
+
+
+# ------------------ Capacité ------------------
+
+def test_capacite_charges_et_simulations(db):
+    pytest.importorskip("numpy")
+    m = TP2.CapacityModel(db.cursor())
+    load = m.loads()
+    expected = dict(db.execute("""SELECT G.NUM_SERVEUR, sum(R.DEBIT_RESEAU) FROM CAPTEUR C
+        JOIN GATEWAY G USING (NUM_GATEWAY) JOIN RESEAU R USING (NUM_RESEAU) GROUP BY 1"""))
+    assert {int(i): float(v) for i, v in zip(m.srv_ids, load["srv_load"])} == expected
+    assert list(load["gw_n"]) == [3] * 8
+    cap_gw, n = m.move(2, 1, 2)
+    assert n == 2 and list(m.loads(cap_gw=cap_gw)["gw_n"][:2]) == [1, 5]
+    keep, gw_srv, gws, caps = m.remove_server(1)
+    counts = TP2.delete_many(db, "SERVEUR", [1])
+    assert (gws, caps) == (counts["GATEWAY"], counts["CAPTEUR"])
+    assert m.loads(keep=keep, gw_srv=gw_srv)["srv_n"].sum() == count(db, "CAPTEUR")
+
+
+# ------------------ Console en mémoire ------------------
+
+def snapshot_edit(snap):
+    with snap.mem:
+        snap.mem.execute("INSERT INTO BATIMENT(NOM_BATIMENT) VALUES ('Mémoire')")
+        snap.mem.execute("UPDATE CAPTEUR SET NOM_CAPTEUR = ? WHERE NUM_CAPTEUR = 1", ("xxx",))
+
+
+def test_memoire_ecriture_sur_disque(path):
+    disk = TP2.connect(path)
+    snap = TP2.MemorySnapshot(disk, path)
+    snapshot_edit(snap)
+    assert count(disk, "BATIMENT") == 2
+    assert snap.write_back() > 0
+    assert count(disk, "BATIMENT", "NOM_BATIMENT = 'Mémoire'") == 1
+    snap.close()
+    disk.close()
+    assert not os.path.exists(path + TP2.SNAPSHOT_JOURNAL)
+
+
+def test_memoire_journal_rejoue_apres_arret(path):
+    disk = TP2.connect(path)
+    snap = TP2.MemorySnapshot(disk, path)
+    snapshot_edit(snap)
+    snap.log.close()                          # arrêt brutal : pas d'écriture sur disque
+    snap.mem.close()
+    with open(path + TP2.SNAPSHOT_JOURNAL, "a", encoding="utf-8") as f:
+        f.write('{"sql": "tronqu')             # dernière ligne à moitié écrite
+    TP2.recover_journal(disk, path)
+    assert count(disk, "BATIMENT", "NOM_BATIMENT = 'Mémoire'") == 1
+    assert count(disk, "CAPTEUR", "NOM_CAPTEUR = 'xxx'") == 1
+    assert not os.path.exists(path + TP2.SNAPSHOT_JOURNAL)
+    disk.close()
+
+
+def test_memoire_journal_suspect_non_rejoue(path):
+    disk = TP2.connect(path)
+    snap = TP2.MemorySnapshot(disk, path)
+    snapshot_edit(snap)
+    snap._log({"backup": 0})                  # interrompu pendant la recopie
+    snap.log.close()
+    snap.mem.close()
+    TP2.recover_journal(disk, path)
+    assert count(disk, "BATIMENT") == 2
+    assert os.path.exists(path + TP2.SNAPSHOT_JOURNAL + ".suspect")
+    disk.close()
+
+
+def test_memoire_journal_rejoue_apres_migration(tmp_path):
+    neuve = str(tmp_path / "neuve.db")
+    sqlite3.connect(neuve).close()                 # schéma pas encore créé
+    with open(neuve + TP2.SNAPSHOT_JOURNAL, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"sql": "INSERT INTO BATIMENT(NOM_BATIMENT) VALUES (?)", "params": ["J"]}) + "\n")
+    TP2.main(["--db", neuve, "inventaire"])
+    with sqlite3.connect(neuve) as db:
+        assert count(db, "BATIMENT", "NOM_BATIMENT = 'J'") == 1
+    assert not os.path.exists(neuve + TP2.SNAPSHOT_JOURNAL + ".suspect")
+
+
+# ------------------ Journal des changements ------------------
+
+def test_cdc_update_colonnes_modifiees(db):
+    cur = db.cursor()
+    since = TP2.last_change(cur)
+    with db:
+        cur.execute("UPDATE CAPTEUR SET NOM_CAPTEUR = 'X' WHERE NUM_CAPTEUR = 1")
+        cur.execute("UPDATE CAPTEUR SET NOM_CAPTEUR = NOM_CAPTEUR WHERE NUM_CAPTEUR = 2")   # sans effet
+        cur.execute("DELETE FROM APP_SRV_CONNEXION WHERE NUM_APPLICATION = 2 AND NUM_SERVEUR = 3")
+    changes = [c for batch in TP2.tail_changes(cur, since) for c in batch]
+    assert [(c["table"], c["op"], c["cle"], c["colonnes"]) for c in changes] == [
+        ("CAPTEUR", "U", {"NUM_CAPTEUR": 1}, {"NOM_CAPTEUR": "X"}),
+        ("APP_SRV_CONNEXION", "D", {"NUM_APPLICATION": 2, "NUM_SERVEUR": 3}, None)]
+
+
+def test_cdc_compaction_et_trou(db):
+    cur = db.cursor()
+    with db:
+        for i in range(TP2.CDC_SEGMENT // 24 + 2):
+            cur.execute("UPDATE CAPTEUR SET NOM_CAPTEUR = ?", (f"n{i}",))
+        TP2.ack_changes(cur, "test", TP2.last_change(cur))
+        assert TP2.compact_changes(cur) > 0
+    with pytest.raises(LookupError):
+        next(TP2.tail_changes(cur, 0))
+    assert list(TP2.tail_changes(cur, TP2.last_change(cur))) == []
+
+
+def test_topologie_rattrape_les_autres_connexions(db, path):
+    cur = db.cursor()
+    g = TP2.topology_cache.get(cur)
+    other = sqlite3.connect(path)
+    with other:
+        other.execute("UPDATE CAPTEUR SET NOM_CAPTEUR = 'renommé' WHERE NUM_CAPTEUR = 1")
+    assert TP2.topology_cache.get(cur) is g                   # patché en place
+    assert g.cap_name[g.cap_idx[1]] == "renommé"
+    with other:
+        other.execute("DELETE FROM CAPTEUR WHERE NUM_CAPTEUR = 1")
+    other.close()
+    g2 = TP2.topology_cache.get(cur)
+    assert g2 is not g and 1 not in g2.cap_idx
+
+
+# ------------------ Intégrité ------------------
+
+def test_integrite_apres_cascades(db):
+    with db:
+        TP2.store_readings(db.cursor(), [(1, T0, 1.0), (7, T0, 2.0)])
+    TP2.delete_many(db, "BATIMENT", [1])
+    TP2.delete_many(db, "SERVEUR", [2])
+    assert not any(r["lignes"] for r in TP2.check_integrity(db.cursor(), samples=0))
+
+
+def test_integrite_reparation(db):
+    with db:
+        db.execute("UPDATE CAPTEUR SET NUM_GATEWAY = 999 WHERE NUM_CAPTEUR = 1")
+        db.execute("UPDATE CAPTEUR SET NUM_SALLE = 4 WHERE NUM_CAPTEUR = 2")
+    bad = lambda: sum(r["lignes"] for r in TP2.check_integrity(db.cursor(), samples=0))
+    assert bad() >= 2
+    TP2.repair_integrity(db, dry_run=True)
+    assert bad() >= 2
+    counts = TP2.repair_integrity(db)
+    assert counts["CAPTEUR"] == 2 and bad() == 0
+    assert count(db, "CAPTEUR", "NUM_CAPTEUR = 1") == 0
+    assert db.execute("SELECT NUM_SALLE FROM CAPTEUR WHERE NUM_CAPTEUR = 2").fetchone()[0] == 1
+
+
+# ------------------ Navigateur de topologie ------------------
+
+def test_topologie_page_repliee(db):
+    rows, last = TP2.topo_page(db.cursor(), "SERVEUR")
+    assert [r[:2] for r in rows] == [(1, "10.0.0.1"), (2, "10.0.0.2"), (3, "10.0.0.3")]
+    assert [r[2:] for r in rows] == [(3, 9), (3, 9), (2, 6)]               # gateways, capteurs
+    rows, _ = TP2.topo_page(db.cursor(), "GATEWAY", ("SALLE", 2), limit=1)
+    assert [r[:2] for r in rows] == [(3, "GW3")] and rows[0][2] == 3
+
+
+def test_topologie_sous_arbre_en_flux(db):
+    walk = list(TP2.topo_walk(db.cursor(), "SALLE", ("BATIMENT", 1), level=1))
+    assert [(lvl, k) for lvl, k, _ in walk[:4]] == [(1, "SALLE"), (2, "GATEWAY"), (3, "CAPTEUR"), (3, "CAPTEUR")]
+    kinds = [k for _, k, _ in walk]
+    assert (kinds.count("SALLE"), kinds.count("GATEWAY"), kinds.count("CAPTEUR")) == (2, 4, 12)
+
+
+def test_topologie_impact(db):
+    g = TP2.topology_cache.get(db.cursor())
+    assert sorted(g.applications_of_server(2)) == [1, 2] and g.applications_of_server(99) == []
+    expected = {r[0] for r in db.execute("""SELECT C.NUM_CAPTEUR FROM APP_SRV_CONNEXION L
+        JOIN GATEWAY G USING (NUM_SERVEUR) JOIN CAPTEUR C USING (NUM_GATEWAY) WHERE L.NUM_APPLICATION = 1""")}
+    assert sorted(g.capteurs_of_application(1)) == sorted(expected)
+    out = io.StringIO()
+    with TP2.scripted_input([], out):
+        TP2.show_impact(db.cursor(), "GATEWAY", 2)
+    assert "Capteurs (3) : Cap4, Cap5, Cap6" in out.getvalue()
+    assert "Applications (2) : App 1, App 2" in out.getvalue()
+
+
+# ------------------ Scripts d'opérations ------------------
+
+def test_script_noms_insérés_plus_haut(db):
+    ops = [{"op": "insert", "table": "BATIMENT", "NOM_BATIMENT": "Neuf"},
+           {"op": "insert", "table": "SALLE", "NOM_SALLE": "N1", "BATIMENT": "Neuf"},
+           {"op": "update", "table": "GATEWAY", "NUM_GATEWAY": 1, "SALLE": "N1"},
+           {"op": "delete", "table": "CAPTEUR", "NUM_CAPTEUR": 24}]
+    script = TP2.ScriptPlan(db)
+    plan = script.compile(ops)
+    assert script.errors == []
+    counts = TP2.run_plan(db, plan)
+    assert counts[("delete", "CAPTEUR")] == 1
+    assert db.execute("""SELECT S.NOM_SALLE FROM GATEWAY G JOIN SALLE S USING (NUM_SALLE)
+                         WHERE G.NUM_GATEWAY = 1""").fetchone()[0] == "N1"
+
+
+def test_script_invalide_le_cache(db):
+    TP2.topology_cache.get(db.cursor())
+    ops = [{"op": "update", "table": "CAPTEUR", "NUM_CAPTEUR": 1, "NUM_GATEWAY": 2}]
+    TP2.run_plan(db, TP2.ScriptPlan(db).compile(ops), dry_run=True)
+    assert TP2.topology_cache.graph is not None
+    TP2.run_plan(db, TP2.ScriptPlan(db).compile(ops))
+    assert TP2.topology_cache.graph is None
+
+
+def test_script_erreurs_rien_ecrit(db):
+    ops = [{"op": "insert", "table": "BATIMENT", "NOM_BATIMENT": "Neuf"},
+           {"op": "update", "table": "CAPTEUR", "CAPTEUR": "Inconnu", "NOM_CAPTEUR": "x"},
+           {"op": "upsert", "table": "SALLE"}]
+    script = TP2.ScriptPlan(db)
+    assert script.compile(ops) == []
+    assert [n for n, _ in script.errors] == [2, 3]
+    assert count(db, "BATIMENT") == 2
+
+
+def test_script_annule_la_transaction(db):
+    ops = [{"op": "insert", "table": "BATIMENT", "NOM_BATIMENT": "A"},
+           {"op": "insert", "table": "APP_SRV_CONNEXION", "NUM_APPLICATION": 1, "NUM_SERVEUR": 1},
+           {"op": "insert", "table": "APP_SRV_CONNEXION", "NUM_APPLICATION": 1, "NUM_SERVEUR": 1}]
+    db.execute("DELETE FROM APP_SRV_CONNEXION WHERE NUM_APPLICATION = 1 AND NUM_SERVEUR = 1")
+    db.commit()
+    plan = TP2.ScriptPlan(db).compile(ops)
+    with pytest.raises(ValueError, match="ligne"):
+        TP2.run_plan(db, plan)
+    assert count(db, "BATIMENT") == 2 and not db.in_transaction
+    with pytest.raises(ValueError, match="2 opération"):
+        TP2.run_plan(db, TP2.ScriptPlan(db).compile(ops), chunk=1)
+    assert count(db, "BATIMENT") == 3        # tranches précédant l'erreur validées
+
+
+def test_script_simulation(db):
+    before = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'BATIMENT'").fetchone()
+    script = TP2.ScriptPlan(db, dry_run=True)
+    TP2.run_plan(db, script.compile([{"op": "insert", "table": "BATIMENT", "NOM_BATIMENT": "A"}]),
+                 dry_run=True)
+    assert count(db, "BATIMENT") == 2
+    assert db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'BATIMENT'").fetchone() == before